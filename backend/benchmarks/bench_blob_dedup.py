@@ -0,0 +1,107 @@
+"""Measure disk saved by the content-addressed blob store.
+
+Builds a seeded upload history for one school: every team uploads the
+competition brief and the slide template it was handed, a share of teams
+re-upload the same stock images and dataset, and each team adds its own
+drafts (some uploaded twice by different members). The uploads are written
+once in the old one-file-per-upload layout and once through the blob store,
+and the bytes actually on disk are compared. Hashing throughput is reported
+as well, since every upload now pays for SHA-256.
+
+Run from backend/:  PYTHONPATH=src python benchmarks/bench_blob_dedup.py
+"""
+
+import os
+import random
+import tempfile
+import time
+
+from services import blob_service
+from storage import LocalStorage
+
+SEED = 38
+COMPETITIONS = 4
+TEAMS_PER_COMPETITION = 12
+CHUNK = 64 * 1024
+
+
+def _content(rng, size):
+    return rng.randbytes(size)
+
+
+def make_uploads(rng):
+    """List of (team, filename, bytes) in upload order."""
+    shared_images = [_content(rng, rng.randint(200_000, 900_000)) for _ in range(6)]
+    dataset = _content(rng, 3_000_000)
+    uploads = []
+    for c in range(COMPETITIONS):
+        brief = _content(rng, rng.randint(400_000, 1_200_000))
+        template = _content(rng, rng.randint(1_000_000, 2_500_000))
+        for t in range(TEAMS_PER_COMPETITION):
+            team = f"team-{c}-{t}"
+            uploads.append((team, "brief.pdf", brief))
+            uploads.append((team, "template.pptx", template))
+            for image in rng.sample(shared_images, rng.randint(0, 3)):
+                uploads.append((team, "stock.png", image))
+            if rng.random() < 0.3:
+                uploads.append((team, "dataset.csv", dataset))
+            for d in range(rng.randint(2, 6)):
+                draft = _content(rng, rng.randint(50_000, 1_500_000))
+                uploads.append((team, f"draft-{d}.docx", draft))
+                if rng.random() < 0.25:
+                    # A teammate uploads the same file again
+                    uploads.append((team, f"draft-{d} (1).docx", draft))
+    return uploads
+
+
+def _chunks(data):
+    for start in range(0, len(data), CHUNK):
+        yield data[start:start + CHUNK]
+
+
+def disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def main():
+    uploads = make_uploads(random.Random(SEED))
+    logical = sum(len(data) for _, _, data in uploads)
+
+    with tempfile.TemporaryDirectory() as legacy_dir, tempfile.TemporaryDirectory() as blob_dir:
+        started = time.perf_counter()
+        for i, (team, filename, data) in enumerate(uploads):
+            os.makedirs(os.path.join(legacy_dir, team), exist_ok=True)
+            with open(os.path.join(legacy_dir, team, f"{i}_{filename}"), "wb") as f:
+                for chunk in _chunks(data):
+                    f.write(chunk)
+        legacy_seconds = time.perf_counter() - started
+
+        store = LocalStorage(blob_dir)
+        temp_dir = os.path.join(blob_dir, "blobs", "tmp")
+        started = time.perf_counter()
+        placed = 0
+        for _, _, data in uploads:
+            sha256, _, temp_path = blob_service.write_chunks(_chunks(data), temp_dir)
+            # Reference counting is a Mongo round trip and not measured here
+            placed += blob_service.place(sha256, temp_path, store)
+        blob_seconds = time.perf_counter() - started
+
+        legacy_bytes = disk_usage(legacy_dir)
+        blob_bytes = disk_usage(blob_dir)
+
+    saved = legacy_bytes - blob_bytes
+    mib = 1024 * 1024
+    print(f"{len(uploads)} uploads, {logical / mib:,.1f} MiB uploaded")
+    print(f"  per-upload files: {legacy_bytes / mib:9,.1f} MiB on disk  {legacy_seconds * 1000:8.1f} ms")
+    print(f"  blob store:       {blob_bytes / mib:9,.1f} MiB on disk  {blob_seconds * 1000:8.1f} ms"
+          f"  ({placed} distinct blobs)")
+    print(f"  saved {saved / mib:,.1f} MiB ({100 * saved / legacy_bytes:.1f}%)"
+          f", hashing at {logical / mib / blob_seconds:,.0f} MiB/s including writes")
+
+
+if __name__ == "__main__":
+    main()
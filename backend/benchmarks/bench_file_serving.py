@@ -0,0 +1,132 @@
+"""Throughput of the file download paths.
+
+1. ASGI level: how long the app spends handing a large file to the server,
+   and in how many messages, for Starlette's stock ``FileResponse`` (64 KiB
+   reads), ``DirectFileResponse`` without pathsend (1 MiB reads) and with
+   ``http.response.pathsend``, where the app only sends the path.
+2. Kernel level: what the server then does with the bytes, copying them
+   through user space (read + sendall, what uvicorn does with body chunks)
+   versus ``os.sendfile`` (what pathsend servers and nginx do), measured
+   over a local socket drained by another thread.
+
+Run from backend/:  PYTHONPATH=src python benchmarks/bench_file_serving.py
+"""
+
+import asyncio
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from starlette.responses import FileResponse
+
+from file_serving import DirectFileResponse
+
+FILE_MB = 256
+RUNS = 3
+MiB = 1024 * 1024
+
+
+def make_file(directory):
+    path = os.path.join(directory, "upload.bin")
+    block = os.urandom(MiB)
+    with open(path, "wb") as f:
+        for _ in range(FILE_MB):
+            f.write(block)
+    return path
+
+
+async def _serve(response, extensions):
+    scope = {
+        "type": "http", "method": "GET", "path": "/", "headers": [],
+        "extensions": extensions, "asgi": {"version": "3.0", "spec_version": "2.4"},
+    }
+    messages = 0
+    body = 0
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal messages, body
+        messages += 1
+        body += len(message.get("body", b""))
+
+    await response(scope, receive, send)
+    return messages, body
+
+
+def bench_asgi(path):
+    cases = [
+        ("FileResponse, 64 KiB reads", lambda: FileResponse(path), {}),
+        ("DirectFileResponse, 1 MiB reads", lambda: DirectFileResponse(path), {}),
+        ("DirectFileResponse, pathsend", lambda: DirectFileResponse(path), {"http.response.pathsend": {}}),
+    ]
+    print(f"\nASGI app, {FILE_MB} MiB file (best of {RUNS}):")
+    for label, make, extensions in cases:
+        best = None
+        for _ in range(RUNS):
+            started = time.perf_counter()
+            messages, body = asyncio.run(_serve(make(), extensions))
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        rate = f"{FILE_MB / best:8,.0f} MiB/s" if body else "   bytes sent by the server"
+        print(f"  {label:34} {best * 1000:8.1f} ms  {messages:5} messages  {rate}")
+
+
+def _drain(sock):
+    while sock.recv(4 * MiB):
+        pass
+
+
+def _socket_copy(path, send):
+    server, client = socket.socketpair()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * MiB)
+    reader = threading.Thread(target=_drain, args=(client,))
+    reader.start()
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        send(f, server)
+    server.shutdown(socket.SHUT_WR)
+    reader.join()
+    elapsed = time.perf_counter() - started
+    server.close()
+    client.close()
+    return elapsed
+
+
+def _read_and_send(chunk_size):
+    def send(f, sock):
+        while chunk := f.read(chunk_size):
+            sock.sendall(chunk)
+    return send
+
+
+def _sendfile(f, sock):
+    offset, size = 0, os.fstat(f.fileno()).st_size
+    while offset < size:
+        offset += os.sendfile(sock.fileno(), f.fileno(), offset, size - offset)
+
+
+def bench_socket(path):
+    cases = [
+        ("read + sendall, 64 KiB", _read_and_send(64 * 1024)),
+        ("read + sendall, 1 MiB", _read_and_send(MiB)),
+        ("os.sendfile (zero-copy)", _sendfile),
+    ]
+    print(f"\nserver side, {FILE_MB} MiB over a local socket (best of {RUNS}):")
+    for label, send in cases:
+        best = min(_socket_copy(path, send) for _ in range(RUNS))
+        print(f"  {label:34} {best * 1000:8.1f} ms  {FILE_MB / best:8,.0f} MiB/s")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = make_file(directory)
+        bench_asgi(path)
+        bench_socket(path)
+
+
+if __name__ == "__main__":
+    main()
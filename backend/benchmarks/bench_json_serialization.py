@@ -0,0 +1,84 @@
+"""Compare response serialization for a team with 10,000 chat messages.
+
+Run from backend/:  PYTHONPATH=src python benchmarks/bench_json_serialization.py
+"""
+
+import timeit
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from responses import FastJSONResponse, orjson
+
+MESSAGES = 10_000
+FILES = 200
+ROUNDS = 10
+
+
+def make_team():
+    now = datetime.now(timezone.utc)
+    members = [
+        {"user_id": str(ObjectId()), "name": f"Member {i}", "email": f"m{i}@example.com"}
+        for i in range(5)
+    ]
+    return {
+        "id": str(ObjectId()),
+        "name": "Benchmark Team",
+        "competition_id": str(ObjectId()),
+        "members": members,
+        "chat": [
+            {
+                "_id": ObjectId(),
+                "user_id": members[i % 5]["user_id"],
+                "user_name": members[i % 5]["name"],
+                "message": f"Message number {i} with some ordinary chat text in it",
+                "created_at": now,
+            }
+            for i in range(MESSAGES)
+        ],
+        "files": [
+            {
+                "_id": ObjectId(),
+                "user_id": members[i % 5]["user_id"],
+                "user_name": members[i % 5]["name"],
+                "filename": f"file-{i}.pdf",
+                "url": f"/student/files/{i}",
+                "size": 1024 * i,
+                "created_at": now,
+            }
+            for i in range(FILES)
+        ],
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def default_path(team):
+    # What FastAPI does for a handler returning a dict without response_model
+    return JSONResponse(jsonable_encoder(team, custom_encoder={ObjectId: str})).body
+
+
+def fast_path(team):
+    return FastJSONResponse(team).body
+
+
+def main():
+    team = make_team()
+    size = len(fast_path(team))
+    print(f"team with {MESSAGES} messages, {FILES} files -> {size / 1024:.0f} KiB JSON")
+    print(f"orjson available: {orjson is not None}")
+
+    results = {}
+    for name, func in (("jsonable_encoder + JSONResponse", default_path), ("FastJSONResponse", fast_path)):
+        best = min(timeit.repeat(lambda: func(team), number=1, repeat=ROUNDS))
+        results[name] = best
+        print(f"{name:<34} {best * 1000:8.2f} ms")
+
+    baseline, fast = results.values()
+    print(f"speedup: {baseline / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
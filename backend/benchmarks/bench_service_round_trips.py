@@ -0,0 +1,93 @@
+"""Count MongoDB round trips per write in the services layer.
+
+Needs a running MongoDB (MONGO_URI, default mongodb://localhost:27017).
+Run from backend/:  PYTHONPATH=src python benchmarks/bench_service_round_trips.py
+
+The "before" column replays the previous find_one -> update_one -> find_one
+sequence against the same data so both numbers come from the same server.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+
+from pymongo import MongoClient, monitoring
+
+os.environ.setdefault("TEST_MODE", "true")
+
+from models import ChatMessage, PydanticObjectId  # noqa: E402
+from services import team_service  # noqa: E402
+
+WRITES = 200
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in ("hello", "isMaster", "ping", "endSessions"):
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def legacy_add_chat_message(collection, team_id, message):
+    if not collection.find_one({"_id": team_id}):
+        return None
+    collection.update_one({"_id": team_id}, {"$push": {"chat": message.model_dump(by_alias=True)}})
+    return collection.find_one({"_id": team_id})
+
+
+def measure(counter, write):
+    counter.count = 0
+    started = time.perf_counter()
+    for _ in range(WRITES):
+        write()
+    elapsed = time.perf_counter() - started
+    return counter.count / WRITES, elapsed / WRITES * 1000
+
+
+def main():
+    counter = CommandCounter()
+    client = MongoClient(
+        os.getenv("MONGO_URI", "mongodb://localhost:27017"), event_listeners=[counter]
+    )
+    collection = client[os.getenv("MONGO_TEST_DATABASE", "projektor_test")]["bench_teams"]
+    collection.drop()
+    team_service._teams_collection = collection
+
+    now = datetime.now(timezone.utc)
+    team_id = collection.insert_one(
+        {
+            "name": "Bench",
+            "competition_id": str(PydanticObjectId()),
+            "members": [],
+            "chat": [],
+            "files": [],
+            "created_at": now,
+            "updated_at": now,
+        }
+    ).inserted_id
+
+    def message():
+        return ChatMessage(user_id=PydanticObjectId(), user_name="Bench", message="hello")
+
+    before = measure(counter, lambda: legacy_add_chat_message(collection, team_id, message()))
+    after = measure(counter, lambda: team_service.add_chat_message(team_id, message()))
+    update = measure(counter, lambda: team_service.update_team(team_id, {"url": "https://example.com"}))
+
+    print(f"{'operation':<32}{'commands/write':>16}{'ms/write':>12}")
+    print(f"{'add_chat_message (before)':<32}{before[0]:>16.2f}{before[1]:>12.2f}")
+    print(f"{'add_chat_message (after)':<32}{after[0]:>16.2f}{after[1]:>12.2f}")
+    print(f"{'update_team (after)':<32}{update[0]:>16.2f}{update[1]:>12.2f}")
+
+    collection.drop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Body, HTTPException, Header, Depends
+from fastapi import APIRouter, Body, HTTPException, Header, Depends, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import List, Literal, Optional
 import hashlib
 import secrets
 import logging
@@ -8,6 +9,16 @@ from datetime import datetime, timezone
 from database import db
 from models import User, School, PydanticObjectId, RegistrationToken
 from api.auth import get_current_user, hash_password
+from archives import stream_zip
+from file_serving import content_disposition
+from services import (
+    cascade_service,
+    export_service,
+    gc_service,
+    job_service,
+    quota_service,
+    user_service,
+)
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -260,7 +271,6 @@ def delete_school(
     school_id: PydanticObjectId, current_user: User = Depends(verify_admin_token)
 ):
     schools_collection = db.get_collection("schools")
-    users_collection = db.get_collection("users")
 
     school_data = schools_collection.find_one({"_id": school_id})
     if not school_data:
@@ -268,17 +278,19 @@ def delete_school(
 
     school = School(**school_data)
 
-    # Delete associated headteacher
-    if school.headteacher_id:
-        users_collection.delete_one({"_id": school.headteacher_id})
-
-    # Delete school
-    result = schools_collection.delete_one({"_id": school_id})
+    # Competitions, teams, tokens and the headteacher go in the background
+    deletion = cascade_service.start(
+        "school",
+        school_id,
+        lambda: schools_collection.delete_one({"_id": school_id}).deleted_count,
+        current_user.id,
+        headteacher_id=str(school.headteacher_id) if school.headteacher_id else None,
+    )
 
-    if result.deleted_count == 0:
+    if deletion is None:
         raise HTTPException(status_code=404, detail="School not found")
 
-    return {"message": "School deleted successfully"}
+    return {"message": "School deleted successfully", "deletion_id": str(deletion["_id"])}
 
 
 # Users
@@ -357,20 +369,26 @@ def delete_user(
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Delete using the same ID format that was found
-    result = users_collection.delete_one({"_id": user_data["_id"]})
+    # Delete using the same ID format that was found; what the user left in
+    # teams is erased in the background
+    result = user_service.delete_user(user_data["_id"], current_user.id)
 
-    if result.deleted_count == 0:
+    if result["deleted_count"] == 0:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return {"message": "User deleted successfully"}
+    return {"message": "User deleted successfully", "deletion_id": result["deletion_id"]}
 
 
 @router.get("/users/{user_id}/export")
 def export_user_data(
     user_id: str,
+    format: Literal["ndjson", "zip"] = "ndjson",
     current_user: User = Depends(verify_admin_token),  # Accept as string
 ):
+    """Everything stored about a user, streamed while it is read.
+
+    NDJSON by default; ``format=zip`` adds the content of their uploads.
+    """
     users_collection = db.get_collection("users")
 
     # Try to find user by string ID first, then by ObjectId
@@ -387,22 +405,27 @@ def export_user_data(
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Remove password hash before exporting
-    user_data.pop("password", None)
-
-    # In a real application, you might also fetch and include other user-related data
-    # (e.g., teams they are part of, messages, files)
-
-    return user_data
+    name = f"export-{user_data['_id']}"
+    if format == "zip":
+        return StreamingResponse(
+            stream_zip(export_service.zip_entries(user_data)),
+            media_type="application/zip",
+            headers={"Content-Disposition": content_disposition(f"{name}.zip")},
+        )
+    return StreamingResponse(
+        export_service.stream_ndjson(user_data),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": content_disposition(f"{name}.ndjson")},
+    )
 
 
 @router.delete("/users/{user_id}/data")
 def delete_user_data(
     user_id: str,
+    anonymize_messages: bool = False,
     current_user: User = Depends(verify_admin_token),  # Accept as string
 ):
     users_collection = db.get_collection("users")
-    teams_collection = db.get_collection("teams")
 
     # Try to find user by string ID first, then by ObjectId
     user_data = users_collection.find_one({"_id": user_id})
@@ -418,16 +441,71 @@ def delete_user_data(
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Delete user account using the actual ID from database
-    users_collection.delete_one({"_id": user_data["_id"]})
-
-    # Remove user from any teams they are a member of (try both string and ObjectId)
-    teams_collection.update_many(
-        {"members.user_id": str(user_data["_id"])},
-        {"$pull": {"members": {"user_id": str(user_data["_id"])}}},
+    # Delete user account using the actual ID from database; memberships,
+    # messages, files, join requests and tokens are erased in the background
+    result = user_service.delete_user(
+        user_data["_id"], current_user.id, anonymize_messages=anonymize_messages
     )
+    if result["deleted_count"] == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return {"message": "User data deleted successfully", "deletion_id": result["deletion_id"]}
+
+
+@router.get("/deletions/{deletion_id}")
+def get_deletion(deletion_id: str, current_user: User = Depends(verify_admin_token)):
+    """Progress of a cascading delete."""
+    deletion = cascade_service.get(deletion_id)
+    if deletion is None:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return deletion
+
+
+@router.post("/storage/reconcile", status_code=202)
+def reconcile_storage(
+    dry_run: bool = False,
+    current_user: User = Depends(verify_admin_token),
+):
+    """Recompute team and school storage counters from the files on disk.
+
+    Walks every team and upload, so a job worker runs it; poll the returned
+    run for its report.
+    """
+    run = quota_service.start_reconciliation(dry_run, current_user.id)
+    return {"id": str(run["_id"]), "status": run["status"], "dry_run": dry_run}
+
+
+@router.get("/storage/reconcile/{run_id}")
+def get_reconciliation(run_id: str, current_user: User = Depends(verify_admin_token)):
+    run = quota_service.get_reconciliation(run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Reconciliation not found")
+    return run
+
+
+@router.post("/storage/gc", status_code=202)
+def collect_garbage(
+    dry_run: bool = False,
+    limit: int = Query(gc_service.GC_ITEMS_PER_RUN or 1000, ge=1, le=100000),
+    current_user: User = Depends(verify_admin_token),
+):
+    """Reclaim storage no file record points at, continuing from the last run.
+
+    A job worker runs the collection; poll ``/jobs/{id}`` for its report.
+    """
+    job = gc_service.start_collection(limit, dry_run)
+    return {"id": str(job["_id"]), "status": job["status"], "dry_run": dry_run, "limit": limit}
+
+
+@router.get("/jobs")
+def job_queue_stats(current_user: User = Depends(verify_admin_token)):
+    """Queue depth and recent latency for each background job type."""
+    return job_service.stats()
 
-    # In a real application, you would also delete chat messages, files, join requests, etc.
-    # For now, we'll just delete the user and remove them from teams.
 
-    return {"message": "User data deleted successfully"}
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str, current_user: User = Depends(verify_admin_token)):
+    job = job_service.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
 from typing import List, Optional
 from services import competition_service
 from models import Competition, PydanticObjectId
 from datetime import datetime, timezone
 from pydantic import BaseModel
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, id_match, next_cursor, page_headers
+from fields import fields_query, model_response
 
 router = APIRouter()
 
@@ -44,15 +46,39 @@ def create_competition(competition_data: CompetitionCreateRequest = Body(...)):
 
 
 @router.get("/", response_model=List[Competition])
-def get_competitions():
-    return competition_service.get_competitions()
+def get_competitions(
+    response: Response,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    after: Optional[PydanticObjectId] = None,
+    fields: Optional[List[str]] = Depends(fields_query),
+    school_id: Optional[str] = None,
+    is_global: Optional[bool] = None,
+    created_by: Optional[str] = None,
+    include_total: bool = False,
+):
+    filters = {}
+    if school_id:
+        filters["school_id"] = id_match(school_id)
+    if is_global is not None:
+        filters["is_global"] = is_global
+    if created_by:
+        filters["created_by"] = id_match(created_by)
+
+    competitions = competition_service.get_competitions(filters, after, limit, fields)
+    total = competition_service.count_competitions(filters) if include_total else None
+    headers = page_headers(next_cursor(competitions, limit), total)
+    response.headers.update(headers)
+    return model_response(competitions, fields, headers)
 
 
 @router.get("/{competition_id}", response_model=Competition)
-def get_competition(competition_id: PydanticObjectId):
-    competition = competition_service.get_competition(competition_id)
+def get_competition(
+    competition_id: PydanticObjectId,
+    fields: Optional[List[str]] = Depends(fields_query),
+):
+    competition = competition_service.get_competition(competition_id, fields)
     if competition:
-        return competition
+        return model_response(competition, fields)
     raise HTTPException(status_code=404, detail="Competition not found")
 
 
@@ -75,5 +101,5 @@ def delete_competition(competition_id: PydanticObjectId):
     result = competition_service.delete_competition(competition_id)
     if result["deleted_count"] == 0:
         raise HTTPException(status_code=404, detail="Competition not found")
-    return {"message": "Competition deleted successfully"}
+    return {"message": "Competition deleted successfully", "deletion_id": result["deletion_id"]}
 
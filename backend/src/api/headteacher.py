@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Body, HTTPException, Header, UploadFile, File as FastAPIFile, Depends
+from fastapi import APIRouter, Body, HTTPException, Header, UploadFile, File as FastAPIFile, Depends, Request, Response
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 import jwt
@@ -7,6 +7,16 @@ import hashlib
 from datetime import datetime, timezone
 from bson import ObjectId
 from database import db
+from responses import FastJSONResponse
+from fields import fields_query, model_response, projection, trim
+from pagination import id_match
+from archives import folder_name, stream_zip, team_file_entries
+from file_serving import content_disposition
+from fastapi.responses import StreamingResponse
+from etags import STAMP_PROJECTION, check_not_modified, compute_etag, etag_headers, touch, with_stamps
+from services.competition_service import COMPETITION_REQUIRED_FIELDS
+from services import blob_service, cascade_service, competition_cache, competition_service, quota_service, team_service
+from services.team_service import TEAM_REQUIRED_FIELDS
 from api.auth import SECRET_KEY, ALGORITHM, get_current_user
 from models import User, School, Competition, Team, PydanticObjectId, RegistrationToken, ChatMessage, File
 
@@ -76,13 +86,14 @@ class CompetitionUpdateRequest(BaseModel):
     is_global: Optional[bool] = None
 
 @router.get("/competitions")
-def list_competitions(current_user: User = Depends(verify_headteacher_token)):
-    competitions_collection = db.get_collection("competitions")
-    
+def list_competitions(
+    current_user: User = Depends(verify_headteacher_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     user = get_user_with_school(current_user)
     
-    # Query with string school_id (matches what's in DB)
-    competitions_data = list(competitions_collection.find({"school_id": user["school_id"]}))
+    # Served from the per-process cache; trim() applies the field selection
+    competitions_data = competition_cache.school_competitions(user["school_id"])
     
     competitions = []
     for comp_data in competitions_data:
@@ -90,7 +101,7 @@ def list_competitions(current_user: User = Depends(verify_headteacher_token)):
         comp_data["id"] = str(comp_data.pop("_id"))
         competitions.append(comp_data)
     
-    return competitions
+    return FastJSONResponse(trim(competitions, fields))
 
 @router.post("/competitions")
 def create_competition(competition: CompetitionCreateRequest, current_user: User = Depends(verify_headteacher_token)):
@@ -114,8 +125,10 @@ def create_competition(competition: CompetitionCreateRequest, current_user: User
     comp_dict = comp_doc.dict(by_alias=True, exclude_unset=True)
     if '_id' in comp_dict:
         del comp_dict['_id']
+    comp_dict["team_count"] = 0
     
     result = competitions_collection.insert_one(comp_dict)
+    competition_cache.invalidate(school_id=user["school_id"])
     
     # Reload from database and return with id field
     created_comp = competitions_collection.find_one({"_id": result.inserted_id})
@@ -123,57 +136,83 @@ def create_competition(competition: CompetitionCreateRequest, current_user: User
     return created_comp
 
 @router.get("/competitions/{competition_id}", response_model=Competition)
-def get_competition(competition_id: PydanticObjectId, current_user: User = Depends(verify_headteacher_token)):
+def get_competition(
+    competition_id: PydanticObjectId,
+    current_user: User = Depends(verify_headteacher_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     competitions_collection = db.get_collection("competitions")
     
-    competition_data = competitions_collection.find_one({"_id": competition_id})
+    competition_data = competitions_collection.find_one(
+        {"_id": competition_id}, projection(fields, COMPETITION_REQUIRED_FIELDS)
+    )
     if not competition_data:
         raise HTTPException(status_code=404, detail="Competition not found")
     
-    return Competition(**competition_data)
+    return model_response(Competition(**competition_data), fields)
 
 @router.put("/competitions/{competition_id}", response_model=Competition)
 def update_competition(competition_id: PydanticObjectId, data: CompetitionUpdateRequest, current_user: User = Depends(verify_headteacher_token)):
     competitions_collection = db.get_collection("competitions")
     
     update_data = data.dict(exclude_unset=True)
-    update_data["updated_at"] = datetime.now(timezone.utc)
     
     result = competitions_collection.update_one(
         {"_id": competition_id},
-        {"$set": update_data}
+        touch({"$set": update_data})
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Competition not found")
     
     updated_competition_data = competitions_collection.find_one({"_id": competition_id})
+    competition_cache.invalidate(updated_competition_data.get("school_id"), competition_id)
     updated_competition_data["id"] = str(updated_competition_data.pop("_id"))
     return updated_competition_data
 
 @router.delete("/competitions/{competition_id}")
 def delete_competition(competition_id: PydanticObjectId, current_user: User = Depends(verify_headteacher_token)):
-    competitions_collection = db.get_collection("competitions")
-    
-    result = competitions_collection.delete_one({"_id": competition_id})
+    # Teams, their chat and files and join requests go in the background
+    result = competition_service.delete_competition(competition_id, requested_by=current_user.id)
     
-    if result.deleted_count == 0:
+    if result["deleted_count"] == 0:
         raise HTTPException(status_code=404, detail="Competition not found")
     
-    return {"message": "Competition deleted successfully"}
+    return {"message": "Competition deleted successfully", "deletion_id": result["deletion_id"]}
+
+@router.get("/deletions/{deletion_id}")
+def get_deletion(deletion_id: str, current_user: User = Depends(verify_headteacher_token)):
+    """Progress of a competition deletion this user started."""
+    deletion = cascade_service.get(deletion_id, requested_by=current_user.id)
+    if deletion is None:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return deletion
 
 # Moderation endpoints
 @router.get("/schools/{school_id}/teams", response_model=List[Team])
-def list_school_teams(school_id: PydanticObjectId, current_user: User = Depends(verify_headteacher_token)):
+def list_school_teams(
+    school_id: PydanticObjectId,
+    current_user: User = Depends(verify_headteacher_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     competitions_collection = db.get_collection("competitions")
     teams_collection = db.get_collection("teams")
     
     # Get all competitions for the school
-    competitions_data = list(competitions_collection.find({"school_id": school_id}))
+    competitions_data = list(competitions_collection.find({"school_id": school_id}, {"_id": 1}))
     competition_ids = [comp["_id"] for comp in competitions_data]
     
-    # Get all teams for those competitions
-    teams_data = list(teams_collection.find({"competition_id": {"$in": competition_ids}}))
+    # Get all teams for those competitions; chat and files are blanked below,
+    # so they are never loaded
+    team_fields = None
+    if fields is not None:
+        team_fields = [f for f in fields if f.split(".")[0] not in ("chat", "files")]
+    teams_data = list(
+        teams_collection.find(
+            {"competition_id": {"$in": competition_ids}},
+            projection(team_fields, TEAM_REQUIRED_FIELDS, default={"chat": 0, "files": 0}),
+        )
+    )
     
     teams = []
     for team_data in teams_data:
@@ -182,7 +221,7 @@ def list_school_teams(school_id: PydanticObjectId, current_user: User = Depends(
         team.files = [] # Don't expose files directly here
         teams.append(team)
     
-    return teams
+    return model_response(teams, fields)
 
 @router.get("/teams/{team_id}/chat", response_model=List[ChatMessage])
 def get_team_chat_for_moderation(team_id: PydanticObjectId, current_user: User = Depends(verify_headteacher_token)):
@@ -206,17 +245,55 @@ def get_team_files_for_moderation(team_id: PydanticObjectId, current_user: User
     team = Team(**team_data)
     return team.files
 
+@router.get("/teams/{team_id}/files/archive")
+def download_team_files_archive(team_id: str, current_user: User = Depends(verify_headteacher_token)):
+    """All files of a team as a ZIP, streamed while it is built"""
+    teams_collection = db.get_collection("teams")
+    
+    team_data = teams_collection.find_one({"_id": id_match(team_id)}, {"name": 1, "files": 1})
+    if not team_data:
+        raise HTTPException(status_code=404, detail="Team not found")
+    
+    return StreamingResponse(
+        stream_zip(team_file_entries([team_data])),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(f"{folder_name(team_data.get('name') or team_id)}.zip")},
+    )
+
+@router.get("/competitions/{competition_id}/files/archive")
+def download_competition_files_archive(competition_id: str, current_user: User = Depends(verify_headteacher_token)):
+    """Files of every team in a competition as one ZIP, a folder per team"""
+    competitions_collection = db.get_collection("competitions")
+    teams_collection = db.get_collection("teams")
+    
+    competition_data = competitions_collection.find_one({"_id": id_match(competition_id)}, {"name": 1})
+    if not competition_data:
+        raise HTTPException(status_code=404, detail="Competition not found")
+    
+    # The cursor is consumed while streaming, one team's files at a time
+    teams = teams_collection.find(
+        {"competition_id": id_match(competition_data["_id"])},
+        {"name": 1, "files": 1},
+        sort=[("_id", 1)],
+    )
+    return StreamingResponse(
+        stream_zip(team_file_entries(teams)),
+        media_type="application/zip",
+        headers={"Content-Disposition": content_disposition(f"{folder_name(competition_data.get('name') or competition_id)}.zip")},
+    )
+
 @router.delete("/teams/{team_id}/chat/{message_id}")
 def delete_chat_message(team_id: PydanticObjectId, message_id: str, current_user: User = Depends(verify_headteacher_token)):
     teams_collection = db.get_collection("teams")
     
-    # Remove the message from the team's chat array
+    # Remove the message from the team's chat array; matching on the message
+    # keeps the 404 check meaningful now that every update bumps the version
     result = teams_collection.update_one(
-        {"_id": team_id},
-        {"$pull": {"chat": {"_id": message_id}}}
+        {"_id": team_id, "chat._id": message_id},
+        touch({"$pull": {"chat": {"_id": message_id}}})
     )
     
-    if result.modified_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Message not found")
     
     return {"message": "Message deleted successfully"}
@@ -225,28 +302,29 @@ def delete_chat_message(team_id: PydanticObjectId, message_id: str, current_user
 def remove_team_member(team_id: PydanticObjectId, member_id: PydanticObjectId, current_user: User = Depends(verify_headteacher_token)):
     teams_collection = db.get_collection("teams")
     
-    team_data = teams_collection.find_one({"_id": team_id})
+    team_data = teams_collection.find_one({"_id": team_id}, {"_id": 1})
     if not team_data:
         raise HTTPException(status_code=404, detail="Team not found")
     
-    team = Team(**team_data)
-    
-    # Remove member
-    initial_member_count = len(team.members)
-    team.members = [m for m in team.members if m.get("user_id") != member_id]
+    # Remove member in place so a concurrent join is not overwritten and the
+    # member counter stays in step with the array
+    result = teams_collection.update_one(
+        {"_id": team_id, "members.user_id": id_match(member_id)},
+        touch(team_service.member_removal(str(member_id), ObjectId(str(member_id))))
+    )
     
-    if len(team.members) == initial_member_count:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Member not found in team")
     
-    teams_collection.update_one(
-        {"_id": team_id},
-        {"$set": {"members": [m.dict() for m in team.members], "updated_at": datetime.now(timezone.utc)}}
-    )
-    
     return {"message": "Member removed successfully"}
 
 @router.get("/teams", response_model=List[Team])
-def list_all_teams_for_headteacher(current_user: User = Depends(verify_headteacher_token)):
+def list_all_teams_for_headteacher(
+    request: Request,
+    response: Response,
+    current_user: User = Depends(verify_headteacher_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     user = get_user_with_school(current_user)
     school_id = user.get("school_id")
     
@@ -258,13 +336,15 @@ def list_all_teams_for_headteacher(current_user: User = Depends(verify_headteach
     teams_collection = db.get_collection("teams")
     
     # Get all competitions for the school - try both string and ObjectId formats
-    competitions_data = list(competitions_collection.find({"school_id": school_id}))
+    competitions_data = list(competitions_collection.find({"school_id": school_id}, {"_id": 1}))
     
     if not competitions_data:
         # Try converting school_id to ObjectId if it's a string
         try:
             from bson import ObjectId
-            competitions_data = list(competitions_collection.find({"school_id": ObjectId(school_id)}))
+            competitions_data = list(
+                competitions_collection.find({"school_id": ObjectId(school_id)}, {"_id": 1})
+            )
         except:
             pass
     
@@ -275,7 +355,17 @@ def list_all_teams_for_headteacher(current_user: User = Depends(verify_headteach
     
     # Get all teams for those competitions - need to convert ObjectIds to strings for comparison
     competition_ids_str = [str(cid) for cid in competition_ids]
-    teams_data = list(teams_collection.find({"competition_id": {"$in": competition_ids_str}}))
+    teams_filter = {"competition_id": {"$in": competition_ids_str}}
+    
+    not_modified = check_not_modified(
+        request, lambda: teams_collection.find(teams_filter, STAMP_PROJECTION), fields
+    )
+    if not_modified:
+        return not_modified
+    
+    teams_data = list(
+        teams_collection.find(teams_filter, with_stamps(projection(fields, TEAM_REQUIRED_FIELDS)))
+    )
     
     teams = []
     for team_data in teams_data:
@@ -300,16 +390,25 @@ def list_all_teams_for_headteacher(current_user: User = Depends(verify_headteach
             team_data["competition_id"] = str(team_data["competition_id"])
         teams.append(team_data)
     
+    headers = etag_headers(compute_etag(teams, fields))
+    response.headers.update(headers)
+    if fields is not None:
+        # Validate through the model so trimmed output keeps the same "_id" shape
+        return model_response([Team(**team_data) for team_data in teams], fields, headers)
     return teams
 
 @router.get("/teams/{team_id}", response_model=dict)
-def get_team_for_moderation(team_id: str, current_user: User = Depends(verify_headteacher_token)):
+def get_team_for_moderation(
+    team_id: str,
+    current_user: User = Depends(verify_headteacher_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     teams_collection = db.get_collection("teams")
     
     try:
-        team_data = teams_collection.find_one({"_id": ObjectId(team_id)})
+        team_data = teams_collection.find_one({"_id": ObjectId(team_id)}, projection(fields))
     except:
-        team_data = teams_collection.find_one({"_id": team_id})
+        team_data = teams_collection.find_one({"_id": team_id}, projection(fields))
     
     if not team_data:
         raise HTTPException(status_code=404, detail="Team not found")
@@ -318,7 +417,7 @@ def get_team_for_moderation(team_id: str, current_user: User = Depends(verify_he
     if "competition_id" in team_data:
         team_data["competition_id"] = str(team_data["competition_id"])
     
-    return team_data
+    return FastJSONResponse(trim(team_data, fields))
 
 @router.delete("/teams/{team_id}/messages/{message_id}")
 def delete_team_message(team_id: str, message_id: str, current_user: User = Depends(verify_headteacher_token)):
@@ -340,11 +439,11 @@ def delete_team_message(team_id: str, message_id: str, current_user: User = Depe
     
     # Remove the message from chat array
     result = teams_collection.update_one(
-        {"_id": team_oid},
-        {"$pull": {"chat": {"_id": message_oid}}}
+        {"_id": team_oid, "chat._id": message_oid},
+        touch({"$pull": {"chat": {"_id": message_oid}}})
     )
     
-    if result.modified_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Message not found")
     
     return {"message": "Message deleted successfully"}
@@ -363,18 +462,22 @@ def delete_team_file(team_id: str, file_id: str, current_user: User = Depends(ve
     except:
         file_oid = file_id
     
-    team_data = teams_collection.find_one({"_id": team_oid})
+    team_data = teams_collection.find_one({"_id": team_oid}, {"_id": 1})
     if not team_data:
         raise HTTPException(status_code=404, detail="Team not found")
     
-    # Remove the file from files array
-    result = teams_collection.update_one(
-        {"_id": team_oid},
-        {"$pull": {"files": {"_id": file_oid}}}
+    # Remove the file from files array, reading back the removed entry's size
+    removed = teams_collection.find_one_and_update(
+        {"_id": team_oid, "files._id": file_oid},
+        touch({"$pull": {"files": {"_id": file_oid}}}),
+        projection={"files": {"$elemMatch": {"_id": file_oid}}},
     )
     
-    if result.modified_count == 0:
+    if removed is None:
         raise HTTPException(status_code=404, detail="File not found")
     
+    quota_service.release_team_storage(team_oid, removed["files"][0].get("size", 0))
+    blob_service.release(removed["files"][0].get("sha256"))
+    
     return {"message": "File deleted successfully"}
 
@@ -7,22 +7,46 @@ from fastapi import (
     UploadFile,
     File as FastAPIFile,
     Depends,
+    Query,
+    Request,
     WebSocket,
     WebSocketDisconnect,
 )
-from fastapi.responses import FileResponse
+from file_serving import file_response
+from starlette.concurrency import run_in_threadpool
+from responses import FastJSONResponse
+from fields import fields_query, projection, subfields, trim, wants
+from etags import (
+    STAMP_PROJECTION,
+    check_not_modified,
+    compute_etag,
+    etag_headers,
+    touch,
+    with_stamps,
+)
+from pagination import id_match
+from services import (
+    blob_service,
+    competition_cache,
+    competition_service,
+    preview_service,
+    quota_service,
+    team_service,
+    upload_service,
+)
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import jwt
 import os
 import json
+import logging
 from datetime import datetime, timezone
 from bson import ObjectId
 from database import db
+import metrics
 from api.auth import SECRET_KEY, ALGORITHM, get_current_user
 from models import (
     User,
-    Competition,
     Team,
     PydanticObjectId,
     ChatMessage,
@@ -31,6 +55,7 @@ from models import (
 )
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 def verify_student_token(current_user: User = Depends(get_current_user)):
@@ -40,10 +65,24 @@ def verify_student_token(current_user: User = Depends(get_current_user)):
 
 
 # Competitions
+# Chat and files are never shown outside the team, so listings never load them
+_PUBLIC_TEAM_PROJECTION = {"chat": 0, "files": 0}
+
+
+def _public_team_projection(fields: Optional[List[str]]):
+    team_fields = subfields(fields, "teams")
+    if team_fields is not None:
+        team_fields = [f for f in team_fields if f.split(".")[0] not in ("chat", "files")]
+    return projection(team_fields, default=_PUBLIC_TEAM_PROJECTION)
+
+
 @router.get("/competitions")
-def list_competitions(current_user: User = Depends(verify_student_token)):
+def list_competitions(
+    request: Request,
+    current_user: User = Depends(verify_student_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     users_collection = db.get_collection("users")
-    competitions_collection = db.get_collection("competitions")
     teams_collection = db.get_collection("teams")
 
     # Flexible user lookup
@@ -61,55 +100,95 @@ def list_competitions(current_user: User = Depends(verify_student_token)):
     if not user_data or not user_data.get("school_id"):
         raise HTTPException(status_code=400, detail="School not found for user")
 
-    # Get school and global competitions (query with string school_id)
-    competitions_data = list(
-        competitions_collection.find(
-            {
-                "$or": [
-                    {"school_id": user_data["school_id"]},
-                    {"is_global": True},
-                ]
-            }
-        )
-    )
+    # School and global competitions, from the per-process cache; trim()
+    # applies the field selection
+    competitions_data = competition_cache.visible_competitions(user_data["school_id"])
+    load_teams = wants(fields, "teams")
+
+    def stamps():
+        documents = list(competitions_data)
+        if load_teams:
+            competition_ids = [str(comp["_id"]) for comp in documents]
+            documents += teams_collection.find(
+                {"competition_id": {"$in": competition_ids}}, STAMP_PROJECTION
+            )
+        return documents
+
+    not_modified = check_not_modified(request, stamps, fields)
+    if not_modified:
+        return not_modified
 
     competitions = []
+    loaded = list(competitions_data)
     for comp_data in competitions_data:
         # Convert _id to id for frontend
         comp_id = str(comp_data["_id"])
         comp_data["id"] = comp_id
         comp_data.pop("_id")
 
-        # Load teams for this competition
-        teams_data = list(teams_collection.find({"competition_id": comp_id}))
-        teams = []
-        for team_data in teams_data:
-            team_data["id"] = str(team_data.pop("_id"))
-            team_data["chat"] = []  # Don't expose chat
-            team_data["files"] = []  # Don't expose files
-            teams.append(team_data)
-
-        comp_data["teams"] = teams
+        # Load teams for this competition, unless the client did not ask for them
+        if load_teams:
+            teams_data = list(
+                teams_collection.find(
+                    {"competition_id": comp_id},
+                    with_stamps(_public_team_projection(fields)),
+                )
+            )
+            loaded += teams_data
+            teams = []
+            for team_data in teams_data:
+                team_data["id"] = str(team_data.pop("_id"))
+                team_data["chat"] = []  # Don't expose chat
+                team_data["files"] = []  # Don't expose files
+                teams.append(team_data)
+
+            comp_data["teams"] = teams
         competitions.append(comp_data)
 
-    return competitions
+    return FastJSONResponse(
+        trim(competitions, fields), headers=etag_headers(compute_etag(loaded, fields))
+    )
 
 
 @router.get("/competitions/{competition_id}")
 def get_competition(
-    competition_id: str, current_user: User = Depends(verify_student_token)
+    competition_id: str,
+    request: Request,
+    current_user: User = Depends(verify_student_token),
+    fields: Optional[List[str]] = Depends(fields_query),
 ):
     competitions_collection = db.get_collection("competitions")
     teams_collection = db.get_collection("teams")
+    load_teams = wants(fields, "teams")
+
+    def stamps():
+        competition = competitions_collection.find_one(
+            {"_id": id_match(competition_id)}, STAMP_PROJECTION
+        )
+        if not competition:
+            return []
+        documents = [competition]
+        if load_teams:
+            documents += teams_collection.find(
+                {"competition_id": str(competition["_id"])}, STAMP_PROJECTION
+            )
+        return documents
+
+    not_modified = check_not_modified(request, stamps, fields)
+    if not_modified:
+        return not_modified
 
     # Flexible competition lookup
-    competition_data = competitions_collection.find_one({"_id": competition_id})
+    competition_projection = with_stamps(projection(fields))
+    competition_data = competitions_collection.find_one(
+        {"_id": competition_id}, competition_projection
+    )
     if not competition_data:
         try:
             from bson import ObjectId
 
             competition_data = competitions_collection.find_one(
-                {"_id": ObjectId(competition_id)}
+                {"_id": ObjectId(competition_id)}, competition_projection
             )
         except:
             pass
@@ -121,37 +200,52 @@ def get_competition(
     actual_comp_id = str(competition_data["_id"])
 
     # Get teams for this competition
-    teams_data = list(teams_collection.find({"competition_id": actual_comp_id}))
-    teams = []
-    for team_data in teams_data:
-        team_data["id"] = str(team_data.pop("_id"))
-        team_data["chat"] = []  # Don't expose chat to non-members
-        team_data["files"] = []  # Don't expose files to non-members
-        teams.append(team_data)
+    loaded = [competition_data]
+    if load_teams:
+        teams_data = list(
+            teams_collection.find(
+                {"competition_id": actual_comp_id},
+                with_stamps(_public_team_projection(fields)),
+            )
+        )
+        loaded += teams_data
+        teams = []
+        for team_data in teams_data:
+            team_data["id"] = str(team_data.pop("_id"))
+            team_data["chat"] = []  # Don't expose chat to non-members
+            team_data["files"] = []  # Don't expose files to non-members
+            teams.append(team_data)
+        competition_data["teams"] = teams
 
     # Convert competition _id to id
     competition_data["id"] = str(competition_data.pop("_id"))
-    competition_data["teams"] = teams
 
-    return competition_data
+    return FastJSONResponse(
+        trim(competition_data, fields),
+        headers=etag_headers(compute_etag(loaded, fields)),
+    )
 
 
 @router.get("/competitions/{competition_id}/my-team")
 def get_my_team_for_competition(
-    competition_id: str, current_user: User = Depends(verify_student_token)
+    competition_id: str,
+    current_user: User = Depends(verify_student_token),
+    fields: Optional[List[str]] = Depends(fields_query),
 ):
     """Check if the current user is already in a team for this competition"""
     competitions_collection = db.get_collection("competitions")
     teams_collection = db.get_collection("teams")
 
-    # Flexible competition lookup
-    competition_data = competitions_collection.find_one({"_id": competition_id})
+    # Flexible competition lookup (only the _id is needed)
+    competition_data = competitions_collection.find_one(
+        {"_id": competition_id}, {"_id": 1}
+    )
     if not competition_data:
         try:
             from bson import ObjectId
 
             competition_data = competitions_collection.find_one(
-                {"_id": ObjectId(competition_id)}
+                {"_id": ObjectId(competition_id)}, {"_id": 1}
             )
         except:
             pass
@@ -165,7 +259,8 @@ def get_my_team_for_competition(
 
     # Check if user is in any team for this competition
     existing_team = teams_collection.find_one(
-        {"competition_id": actual_comp_id, "members.user_id": user_id_str}
+        {"competition_id": actual_comp_id, "members.user_id": user_id_str},
+        projection(fields),
     )
 
     if not existing_team:
@@ -175,7 +270,7 @@ def get_my_team_for_competition(
 
     # Return the team
     existing_team["id"] = str(existing_team.pop("_id"))
-    return existing_team
+    return FastJSONResponse(trim(existing_team, fields))
 
 
 # Teams
@@ -189,10 +284,6 @@ def create_team(
     team_data: TeamCreateRequest,
     current_user: User = Depends(verify_student_token),
 ):
-    log_file_path = "/home/bartoszg/.gemini/tmp/718ff143cbffa6b812a15f4e413e7d6cf9d697a71c04ee41464b160bab583b8a/student_debug.log"
-    with open(log_file_path, "a") as f:
-        f.write(f"[{datetime.now(timezone.utc)}] DEBUG: create_team called.\n")
-
     users_collection = db.get_collection("users")
     competitions_collection = db.get_collection("competitions")
     teams_collection = db.get_collection("teams")
@@ -227,29 +318,8 @@ def create_team(
     if not competition_data:
         raise HTTPException(status_code=404, detail="Competition not found")
 
-    competition = Competition(**competition_data)
-
-    # Check max teams limit (use actual competition_id from DB)
+    # Use actual competition_id from DB
     actual_comp_id = str(competition_data["_id"])
-    team_count = teams_collection.count_documents({"competition_id": actual_comp_id})
-
-    log_file_path = "/home/bartoszg/.gemini/tmp/718ff143cbffa6b812a15f4e413e7d6cf9d697a71c04ee41464b160bab583b8a/student_debug.log"
-    with open(log_file_path, "a") as f:
-        f.write(
-            f"[{datetime.now(timezone.utc)}] DEBUG: team_count: {team_count}, competition.max_teams: {competition.max_teams}\n"
-        )
-        f.write(
-            f"[{datetime.now(timezone.utc)}] DEBUG: current_user.id: {current_user.id}, type: {type(current_user.id)}\n"
-        )
-        f.write(
-            f"[{datetime.now(timezone.utc)}] DEBUG: actual_comp_id: {actual_comp_id}, type: {type(actual_comp_id)}\n"
-        )
-
-    if team_count >= competition.max_teams:
-        raise HTTPException(
-            status_code=400,
-            detail="Maximum number of teams reached for this competition",
-        )
 
     # Check if user is already in a team for this competition (check both str formats)
     user_id_str = str(current_user.id)
@@ -257,16 +327,17 @@ def create_team(
         {
             "competition_id": actual_comp_id,
             "members.user_id": {"$in": [user_id_str, current_user.id]},
-        }
+        },
+        {"_id": 1},
     )
 
-    with open(log_file_path, "a") as f:
-        f.write(
-            f"[{datetime.now(timezone.utc)}] DEBUG: Checking for existing team member with user_id: {user_id_str}\n"
-        )
-        f.write(
-            f"[{datetime.now(timezone.utc)}] DEBUG: existing_team_member: {existing_team_member}\n"
-        )
+    logger.debug(
+        "create_team membership check",
+        extra={
+            "user_id": user_id_str,
+            "already_member": existing_team_member is not None,
+        },
+    )
 
     if existing_team_member:
         raise HTTPException(
@@ -274,6 +345,20 @@ def create_team(
             detail="Already in a team for this competition",
         )
 
+    # Take a team slot atomically; the max_teams check happens in the update
+    if not competition_service.reserve_team_slot(competition_data["_id"]):
+        logger.debug(
+            "create_team limit reached",
+            extra={
+                "competition_id": actual_comp_id,
+                "max_teams": competition_data.get("max_teams"),
+            },
+        )
+        raise HTTPException(
+            status_code=400,
+            detail="Maximum number of teams reached for this competition",
+        )
+
     # Create team
     team_dict = {
         "name": team_data.name,
@@ -285,13 +370,19 @@ def create_team(
                 "email": user_data.get("email", current_user.email),
             }
         ],
+        "member_count": 1,
+        "storage_used": 0,
         "chat": [],
         "files": [],
         "created_at": datetime.now(timezone.utc),
         "updated_at": datetime.now(timezone.utc),
     }
 
-    result = teams_collection.insert_one(team_dict)
+    try:
+        result = teams_collection.insert_one(team_dict)
+    except Exception:
+        competition_service.release_team_slot(competition_data["_id"])
+        raise
 
     # Reload and return with id field
     created_team = teams_collection.find_one({"_id": result.inserted_id})
@@ -300,16 +391,33 @@ def create_team(
 
 
 @router.get("/teams/{team_id}")
-def get_team(team_id: str, current_user: User = Depends(verify_student_token)):
+def get_team(
+    team_id: str,
+    request: Request,
+    current_user: User = Depends(verify_student_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     teams_collection = db.get_collection("teams")
 
-    # Flexible ID lookup
-    team_data = teams_collection.find_one({"_id": team_id})
+    # Members see chat and files, everybody else does not, so the tag is per user
+    def stamps():
+        team = teams_collection.find_one({"_id": id_match(team_id)}, STAMP_PROJECTION)
+        return [team] if team else []
+
+    not_modified = check_not_modified(request, stamps, str(current_user.id), fields)
+    if not_modified:
+        return not_modified
+
+    # Flexible ID lookup; members are always needed for the membership check
+    team_projection = with_stamps(projection(fields, required=("members",)))
+    team_data = teams_collection.find_one({"_id": team_id}, team_projection)
     if not team_data:
         try:
             from bson import ObjectId
 
-            team_data = teams_collection.find_one({"_id": ObjectId(team_id)})
+            team_data = teams_collection.find_one(
+                {"_id": ObjectId(team_id)}, team_projection
+            )
         except:
             pass
 
@@ -330,7 +438,8 @@ def get_team(team_id: str, current_user: User = Depends(verify_student_token)):
         team_data["chat"] = []
         team_data["files"] = []
 
-    return team_data
+    etag = compute_etag([team_data], str(current_user.id), fields)
+    return FastJSONResponse(trim(team_data, fields), headers=etag_headers(etag))
 
 
 @router.put("/teams/{team_id}")
@@ -369,7 +478,7 @@ def update_team(
     filtered_updates = {k: v for k, v in update_data.items() if k in allowed_fields}
 
     if filtered_updates:
-        teams_collection.update_one({"_id": team_id}, {"$set": filtered_updates})
+        teams_collection.update_one({"_id": team_id}, touch({"$set": filtered_updates}))
 
     # Return updated team
     updated_team = teams_collection.find_one({"_id": team_id})
@@ -390,8 +499,9 @@ def create_join_request(
     teams_collection = db.get_collection("teams")
     join_requests_collection = db.get_collection("join_requests")
 
-    print(
-        f"DEBUG: Creating join request for team_id={team_id}, user_id={current_user.id}"
+    logger.debug(
+        "Creating join request",
+        extra={"team_id": team_id, "user_id": str(current_user.id)},
     )
 
     # Flexible user lookup
@@ -454,26 +564,27 @@ def create_join_request(
     join_request_dict["id"] = str(result.inserted_id)
     join_request_dict.pop("_id", None)  # Remove ObjectId if it exists
 
-    print(f"DEBUG: Join request created: {join_request_dict}")
+    logger.debug("Join request created", extra={"join_request_id": join_request_dict["id"]})
     return join_request_dict
 
 
 @router.get("/teams/{team_id}/join-requests")
 def list_join_requests(
-    team_id: str, current_user: User = Depends(verify_student_token)
+    team_id: str,
+    current_user: User = Depends(verify_student_token),
+    fields: Optional[List[str]] = Depends(fields_query),
 ):
     teams_collection = db.get_collection("teams")
     join_requests_collection = db.get_collection("join_requests")
 
-    print(
-        f"DEBUG: Loading join requests for team_id={team_id}, user_id={current_user.id}"
-    )
 
-    # Flexible team lookup
-    team_data = teams_collection.find_one({"_id": team_id})
+    # Flexible team lookup (only members are needed)
+    team_data = teams_collection.find_one({"_id": team_id}, {"members": 1})
     if not team_data:
         try:
-            team_data = teams_collection.find_one({"_id": ObjectId(team_id)})
+            team_data = teams_collection.find_one(
+                {"_id": ObjectId(team_id)}, {"members": 1}
+            )
         except:
             pass
 
@@ -482,29 +593,30 @@ def list_join_requests(
 
     actual_team_id = str(team_data["_id"])
 
-    print(f"DEBUG: Actual team_id={actual_team_id}")
-
     # Verify user is a team member
     is_member = any(
         m.get("user_id") in [str(current_user.id), current_user.id]
         for m in team_data.get("members", [])
     )
     if not is_member:
-        print(f"DEBUG: User {current_user.id} is not a member")
         raise HTTPException(status_code=403, detail="Not a member of this team")
 
     # Get pending requests
     requests_data = list(
-        join_requests_collection.find({"team_id": actual_team_id, "status": "pending"})
+        join_requests_collection.find(
+            {"team_id": actual_team_id, "status": "pending"}, projection(fields)
+        )
+    )
+    logger.debug(
+        "Loaded pending join requests",
+        extra={"team_id": actual_team_id, "count": len(requests_data)},
     )
-    print(f"DEBUG: Found {len(requests_data)} pending join requests")
     requests = []
     for req_data in requests_data:
         req_data["id"] = str(req_data.pop("_id"))
         requests.append(req_data)
-        print(f"DEBUG: Join request: {req_data}")
 
-    return requests
+    return FastJSONResponse(trim(requests, fields))
 
 
 class JoinRequestAction(BaseModel):
@@ -589,12 +701,6 @@ def handle_join_request(
         required_approvals = (member_count // 2) + 1
 
         if len(approvals) >= required_approvals:
-            # Check max members limit
-            if len(team_data.get("members", [])) >= max_members:
-                raise HTTPException(
-                    status_code=400, detail="Team has reached maximum member limit"
-                )
-
             # Add user to team
             user_id_to_add = join_request_data.get("user_id")
             user_to_add_data = users_collection.find_one({"_id": user_id_to_add})
@@ -606,20 +712,28 @@ def handle_join_request(
                 except:
                     pass
 
-            if user_to_add_data:
-                new_member = {
-                    "user_id": str(user_to_add_data["_id"]),
-                    "name": user_to_add_data.get("name", ""),
-                    "email": user_to_add_data.get("email", ""),
-                }
+            if not user_to_add_data:
+                raise HTTPException(status_code=404, detail="User not found")
 
-            teams_collection.update_one(
-                {"_id": team_data["_id"]},
-                {
-                    "$push": {"members": new_member},
-                    "$set": {"updated_at": datetime.now(timezone.utc)},
-                },
-            )
+            new_member = {
+                "user_id": str(user_to_add_data["_id"]),
+                "name": user_to_add_data.get("name", ""),
+                "email": user_to_add_data.get("email", ""),
+            }
+            if any(
+                m.get("user_id") == new_member["user_id"]
+                for m in team_data.get("members", [])
+            ):
+                raise HTTPException(
+                    status_code=400, detail="User is already a member of this team"
+                )
+
+            # The max members check happens inside the update, so concurrent
+            # approvals cannot push the team over its limit
+            if not team_service.join_team(team_data["_id"], new_member, max_members):
+                raise HTTPException(
+                    status_code=400, detail="Team has reached maximum member limit"
+                )
 
             # Mark request as approved
             join_requests_collection.update_one(
@@ -726,7 +840,7 @@ def send_chat_message(
 
     # Update team - use the original _id from team_data to maintain correct type
     teams_collection.update_one(
-        {"_id": team_data["_id"]}, {"$push": {"chat": chat_message}}
+        {"_id": team_data["_id"]}, touch({"$push": {"chat": chat_message}})
     )
 
     return chat_message
@@ -736,13 +850,16 @@ def send_chat_message(
 def get_chat_history(team_id: str, current_user: User = Depends(verify_student_token)):
     teams_collection = db.get_collection("teams")
 
-    # Flexible team lookup
-    team_data = teams_collection.find_one({"_id": team_id})
+    # Flexible team lookup; the file list is not needed here
+    chat_projection = {"members": 1, "chat": 1}
+    team_data = teams_collection.find_one({"_id": team_id}, chat_projection)
     if not team_data:
         try:
             from bson import ObjectId
 
-            team_data = teams_collection.find_one({"_id": ObjectId(team_id)})
+            team_data = teams_collection.find_one(
+                {"_id": ObjectId(team_id)}, chat_projection
+            )
         except:
             pass
 
@@ -757,22 +874,29 @@ def get_chat_history(team_id: str, current_user: User = Depends(verify_student_t
     if not is_member:
         raise HTTPException(status_code=403, detail="Not a member of this team")
 
-    return {"chat": team_data.get("chat", [])}
+    return FastJSONResponse({"chat": team_data.get("chat", [])})
 
 
 # Files
 # Files
 @router.get("/teams/{team_id}/files")
-def list_team_files(team_id: str, current_user: User = Depends(verify_student_token)):
+def list_team_files(
+    team_id: str,
+    current_user: User = Depends(verify_student_token),
+    fields: Optional[List[str]] = Depends(fields_query),
+):
     teams_collection = db.get_collection("teams")
 
-    # Flexible team lookup
-    team_data = teams_collection.find_one({"_id": team_id})
+    # Flexible team lookup; the chat history is not needed here
+    files_projection = {"members": 1, "files": 1}
+    team_data = teams_collection.find_one({"_id": team_id}, files_projection)
     if not team_data:
         try:
             from bson import ObjectId
 
-            team_data = teams_collection.find_one({"_id": ObjectId(team_id)})
+            team_data = teams_collection.find_one(
+                {"_id": ObjectId(team_id)}, files_projection
+            )
         except:
             pass
 
@@ -795,7 +919,7 @@ def list_team_files(team_id: str, current_user: User = Depends(verify_student_to
             file_dict["id"] = file_dict.pop("_id")
         files.append(file_dict)
 
-    return files
+    return FastJSONResponse(trim(files, fields))
 
 
 @router.post("/teams/{team_id}/files")
@@ -822,13 +946,16 @@ async def upload_file(
     if not user_data:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Flexible team lookup
-    team_data = teams_collection.find_one({"_id": team_id})
+    # Flexible team lookup; storage is tracked by a counter, so the file
+    # list itself is not needed
+    team_data = teams_collection.find_one({"_id": team_id}, {"members": 1})
     if not team_data:
         try:
             from bson import ObjectId
 
-            team_data = teams_collection.find_one({"_id": ObjectId(team_id)})
+            team_data = teams_collection.find_one(
+                {"_id": ObjectId(team_id)}, {"members": 1}
+            )
         except:
             pass
 
@@ -843,67 +970,270 @@ async def upload_file(
     if not is_member:
         raise HTTPException(status_code=403, detail="Not a member of this team")
 
-    # Check file size (100MB limit per team)
-    files = team_data.get("files", [])
-    total_size = sum(f.get("size", 0) for f in files)
+    # Stream the upload into the blob store, hashing as it is written
+    sha256, file_size, temp_path = await blob_service.write_upload(file)
+    metrics.upload_bytes_total.inc(file_size, endpoint="student")
+    metrics.uploads_total.inc(endpoint="student")
 
-    # Save file
-    file_id = str(PydanticObjectId())
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
+    # Reserve the space atomically before storing (100MB per team by default);
+    # teams are charged for their files even when the content is shared
+    if not await run_in_threadpool(quota_service.reserve_team_storage, team_data["_id"], file_size):
+        blob_service.discard(temp_path)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Team file storage limit exceeded ({quota_service.TEAM_STORAGE_LIMIT // (1024 * 1024)}MB)",
+        )
 
-    file_path = os.path.join(upload_dir, f"{file_id}_{file.filename}")
+    return await _attach_file(
+        team_data["_id"],
+        current_user,
+        user_data.get("name", current_user.name),
+        file.filename,
+        sha256,
+        file_size,
+        temp_path,
+    )
 
-    content = await file.read()
-    file_size = len(content)
 
-    if total_size + file_size > 100 * 1024 * 1024:  # 100MB
-        raise HTTPException(
-            status_code=400, detail="Team file storage limit exceeded (100MB)"
-        )
+async def _attach_file(
+    team_id,
+    current_user: User,
+    user_name: str,
+    filename: str,
+    sha256: str,
+    size: int,
+    temp_path: str,
+) -> dict:
+    """Store hashed content whose quota is already reserved and list it on the team.
 
-    with open(file_path, "wb") as f:
-        f.write(content)
+    On failure the reservation is given back.
+    """
+    teams_collection = db.get_collection("teams")
+    try:
+        # Placing the blob may upload the whole file to S3; keep it off the event loop
+        await run_in_threadpool(blob_service.commit, sha256, size, temp_path)
+    except Exception:
+        await run_in_threadpool(quota_service.release_team_storage, team_id, size)
+        raise
 
-    # Add file to team
+    file_id = str(PydanticObjectId())
     file_doc = {
         "_id": file_id,
         "user_id": str(current_user.id),
-        "user_name": user_data.get("name", current_user.name),
-        "filename": file.filename,
+        "user_name": user_name,
+        "filename": filename,
         "url": f"/student/files/{file_id}",
-        "size": file_size,
+        "size": size,
+        "sha256": sha256,
         "created_at": datetime.now(timezone.utc).isoformat(),
     }
 
-    teams_collection.update_one(
-        {"_id": team_data["_id"]}, {"$push": {"files": file_doc}}
-    )
+    try:
+        await run_in_threadpool(
+            teams_collection.update_one, {"_id": team_id}, touch({"$push": {"files": file_doc}})
+        )
+    except Exception:
+        await run_in_threadpool(quota_service.release_team_storage, team_id, size)
+        await run_in_threadpool(blob_service.release, sha256)
+        raise
 
+    preview = await run_in_threadpool(
+        preview_service.after_upload, team_id, file_id, sha256, filename, size
+    )
+    if preview:
+        file_doc["preview_url"] = preview
     return file_doc
 
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+
+
+def _session_status(session: dict) -> dict:
+    return {
+        "upload_id": str(session["_id"]),
+        "filename": session["filename"],
+        "size": session["size"],
+        "offset": session["received"],
+        "chunk_size": upload_service.CHUNK_SIZE,
+        "expires_at": session["expires_at"],
+    }
+
+
+def _upload_id(upload_id: str) -> ObjectId:
+    if not ObjectId.is_valid(upload_id):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return ObjectId(upload_id)
+
+
+@router.post("/teams/{team_id}/uploads", status_code=201)
+def create_upload_session(
+    team_id: str,
+    upload: UploadSessionCreate,
+    current_user: User = Depends(verify_student_token),
+):
+    """Start a resumable upload; the declared size is reserved from the team's quota"""
+    if upload.size <= 0:
+        raise HTTPException(status_code=400, detail="Upload size must be positive")
+
+    teams_collection = db.get_collection("teams")
+    team_data = teams_collection.find_one({"_id": id_match(team_id)}, {"members": 1})
+    if not team_data:
+        raise HTTPException(status_code=404, detail="Team not found")
+    is_member = any(
+        m.get("user_id") in [str(current_user.id), current_user.id]
+        for m in team_data.get("members", [])
+    )
+    if not is_member:
+        raise HTTPException(status_code=403, detail="Not a member of this team")
+
+    session = upload_service.create_session(
+        team_data["_id"], str(current_user.id), current_user.name, upload.filename, upload.size
+    )
+    if session is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Team file storage limit exceeded ({quota_service.TEAM_STORAGE_LIMIT // (1024 * 1024)}MB)",
+        )
+    return _session_status(session)
+
+
+@router.get("/uploads/{upload_id}")
+def get_upload_session(upload_id: str, current_user: User = Depends(verify_student_token)):
+    """Current offset of a resumable upload, for resuming after a dropped connection"""
+    session = upload_service.get_session(_upload_id(upload_id), str(current_user.id))
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return _session_status(session)
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(verify_student_token),
+):
+    """Append the request body to a resumable upload at ``offset``"""
+    oid = _upload_id(upload_id)
+    user_id = str(current_user.id)
+    session = await run_in_threadpool(upload_service.claim_chunk, oid, user_id, offset)
+    if session is None:
+        current = await run_in_threadpool(upload_service.get_session, oid, user_id)
+        if not current:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        raise HTTPException(
+            status_code=409,
+            detail="Chunk does not continue the upload, resume from the current offset",
+            headers={"Upload-Offset": str(current["received"])},
+        )
+
+    try:
+        written = await upload_service.write_chunk(session, offset, request.stream())
+    except upload_service.ChunkTooLarge:
+        await run_in_threadpool(upload_service.release_chunk, session)
+        raise HTTPException(status_code=400, detail="Chunk exceeds the declared upload size")
+    except BaseException:
+        # Not awaited: the request may be cancelled, and the lease must still go
+        upload_service.release_chunk(session)
+        raise
+
+    metrics.upload_bytes_total.inc(written, endpoint="student")
+    received = await run_in_threadpool(upload_service.acknowledge_chunk, session, offset, written)
+    return {"upload_id": upload_id, "offset": received, "size": session["size"]}
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, current_user: User = Depends(verify_student_token)):
+    """Finalize a fully received upload into a team file"""
+    oid = _upload_id(upload_id)
+    session = await run_in_threadpool(upload_service.take_completed, oid, str(current_user.id))
+    if session is None:
+        current = await run_in_threadpool(upload_service.get_session, oid, str(current_user.id))
+        if not current:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        raise HTTPException(
+            status_code=409,
+            detail="Upload is incomplete",
+            headers={"Upload-Offset": str(current["received"])},
+        )
+
+    teams_collection = db.get_collection("teams")
+    user_id = str(current_user.id)
+    if not await run_in_threadpool(
+        teams_collection.find_one,
+        {"_id": session["team_id"], "members.user_id": {"$in": [user_id, current_user.id]}},
+        {"_id": 1},
+    ):
+        # Removed from the team while uploading
+        await run_in_threadpool(
+            quota_service.release_team_storage, session["team_id"], session["size"]
+        )
+        await run_in_threadpool(blob_service.discard, session["path"])
+        raise HTTPException(status_code=403, detail="Not a member of this team")
+
+    metrics.uploads_total.inc(endpoint="student")
+    sha256 = await run_in_threadpool(blob_service.hash_file, session["path"])
+    return await _attach_file(
+        session["team_id"],
+        current_user,
+        session["user_name"],
+        session["filename"],
+        sha256,
+        session["size"],
+        session["path"],
+    )
+
+
+@router.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str, current_user: User = Depends(verify_student_token)):
+    """Abandon a resumable upload, giving its reserved space back"""
+    if not upload_service.abort(_upload_id(upload_id), str(current_user.id)):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"message": "Upload aborted"}
+
+
 # File Download
 @router.get("/files/{file_id}")
 async def download_file(file_id: str):
     """Download a file by ID"""
+    teams_collection = db.get_collection("teams")
+    team_data = teams_collection.find_one({"files._id": file_id}, {"files.$": 1})
+    if team_data and team_data["files"][0].get("sha256"):
+        record = team_data["files"][0]
+        # Served from disk, or a redirect straight to object storage
+        response = blob_service.download_response(record["sha256"], record["filename"])
+        if response is not None:
+            return response
+
+    # Files uploaded before the blob store live at uploads/<file id>_<name>
     upload_dir = "uploads"
-
-    # Find the file in the uploads directory
     for filename in os.listdir(upload_dir):
         if filename.startswith(file_id):
             file_path = os.path.join(upload_dir, filename)
             # Extract original filename (after file_id_)
             original_name = filename.split("_", 1)[1] if "_" in filename else filename
-            return FileResponse(
-                path=file_path,
-                filename=original_name,
-                media_type="application/octet-stream",
-            )
+            return file_response(file_path, original_name, "application/octet-stream")
 
     raise HTTPException(status_code=404, detail="File not found")
 
 
+@router.get("/files/{file_id}/preview")
+async def download_file_preview(file_id: str):
+    """Small JPEG preview of an image or PDF file, once it has been rendered"""
+    teams_collection = db.get_collection("teams")
+    team_data = teams_collection.find_one({"files._id": file_id}, {"files.$": 1})
+    if team_data:
+        record = team_data["files"][0]
+        if record.get("preview_url") and record.get("sha256"):
+            response = preview_service.download_response(record["sha256"])
+            if response is not None:
+                response.headers["Cache-Control"] = "private, max-age=86400, immutable"
+                return response
+    raise HTTPException(status_code=404, detail="Preview not found")
+
+
 @router.delete("/teams/{team_id}/files/{file_id}")
 async def delete_file(
     team_id: str,
@@ -945,20 +1275,25 @@ async def delete_file(
     if not file_to_delete:
         raise HTTPException(status_code=404, detail="File not found")
 
-    # Delete physical file
-    upload_dir = "uploads"
-    for filename in os.listdir(upload_dir):
-        if filename.startswith(file_id):
-            file_path = os.path.join(upload_dir, filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            break
-
-    # Remove from database
-    teams_collection.update_one(
-        {"_id": team_data["_id"]},
-        {"$pull": {"files": {"_id": file_id}}}
+    # Remove from database; only the request that actually removed the entry
+    # gives its space and its blob reference back
+    result = teams_collection.update_one(
+        {"_id": team_data["_id"], "files._id": file_id},
+        touch({"$pull": {"files": {"_id": file_id}}}),
     )
+    if result.matched_count:
+        quota_service.release_team_storage(
+            team_data["_id"], file_to_delete.get("size", 0)
+        )
+        if file_to_delete.get("sha256"):
+            blob_service.release(file_to_delete["sha256"])
+        else:
+            # Delete the physical file of a pre-blob-store upload
+            upload_dir = "uploads"
+            for filename in os.listdir(upload_dir):
+                if filename.startswith(file_id):
+                    os.remove(os.path.join(upload_dir, filename))
+                    break
 
     return {"message": "File deleted successfully"}
 
@@ -973,10 +1308,12 @@ class ConnectionManager:
         if team_id not in self.active_connections:
             self.active_connections[team_id] = []
         self.active_connections[team_id].append(websocket)
+        metrics.websocket_connections.inc()
 
     def disconnect(self, websocket: WebSocket, team_id: str):
         if team_id in self.active_connections:
             self.active_connections[team_id].remove(websocket)
+            metrics.websocket_connections.dec()
             if not self.active_connections[team_id]:
                 del self.active_connections[team_id]
 
@@ -1072,7 +1409,7 @@ async def websocket_endpoint(websocket: WebSocket, team_id: str):
 
             # Save to database
             teams_collection.update_one(
-                {"_id": team_data["_id"]}, {"$push": {"chat": chat_message}}
+                {"_id": team_data["_id"]}, touch({"$push": {"chat": chat_message}})
             )
 
             # Broadcast to all connected clients in this team
@@ -1,11 +1,24 @@
-from fastapi import APIRouter, Body, HTTPException, UploadFile, File as FastAPIFile
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    HTTPException,
+    Query,
+    Response,
+    UploadFile,
+    File as FastAPIFile,
+)
 from typing import List
-from services import team_service
+from starlette.concurrency import run_in_threadpool
+from services import blob_service, preview_service, quota_service, team_service
+import metrics
+from file_serving import file_response
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, id_match, next_cursor, page_headers
+from fields import fields_query, model_response
 from models import Team, PydanticObjectId, ChatMessage, File
 from pydantic import BaseModel
 from typing import Optional, Dict
 import os
-import uuid
 from datetime import datetime, timezone
 
 router = APIRouter()
@@ -36,15 +49,38 @@ def create_team(team_data: TeamCreateRequest = Body(...)):
 
 
 @router.get("/", response_model=List[Team])
-def get_teams():
-    return team_service.get_teams()
+def get_teams(
+    response: Response,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    after: Optional[PydanticObjectId] = None,
+    fields: Optional[List[str]] = Depends(fields_query),
+    competition_id: Optional[str] = None,
+    member_id: Optional[str] = None,
+    name: Optional[str] = None,
+    include_total: bool = False,
+):
+    filters = {}
+    if competition_id:
+        filters["competition_id"] = id_match(competition_id)
+    if member_id:
+        filters["members.user_id"] = id_match(member_id)
+    if name:
+        filters["name"] = name
+
+    teams = team_service.get_teams(filters, after, limit, fields)
+    total = team_service.count_teams(filters) if include_total else None
+    headers = page_headers(next_cursor(teams, limit), total)
+    response.headers.update(headers)
+    return model_response(teams, fields, headers)
 
 
 @router.get("/{team_id}", response_model=Team)
-def get_team(team_id: PydanticObjectId):
-    team = team_service.get_team(team_id)
+def get_team(
+    team_id: PydanticObjectId, fields: Optional[List[str]] = Depends(fields_query)
+):
+    team = team_service.get_team(team_id, fields)
     if team:
-        return team
+        return model_response(team, fields)
     raise HTTPException(status_code=404, detail="Team not found")
 
 
@@ -97,10 +133,6 @@ def add_chat_message(
     message_data: ChatMessageRequest = Body(...)
 ):
     """Add a chat message to a team"""
-    team = team_service.get_team(team_id)
-    if not team:
-        raise HTTPException(status_code=404, detail="Team not found")
-    
     new_message = ChatMessage(
         user_id=message_data.user_id,
         user_name=message_data.user_name,
@@ -131,38 +163,48 @@ async def upload_file(
     user_name: str = Body(...)
 ):
     """Upload a file to a team"""
-    team = team_service.get_team(team_id)
-    if not team:
+    if not team_service.team_exists(team_id):
         raise HTTPException(status_code=404, detail="Team not found")
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = os.path.join(os.getcwd(), "uploads", str(team_id))
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Generate unique filename
-    file_extension = os.path.splitext(file.filename)[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(upload_dir, unique_filename)
+    # Stream the upload into the blob store, reserving the team's quota
+    # before the content is stored
+    sha256, size, temp_path = await blob_service.write_upload(file)
+    metrics.upload_bytes_total.inc(size, endpoint="teams")
+    metrics.uploads_total.inc(endpoint="teams")
+    if not await run_in_threadpool(quota_service.reserve_team_storage, team_id, size):
+        blob_service.discard(temp_path)
+        raise HTTPException(status_code=400, detail="Team file storage limit exceeded")
+    try:
+        # Placing the blob may upload the whole file to S3; keep it off the event loop
+        await run_in_threadpool(blob_service.commit, sha256, size, temp_path)
+    except Exception:
+        await run_in_threadpool(quota_service.release_team_storage, team_id, size)
+        raise
     
-    # Save file
-    contents = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
-    
-    # Create file record
-    file_url = f"/api/teams/{team_id}/files/{unique_filename}"
+    # Create file record; the URL names the record, not the stored bytes
+    file_id = PydanticObjectId()
+    file_url = f"/api/teams/{team_id}/files/{file_id}{os.path.splitext(file.filename)[1]}"
     new_file = File(
+        _id=file_id,
         user_id=PydanticObjectId(user_id),
         user_name=user_name,
         filename=file.filename,
         url=file_url,
-        size=len(contents),
+        size=size,
+        sha256=sha256,
         created_at=datetime.now(timezone.utc)
     )
     
-    updated_team = team_service.add_file(team_id, new_file)
+    updated_team = await run_in_threadpool(
+        team_service.add_file, team_id, new_file, projection=team_service.SUMMARY_PROJECTION
+    )
     if updated_team:
+        new_file.preview_url = await run_in_threadpool(
+            preview_service.after_upload, team_id, str(file_id), sha256, file.filename, size
+        )
         return {"message": "File uploaded successfully", "file": new_file}
+    await run_in_threadpool(quota_service.release_team_storage, team_id, size)
+    await run_in_threadpool(blob_service.release, sha256)
     raise HTTPException(status_code=404, detail="Team not found")
 
 
@@ -178,42 +220,38 @@ def get_files(team_id: PydanticObjectId):
 @router.get("/{team_id}/files/{filename}")
 async def download_file(team_id: PydanticObjectId, filename: str):
     """Download a file from a team"""
-    from fastapi.responses import FileResponse
+    record = team_service.get_file(team_id, f"/api/teams/{team_id}/files/{filename}")
+    if record and record.sha256:
+        response = blob_service.download_response(record.sha256, record.filename)
+        if response is not None:
+            return response
     
+    # Uploads from before the blob store live under uploads/<team id>/
     file_path = os.path.join(os.getcwd(), "uploads", str(team_id), filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found")
     
-    return FileResponse(file_path)
+    return file_response(file_path)
 
 
 @router.delete("/{team_id}/files/{file_id}")
 async def delete_file(team_id: PydanticObjectId, file_id: str):
     """Delete a file from a team"""
-    team = team_service.get_team(team_id)
-    if not team:
+    if not team_service.team_exists(team_id):
         raise HTTPException(status_code=404, detail="Team not found")
     
-    # Find the file to get its filename
-    file_to_delete = None
-    for file in team.files:
-        if file.id == file_id:
-            file_to_delete = file
-            break
-    
-    if not file_to_delete:
+    # Delete file record from database
+    removed = team_service.delete_file(team_id, file_id)
+    if not removed:
         raise HTTPException(status_code=404, detail="File not found")
     
-    # Extract filename from URL
-    filename = file_to_delete.url.split('/')[-1]
-    file_path = os.path.join(os.getcwd(), "uploads", str(team_id), filename)
-    
-    # Delete physical file
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    if not removed.get("sha256"):
+        # Delete the physical file of a pre-blob-store upload
+        filename = (removed.get("url") or "").split('/')[-1]
+        file_path = os.path.join(os.getcwd(), "uploads", str(team_id), filename)
+        if filename and os.path.exists(file_path):
+            os.remove(file_path)
     
-    # Delete file record from database
-    updated_team = team_service.delete_file(team_id, file_id)
-    if updated_team:
-        return {"message": "File deleted successfully"}
-    raise HTTPException(status_code=404, detail="Failed to delete file")
+    quota_service.release_team_storage(team_id, removed.get("size") or 0)
+    blob_service.release(removed.get("sha256"))
+    return {"message": "File deleted successfully"}
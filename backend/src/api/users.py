@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Body, HTTPException, Depends
+from fastapi import APIRouter, Body, HTTPException, Depends, Query, Response
 from typing import List
 from services import user_service
 from pydantic import BaseModel, EmailStr
@@ -6,6 +6,8 @@ from models import User, UserOut, PydanticObjectId
 from typing import Optional
 from datetime import datetime, timezone
 from api.auth import get_current_user, verify_password
+from pagination import DEFAULT_LIMIT, MAX_LIMIT, id_match, next_cursor, page_headers
+from fields import fields_query, model_response
 
 router = APIRouter()
 
@@ -44,8 +46,29 @@ def create_user(user_data: UserCreateRequest = Body(...)):
 
 
 @router.get("/", response_model=List[UserOut])
-def get_users():
-    return user_service.get_users()
+def get_users(
+    response: Response,
+    limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    after: Optional[PydanticObjectId] = None,
+    fields: Optional[List[str]] = Depends(fields_query),
+    role: Optional[str] = None,
+    school_id: Optional[str] = None,
+    email: Optional[str] = None,
+    include_total: bool = False,
+):
+    filters = {}
+    if role:
+        filters["role"] = role
+    if school_id:
+        filters["school_id"] = id_match(school_id)
+    if email:
+        filters["email"] = email
+
+    users = user_service.get_users(filters, after, limit, fields)
+    total = user_service.count_users(filters) if include_total else None
+    headers = page_headers(next_cursor(users, limit), total)
+    response.headers.update(headers)
+    return model_response(users, fields, headers)
 
 
 @router.delete("/me")
@@ -58,19 +81,22 @@ def delete_own_account(
     if not verify_password(request.password, current_user.password):
         raise HTTPException(status_code=401, detail="Invalid password")
     
-    # Delete the user
-    result = user_service.delete_user(current_user.id)
+    # Delete the user; their messages, files and memberships are erased in
+    # the background
+    result = user_service.delete_user(current_user.id, current_user.id)
     if result["deleted_count"] == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {"message": "Account deleted successfully"}
+    return {"message": "Account deleted successfully", "deletion_id": result["deletion_id"]}
 
 
 @router.get("/{user_id}", response_model=UserOut)
-def get_user(user_id: PydanticObjectId):
-    user = user_service.get_user(user_id)
+def get_user(
+    user_id: PydanticObjectId, fields: Optional[List[str]] = Depends(fields_query)
+):
+    user = user_service.get_user(user_id, fields)
     if user:
-        return user
+        return model_response(user, fields)
     raise HTTPException(status_code=404, detail="User not found")
 
 
@@ -92,5 +118,5 @@ def delete_user(user_id: PydanticObjectId):
     result = user_service.delete_user(user_id)
     if result["deleted_count"] == 0:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"message": "User deleted successfully"}
+    return {"message": "User deleted successfully", "deletion_id": result["deletion_id"]}
 
@@ -0,0 +1,170 @@
+"""ZIP archives of team files, streamed as they are built.
+
+``stream_zip`` writes entries through ``zipfile`` into a tiny buffer that
+is drained after every write, so a download of a whole competition holds at
+most one read chunk in memory and never touches a temporary file. Entries
+use data descriptors (sizes and CRC after the data), which every common
+unzip tool understands, and ZIP64 where needed.
+
+Formats that are already compressed (images, video, PDFs, Office documents,
+archives) are stored as-is; deflating them again costs CPU for nothing.
+"""
+
+import os
+import zipfile
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from services import blob_service
+from storage import UPLOAD_DIR, get_storage
+
+READ_CHUNK_SIZE = 256 * 1024
+STORED_EXTENSIONS = {
+    ".7z", ".aac", ".avif", ".bz2", ".docx", ".epub", ".flac", ".gif", ".gz",
+    ".heic", ".jar", ".jpeg", ".jpg", ".m4a", ".mkv", ".mov", ".mp3", ".mp4",
+    ".odp", ".ods", ".odt", ".ogg", ".pdf", ".png", ".pptx", ".rar", ".webm",
+    ".webp", ".xlsx", ".xz", ".zip", ".zst",
+}
+
+
+class ArchiveEntry(NamedTuple):
+    name: str
+    size: int
+    modified: Optional[datetime]
+    open: Callable[[], object]
+
+
+class _Drain:
+    """Write-only, unseekable sink that hands out what was written so far."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def compression_for(filename: str) -> int:
+    if os.path.splitext(filename)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def stream_zip(entries: Iterable[ArchiveEntry]) -> Iterator[bytes]:
+    """Yield a ZIP archive of ``entries`` piece by piece."""
+    sink = _Drain()
+    # A sink without seek() makes zipfile write data descriptors
+    with zipfile.ZipFile(sink, mode="w", allowZip64=True) as archive:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, _date_time(entry.modified))
+            info.compress_type = compression_for(entry.name)
+            # Only used to decide whether the entry needs ZIP64 extensions
+            info.file_size = entry.size
+            # Plain read/write permissions when extracted on Unix
+            info.external_attr = 0o644 << 16
+            try:
+                source = entry.open()
+            except FileNotFoundError:
+                # Deleted since the listing was read
+                continue
+            try:
+                with archive.open(info, mode="w") as target:
+                    while chunk := source.read(READ_CHUNK_SIZE):
+                        target.write(chunk)
+                        if data := sink.take():
+                            yield data
+            finally:
+                source.close()
+            if data := sink.take():
+                yield data
+    yield sink.take()
+
+
+def _date_time(modified: Optional[datetime]):
+    if modified is None or modified.year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return modified.timetuple()[:6]
+
+
+def _safe_name(name: str) -> str:
+    name = name.replace("\\", "/").split("/")[-1].strip() or "file"
+    return "_" if name in (".", "..") else name
+
+
+def folder_name(name: str) -> str:
+    """A team or competition name usable as a folder or download name."""
+    name = name.replace("/", "-").replace("\\", "-").strip()
+    return "_" if name in ("", ".", "..") else name
+
+
+def unique_name(folder: str, filename: str, used: Dict[str, int]) -> str:
+    """``folder/filename``, numbered like ``report (2).pdf`` on collisions."""
+    base, extension = os.path.splitext(_safe_name(filename))
+    name = f"{folder}/{base}{extension}"
+    count = used.get(name.lower(), 0)
+    used[name.lower()] = count + 1
+    while count:
+        candidate = f"{folder}/{base} ({count + 1}){extension}"
+        if candidate.lower() not in used:
+            used[candidate.lower()] = 1
+            return candidate
+        count += 1
+    return name
+
+
+def _source(team_id: str, record: dict) -> Optional[Callable[[], object]]:
+    """Opener for a file record's content, or None if it is gone."""
+    if record.get("sha256"):
+        key = blob_service.blob_key(record["sha256"])
+        return lambda: get_storage().open(key)
+    url = record.get("url") or ""
+    if url.startswith("/api/teams/"):
+        path = os.path.join(UPLOAD_DIR, team_id, url.rsplit("/", 1)[-1])
+    else:
+        path = os.path.join(UPLOAD_DIR, f"{record.get('_id')}_{record.get('filename')}")
+    if not os.path.exists(path):
+        return None
+    return lambda: open(path, "rb")
+
+
+def team_file_entries(teams: Iterable[dict]) -> Iterator[ArchiveEntry]:
+    """Archive entries for the files of ``teams``, one folder per team.
+
+    ``teams`` need ``name`` and ``files``. Files whose content is missing
+    are skipped rather than failing the download halfway through.
+    """
+    used: Dict[str, int] = {}
+    for team in teams:
+        team_id = str(team["_id"])
+        folder = folder_name(team.get("name") or team_id)
+        if folder.lower() in used:
+            folder = f"{folder} ({team_id[-6:]})"
+        used[folder.lower()] = 1
+        for record in team.get("files", []):
+            opener = _source(team_id, record)
+            if opener is None:
+                continue
+            modified = record.get("created_at")
+            if isinstance(modified, str):
+                modified = datetime.fromisoformat(modified)
+            yield ArchiveEntry(
+                unique_name(folder, record.get("filename") or "file", used),
+                record.get("size") or 0,
+                modified,
+                opener,
+            )
@@ -4,6 +4,8 @@ from dotenv import load_dotenv, find_dotenv
 import os
 
 from pymongo.synchronous.database import Database
+from metrics import PoolMetricsListener
+from slow_queries import listener_from_env
 
 # Load from .env.local file in project root
 load_dotenv(find_dotenv(".env.local", usecwd=True))
@@ -19,7 +21,11 @@ _db = None
 def get_db():
     global _client, _db
     if _db is None:
-        _client = MongoClient(MONGO_URI)
+        listeners = [PoolMetricsListener()]
+        slow_query_listener = listener_from_env()
+        if slow_query_listener:
+            listeners.append(slow_query_listener)
+        _client = MongoClient(MONGO_URI, event_listeners=listeners)
         # Use test database if in test mode
         if os.getenv("TEST_MODE") == "true":
             _db = _client[TEST_DATABASE]
@@ -32,3 +38,38 @@ get_db()
 
 db: Database = cast(Database, _db)
 client: MongoClient = cast(MongoClient, _client)
+
+
+def ensure_indexes():
+    """Create the indexes queries rely on; idempotent, run at startup."""
+    teams = db.get_collection("teams")
+    # File downloads resolve a file id or URL to its record
+    teams.create_index("files._id")
+    teams.create_index("files.url")
+    # Previews and the garbage collector find the records sharing a blob
+    teams.create_index("files.sha256", sparse=True)
+    # Exports and erasure find a user's memberships, messages, uploads,
+    # join requests and registration token
+    teams.create_index("members.user_id")
+    teams.create_index("chat.user_id")
+    teams.create_index("files.user_id")
+    join_requests = db.get_collection("join_requests")
+    join_requests.create_index("user_id")
+    join_requests.create_index("approvals")
+    db.get_collection("registration_tokens").create_index("used_by", sparse=True)
+    db.get_collection("upload_sessions").create_index("expires_at")
+    db.get_collection("blobs").create_index(
+        "unreferenced_at", partialFilterExpression={"unreferenced_at": {"$exists": True}}
+    )
+    jobs = db.get_collection("jobs")
+    # Job workers claim the next due job of a type, and take over running
+    # jobs whose lease expired
+    jobs.create_index([("type", 1), ("status", 1), ("run_after", 1)])
+    jobs.create_index([("type", 1), ("status", 1), ("lease_until", 1)])
+    # At most one running job per slot, which caps each type's concurrency
+    jobs.create_index(
+        [("type", 1), ("slot", 1)],
+        unique=True,
+        partialFilterExpression={"status": "running"},
+    )
+    jobs.create_index([("status", 1), ("finished_at", 1)])
@@ -0,0 +1,107 @@
+"""Weak ETags and conditional GET for polled JSON endpoints.
+
+A tag is a digest of the ``_id``, ``updated_at`` and ``version`` of every
+document a response is built from, plus whatever else shapes the body (the
+caller, the requested fields). Revalidating a tag therefore only needs those
+stamp fields, so an unchanged resource is answered with ``304 Not Modified``
+without loading or serializing the full documents.
+
+Writers keep the stamps honest by passing their update through ``touch``.
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from fastapi import Request, Response
+
+STAMP_FIELDS = ("updated_at", "version")
+STAMP_PROJECTION = {"_id": 1, "updated_at": 1, "version": 1}
+# Clients may store the body but must revalidate before every use
+CACHE_CONTROL = "private, no-cache"
+
+
+def touch(update):
+    """Add an ``updated_at``/``version`` bump to a Mongo update.
+
+    Accepts both update documents and aggregation pipeline updates.
+    """
+    if isinstance(update, list):
+        return [
+            *update,
+            {
+                "$set": {
+                    "updated_at": "$$NOW",
+                    "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]},
+                }
+            },
+        ]
+    touched = dict(update)
+    touched["$set"] = {**update.get("$set", {}), "updated_at": datetime.now(timezone.utc)}
+    touched["$inc"] = {**update.get("$inc", {}), "version": 1}
+    return touched
+
+
+def with_stamps(projection: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+    """Make sure an inclusion projection still returns the stamp fields."""
+    if not projection or 1 not in projection.values():
+        return projection
+    return {**projection, **{field: 1 for field in STAMP_FIELDS}}
+
+
+def _stamp(document: Dict[str, Any]) -> str:
+    updated_at = document.get("updated_at")
+    if isinstance(updated_at, datetime):
+        updated_at = updated_at.isoformat()
+    return f"{document.get('_id', document.get('id'))}:{updated_at}:{document.get('version', 0)}"
+
+
+def compute_etag(documents: Iterable[Dict[str, Any]], *scope: Any) -> str:
+    """Weak ETag over the stamps of ``documents`` and the extra ``scope`` values."""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in scope:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+    # Order independent, so the tag does not depend on the query plan
+    for stamp in sorted(_stamp(document) for document in documents):
+        digest.update(stamp.encode())
+        digest.update(b"\n")
+    return f'W/"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an ``If-None-Match`` header against ``etag``."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == opaque
+        for candidate in if_none_match.split(",")
+    )
+
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
+
+
+def check_not_modified(
+    request: Request, stamps: Callable[[], Iterable[Dict[str, Any]]], *scope: Any
+) -> Optional[Response]:
+    """A 304 response when the client's tag is still current, otherwise None.
+
+    ``stamps`` is only called for conditional requests; it should query the
+    same documents as the handler, projected with ``STAMP_PROJECTION``.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    etag = compute_etag(stamps(), *scope)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return None
@@ -0,0 +1,112 @@
+"""Sparse fieldsets: ``?fields=name,teams.name`` on JSON read endpoints.
+
+The same field list drives both the Mongo projection (so unrequested data
+never leaves the database) and the trimming of the response body (so fields
+a handler needs internally, like ``members`` for a membership check, are not
+sent back). Dotted paths select inside embedded documents and arrays.
+Identifiers (``id``/``_id``) are always kept so clients can address what
+they received.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import Query
+from pydantic import BaseModel
+
+from pagination import parse_fields, projection_for
+from responses import FastJSONResponse
+
+ID_FIELDS = ("id", "_id")
+
+
+def fields_query(
+    fields: Optional[str] = Query(
+        None, description="Comma separated fields to return, e.g. name,teams.name"
+    ),
+) -> Optional[List[str]]:
+    """Dependency parsing the ``fields`` query parameter; None means everything."""
+    return parse_fields(fields)
+
+
+def wants(fields: Optional[List[str]], name: str) -> bool:
+    """Whether ``name`` (or anything inside it) was requested."""
+    if fields is None:
+        return True
+    return any(field == name or field.startswith(name + ".") for field in fields)
+
+
+def subfields(fields: Optional[List[str]], name: str) -> Optional[List[str]]:
+    """Fields requested inside ``name``; None when the whole value was requested."""
+    if fields is None or name in fields:
+        return None
+    prefix = name + "."
+    return [field[len(prefix):] for field in fields if field.startswith(prefix)]
+
+
+def projection(
+    fields: Optional[List[str]],
+    required: Iterable[str] = (),
+    default: Optional[Dict[str, int]] = None,
+) -> Optional[Dict[str, int]]:
+    """Mongo projection for ``fields`` plus what the handler itself reads.
+
+    ``default`` is used when no fields were requested.
+    """
+    if fields is None:
+        return default
+    return projection_for(fields, required)
+
+
+def _tree(fields: Iterable[str]) -> Dict[str, Any]:
+    tree: Dict[str, Any] = {}
+    for field in fields:
+        head, _, rest = field.partition(".")
+        if not rest:
+            tree[head] = None
+        elif tree.get(head, {}) is not None:
+            tree.setdefault(head, {})
+            tree[head] = {**tree[head], **_tree([rest])}
+    return tree
+
+
+def _apply(value: Any, tree: Optional[Dict[str, Any]]) -> Any:
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_apply(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    trimmed = {key: value[key] for key in ID_FIELDS if key in value}
+    for key, subtree in tree.items():
+        if key in value:
+            trimmed[key] = _apply(value[key], subtree)
+    return trimmed
+
+
+def trim(document: Any, fields: Optional[List[str]]) -> Any:
+    """Keep only the requested fields of a document or list of documents."""
+    if fields is None:
+        return document
+    return _apply(document, _tree(fields))
+
+
+def model_response(
+    content: Any, fields: Optional[List[str]], headers: Optional[Dict[str, str]] = None
+):
+    """Trim response_model results; returns them untouched when no fields were asked.
+
+    Returning a response directly skips FastAPI's response_model validation,
+    which would otherwise reject the trimmed documents.
+    """
+    if fields is None:
+        return content
+    if isinstance(content, list):
+        dumped = [
+            item.model_dump(by_alias=True) if isinstance(item, BaseModel) else item
+            for item in content
+        ]
+    elif isinstance(content, BaseModel):
+        dumped = content.model_dump(by_alias=True)
+    else:
+        dumped = content
+    return FastJSONResponse(trim(dumped, fields), headers=headers)
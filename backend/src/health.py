@@ -0,0 +1,94 @@
+"""Liveness and readiness checks used by the /health endpoints."""
+
+import asyncio
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+import pymongo
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+
+MONGO_PING_TIMEOUT_SECONDS = float(os.getenv("HEALTH_MONGO_TIMEOUT_SECONDS", "2"))
+UPLOADS_MIN_FREE_BYTES = int(os.getenv("HEALTH_UPLOADS_MIN_FREE_MB", "500")) * 1024 * 1024
+MAX_EVENT_LOOP_LAG_SECONDS = float(os.getenv("HEALTH_MAX_LOOP_LAG_SECONDS", "1"))
+CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", "2"))
+UPLOAD_DIR = "uploads"
+
+
+def check_mongo() -> Dict[str, Any]:
+    from database import client
+
+    started = time.perf_counter()
+    try:
+        # Client-side operation timeout, so a dead server fails fast
+        # instead of waiting for the 30s server selection default
+        with pymongo.timeout(MONGO_PING_TIMEOUT_SECONDS):
+            client.admin.command("ping")
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+    return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+def check_uploads() -> Dict[str, Any]:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    try:
+        usage = shutil.disk_usage(UPLOAD_DIR)
+    except OSError as e:
+        return {"ok": False, "error": str(e)}
+    writable = os.access(UPLOAD_DIR, os.W_OK)
+    return {
+        "ok": writable and usage.free >= UPLOADS_MIN_FREE_BYTES,
+        "writable": writable,
+        "free_bytes": usage.free,
+        "min_free_bytes": UPLOADS_MIN_FREE_BYTES,
+    }
+
+
+def check_event_loop() -> Dict[str, Any]:
+    lag = metrics.loop_lag_monitor.lag
+    return {
+        "ok": lag <= MAX_EVENT_LOOP_LAG_SECONDS,
+        "lag_seconds": round(lag, 4),
+        "max_lag_seconds": MAX_EVENT_LOOP_LAG_SECONDS,
+    }
+
+
+class ReadinessProbe:
+    """Runs the dependency checks, caching the result for a short window.
+
+    Concurrent probes share one in-flight check, so orchestrators polling
+    several endpoints at once never multiply the load on MongoDB.
+    """
+
+    def __init__(self, ttl: float = CACHE_SECONDS):
+        self.ttl = ttl
+        self._result: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def invalidate(self):
+        self._result = None
+
+    async def check(self) -> Dict[str, Any]:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            if self._result is not None and now - self._checked_at < self.ttl:
+                return self._result
+            mongo, uploads = await asyncio.gather(
+                run_in_threadpool(check_mongo), run_in_threadpool(check_uploads)
+            )
+            checks = {"mongo": mongo, "uploads": uploads, "event_loop": check_event_loop()}
+            self._result = {
+                "status": "ok" if all(c["ok"] for c in checks.values()) else "fail",
+                "checks": checks,
+            }
+            self._checked_at = time.monotonic()
+            return self._result
+
+
+readiness_probe = ReadinessProbe()
@@ -1,19 +1,61 @@
-from fastapi import FastAPI, Request, status, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+from fastapi import (
+    Depends,
+    FastAPI,
+    Header,
+    Request,
+    status,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv, find_dotenv
+import hmac
 import os
+import time
+import uuid
 import logging
 from typing import Dict, List
+import metrics
+import request_context
+from logging_config import configure_logging
+from responses import FastJSONResponse
+from health import readiness_probe, check_event_loop
+from response_compression import CompressionMiddleware
+from database import ensure_indexes
+from services import invalidation_bus, job_service, preview_service
+from starlette.concurrency import run_in_threadpool
 
 # Load environment variables from the project root .env.local file
 load_dotenv(find_dotenv(".env.local", usecwd=True))
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+configure_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Off when jobs run in a separate `python -m worker` process
+JOB_WORKER_EMBEDDED = os.getenv("JOB_WORKER_EMBEDDED", "true").lower() != "false"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        await run_in_threadpool(ensure_indexes)
+    except Exception:
+        logger.warning("Could not create MongoDB indexes", exc_info=True)
+    metrics.loop_lag_monitor.start()
+    invalidation_bus.invalidation_bus.start()
+    if JOB_WORKER_EMBEDDED:
+        job_service.job_worker.start()
+    yield
+    await job_service.job_worker.stop()
+    await invalidation_bus.invalidation_bus.stop()
+    preview_service.shutdown()
+    await metrics.loop_lag_monitor.stop()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # Configure CORS
 origins = [
@@ -27,7 +69,9 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Request-ID", "ETag", "Upload-Offset"],
 )
+app.add_middleware(CompressionMiddleware)
 
 
 # Global exception handler
@@ -40,11 +84,66 @@ async def validation_exception_handler(request: Request, exc: Exception):
     )
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    metrics.http_requests_in_progress.inc()
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metrics.http_requests_in_progress.dec()
+        # Label by route template, not raw path, to keep cardinality bounded
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        metrics.http_requests_total.inc(
+            method=request.method, route=route_path, status=status_code
+        )
+        metrics.http_request_duration_seconds.observe(
+            time.perf_counter() - started, method=request.method, route=route_path
+        )
+
+
+@app.middleware("http")
+async def bind_request_context(request: Request, call_next):
+    # Reuse the proxy's correlation ID when present so logs join up end to end
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    scope_token = request_context.bind_scope(request.scope)
+    request_id_token = request_context.bind_request_id(request_id)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_context.reset_request_id(request_id_token)
+        request_context.reset_scope(scope_token)
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/health/live")
+async def liveness_check():
+    # Only proves the worker is scheduling coroutines; deliberately does not
+    # touch dependencies so a database outage does not restart every worker
+    return {"status": "ok", "event_loop": check_event_loop()}
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    result = await readiness_probe.check()
+    status_code = (
+        status.HTTP_200_OK
+        if result["status"] == "ok"
+        else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    return JSONResponse(status_code=status_code, content=result)
+
+
 # Include routers here as they are created
 from api import (
     users,
@@ -71,6 +170,24 @@ app.include_router(
 )
 
 
+def verify_metrics_access(authorization: str = Header(None)):
+    # Scrapers authenticate with METRICS_TOKEN so they do not need an admin
+    # login; anyone else has to be an admin
+    scrape_token = os.getenv("METRICS_TOKEN")
+    if scrape_token and authorization and hmac.compare_digest(
+        authorization, f"Bearer {scrape_token}"
+    ):
+        return
+    admin.verify_admin_token(auth.get_current_user(authorization))
+
+
+@app.get("/metrics", dependencies=[Depends(verify_metrics_access)])
+async def metrics_endpoint():
+    return PlainTextResponse(
+        metrics.render_latest(), media_type="text/plain; version=0.0.4"
+    )
+
+
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
@@ -81,10 +198,12 @@ class ConnectionManager:
         if team_id not in self.active_connections:
             self.active_connections[team_id] = []
         self.active_connections[team_id].append(websocket)
+        metrics.websocket_connections.inc()
 
     def disconnect(self, websocket: WebSocket, team_id: str):
         if team_id in self.active_connections:
             self.active_connections[team_id].remove(websocket)
+            metrics.websocket_connections.dec()
             if not self.active_connections[team_id]:
                 del self.active_connections[team_id]
 
@@ -0,0 +1,359 @@
+"""In-process metrics registry rendered in the Prometheus text format.
+
+Kept dependency-free on purpose: every worker keeps its own counters and the
+scraper aggregates across workers, exactly like the official client does in
+single-process mode.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+
+# Latency buckets in seconds, tuned for an API that mostly answers in < 1s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = [0] * len(self.buckets) + [0.0, 0]
+                self._values[key] = state
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[-1] if state else 0
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, state):
+                cumulative += bucket_count
+                labels = _format_labels(
+                    self.labelnames, key, ("le", _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_requests_total = REGISTRY.register(
+    Counter(
+        "projektor_http_requests_total",
+        "HTTP requests handled, by route template, method and status code.",
+        ("method", "route", "status"),
+    )
+)
+http_request_duration_seconds = REGISTRY.register(
+    Histogram(
+        "projektor_http_request_duration_seconds",
+        "HTTP request latency in seconds, by route template and method.",
+        ("method", "route"),
+    )
+)
+http_requests_in_progress = REGISTRY.register(
+    Gauge(
+        "projektor_http_requests_in_progress",
+        "HTTP requests currently being handled.",
+    )
+)
+websocket_connections = REGISTRY.register(
+    Gauge(
+        "projektor_websocket_connections",
+        "Open chat websocket connections.",
+    )
+)
+upload_bytes_total = REGISTRY.register(
+    Counter(
+        "projektor_upload_bytes_total",
+        "Bytes received through file upload endpoints.",
+        ("endpoint",),
+    )
+)
+uploads_total = REGISTRY.register(
+    Counter(
+        "projektor_uploads_total",
+        "Files received through file upload endpoints.",
+        ("endpoint",),
+    )
+)
+mongo_pool_connections = REGISTRY.register(
+    Gauge(
+        "projektor_mongo_pool_connections",
+        "Open connections in the MongoDB pool, by server address.",
+        ("address",),
+    )
+)
+mongo_pool_checked_out = REGISTRY.register(
+    Gauge(
+        "projektor_mongo_pool_checked_out",
+        "Connections currently checked out of the MongoDB pool.",
+        ("address",),
+    )
+)
+mongo_pool_checkout_failures_total = REGISTRY.register(
+    Counter(
+        "projektor_mongo_pool_checkout_failures_total",
+        "Failed MongoDB connection checkouts, by reason.",
+        ("address", "reason"),
+    )
+)
+mongo_pool_checkout_wait_seconds = REGISTRY.register(
+    Histogram(
+        "projektor_mongo_pool_checkout_wait_seconds",
+        "Time spent waiting for a MongoDB connection.",
+        ("address",),
+        buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+    )
+)
+event_loop_lag_seconds = REGISTRY.register(
+    Gauge(
+        "projektor_event_loop_lag_seconds",
+        "Most recent event loop scheduling delay in seconds.",
+    )
+)
+event_loop_lag_max_seconds = REGISTRY.register(
+    Gauge(
+        "projektor_event_loop_lag_max_seconds",
+        "Largest event loop scheduling delay seen since the previous scrape.",
+    )
+)
+
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Feeds pymongo connection pool events into the registry."""
+
+    def __init__(self):
+        self._checkout_started: Dict[int, float] = {}
+
+    def pool_created(self, event):
+        mongo_pool_connections.set(0, address=_address(event))
+        mongo_pool_checked_out.set(0, address=_address(event))
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        mongo_pool_connections.remove(address=_address(event))
+        mongo_pool_checked_out.remove(address=_address(event))
+
+    def connection_created(self, event):
+        mongo_pool_connections.inc(address=_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_connections.dec(address=_address(event))
+
+    def connection_check_out_started(self, event):
+        self._checkout_started[threading.get_ident()] = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._checkout_started.pop(threading.get_ident(), None)
+        mongo_pool_checkout_failures_total.inc(
+            address=_address(event), reason=str(event.reason)
+        )
+
+    def connection_checked_out(self, event):
+        started = self._checkout_started.pop(threading.get_ident(), None)
+        if started is not None:
+            mongo_pool_checkout_wait_seconds.observe(
+                time.perf_counter() - started, address=_address(event)
+            )
+        mongo_pool_checked_out.inc(address=_address(event))
+
+    def connection_checked_in(self, event):
+        mongo_pool_checked_out.dec(address=_address(event))
+
+
+class EventLoopLagMonitor:
+    """Measures how late the event loop wakes up a periodic sleeper."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+            event_loop_lag_seconds.set(self.lag)
+            if self.lag > event_loop_lag_max_seconds.value():
+                event_loop_lag_max_seconds.set(self.lag)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+loop_lag_monitor = EventLoopLagMonitor()
+
+
+def render_latest() -> str:
+    output = REGISTRY.render()
+    # The max gauge is a "since last scrape" window
+    event_loop_lag_max_seconds.set(loop_lag_monitor.lag)
+    return output
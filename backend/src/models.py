@@ -115,6 +115,8 @@ class File(BaseModel):
     filename: str
     url: str
     size: int
+    sha256: Optional[str] = None  # Content hash; set when stored in the blob store
+    preview_url: Optional[str] = None  # Small JPEG of images and PDFs, once rendered
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
@@ -0,0 +1,90 @@
+"""Keyset pagination and field selection helpers for list queries.
+
+Pages are ordered by ``_id`` and continued with ``after=<last id>``, so each
+page is an index range scan regardless of how deep the client has paged.
+Page metadata travels in response headers to keep list bodies unchanged.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+
+def id_match(value) -> dict:
+    """Match a reference stored either as a string or as an ObjectId."""
+    value = str(value)
+    if ObjectId.is_valid(value):
+        return {"$in": [value, ObjectId(value)]}
+    return {"$eq": value}
+
+
+def any_id(values) -> dict:
+    """Match any of ``values``, stored either as strings or as ObjectIds."""
+    matches = []
+    for value in values:
+        matches.append(str(value))
+        if ObjectId.is_valid(str(value)):
+            matches.append(ObjectId(str(value)))
+    return {"$in": matches}
+
+
+def page_query(filters: dict, after: Optional[ObjectId] = None) -> dict:
+    if after is None:
+        return filters
+    return {**filters, "_id": {"$gt": after}}
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Split a comma separated ``fields`` parameter; None means all fields."""
+    if not fields:
+        return None
+    parsed = [field.strip() for field in fields.split(",") if field.strip()]
+    return parsed or None
+
+
+def projection_for(
+    fields: Optional[Iterable[str]],
+    required: Iterable[str] = (),
+    excluded: Iterable[str] = (),
+) -> Optional[Dict[str, int]]:
+    """Build a Mongo projection for the requested fields.
+
+    ``required`` fields are always included because the response model
+    cannot be built without them; ``excluded`` fields are never returned.
+    """
+    excluded = set(excluded)
+    if fields is None:
+        return {field: 0 for field in excluded} or None
+    selected = (set(fields) | set(required)) - excluded
+    # Mongo rejects overlapping paths such as "members" with "members.name"
+    paths = {
+        path
+        for path in selected
+        if not any(path.startswith(other + ".") for other in selected)
+        and not any(path.startswith(other + ".") for other in excluded)
+    }
+    projection = {field: 1 for field in sorted(paths)}
+    projection["_id"] = 1
+    return projection
+
+
+def next_cursor(items: list, limit: Optional[int]) -> Optional[str]:
+    """The cursor for the following page, or None when this page is the last."""
+    if not limit or len(items) < limit:
+        return None
+    return str(items[-1].id)
+
+
+def page_headers(cursor: Optional[str], total: Optional[int] = None) -> Dict[str, str]:
+    headers = {}
+    if cursor is not None:
+        headers[NEXT_CURSOR_HEADER] = cursor
+    if total is not None:
+        headers[TOTAL_COUNT_HEADER] = str(total)
+    return headers
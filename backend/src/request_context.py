@@ -0,0 +1,44 @@
+"""Per-request context shared with code that has no access to the Request.
+
+Sync handlers run in the threadpool with a copy of the caller's context, so
+values set by the middleware are visible to pymongo listeners and loggers.
+"""
+
+from contextvars import ContextVar
+from typing import Optional
+
+_current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+
+def bind_scope(scope: dict):
+    return _current_scope.set(scope)
+
+
+def reset_scope(token):
+    _current_scope.reset(token)
+
+
+def current_route() -> str:
+    """Route template of the request being handled, e.g. /api/student/teams/{team_id}."""
+    scope = _current_scope.get()
+    if scope is None:
+        return "-"
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    return scope.get("path", "-")
+
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def bind_request_id(request_id: str):
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
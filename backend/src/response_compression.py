@@ -0,0 +1,272 @@
+"""Negotiated response compression (zstd, brotli, gzip).
+
+``CompressionMiddleware`` picks the best encoding the client accepts, leaves
+bodies under ``COMPRESSION_MIN_BYTES`` alone and compresses everything else
+as it streams through, so large chat histories and team listings never sit
+in memory twice. Only textual content types are touched; uploads such as
+images, archives and PDFs are already compressed.
+
+gzip is always available. brotli and zstd are used when the ``brotli`` and
+``zstandard`` packages are installed.
+"""
+
+import os
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+# Server preference, best first; the client's q-values take precedence
+PREFERRED_ENCODINGS = [
+    encoding.strip()
+    for encoding in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+    if encoding.strip()
+]
+GZIP_LEVEL = 6
+# Levels tuned for dynamic responses: close to the best ratio at a fraction
+# of the CPU of the maximum settings
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+)
+# Streams whose consumers need every event as soon as it is written
+_NEVER_COMPRESS_TYPES = ("text/event-stream",)
+
+response_bytes_total = metrics.REGISTRY.register(
+    metrics.Counter(
+        "projektor_http_compression_bytes_total",
+        "Response body bytes before (identity) and after (encoded) compression.",
+        ("encoding", "stage"),
+    )
+)
+
+
+class _GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_encoders() -> Dict[str, Callable]:
+    encoders: Dict[str, Callable] = {"gzip": _GzipEncoder}
+    if brotli is not None:
+        encoders["br"] = _BrotliEncoder
+    if zstandard is not None:
+        encoders["zstd"] = _ZstdEncoder
+    return encoders
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    encoder = available_encoders()[encoding]()
+    return encoder.compress(data) + encoder.finish()
+
+
+def negotiate(accept_encoding: str, supported: Sequence[str]) -> Optional[str]:
+    """Choose an encoding from ``supported`` (in preference order) for a request."""
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+
+    best, best_q = None, 0.0
+    for coding in supported:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def _compressible(message: Message) -> bool:
+    status = message["status"]
+    if status < 200 or status in (204, 206, 304):
+        return False
+    headers = Headers(raw=message["headers"])
+    if "content-encoding" in headers or "content-range" in headers:
+        return False
+    if "no-transform" in headers.get("cache-control", ""):
+        return False
+    content_type = headers.get("content-type", "").lower()
+    if content_type.startswith(_NEVER_COMPRESS_TYPES):
+        return False
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = MIN_BYTES,
+        encodings: Optional[List[str]] = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        encoders = available_encoders()
+        self.encoders = encoders
+        self.encodings = [e for e in (encodings or PREFERRED_ENCODINGS) if e in encoders]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        encoding = negotiate(accept_encoding, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressingSend(
+            send, encoding, self.encoders[encoding], self.minimum_size
+        )
+        await self.app(scope, receive, responder)
+
+
+class _CompressingSend:
+    """Wraps ``send`` for one response.
+
+    The start message is held back until enough body has been seen to know
+    whether the response reaches the size threshold. Small or single-part
+    bodies are compressed in one go and keep an exact Content-Length; longer
+    streams are compressed chunk by chunk with chunked transfer encoding.
+    """
+
+    def __init__(self, send: Send, encoding: str, encoder_factory: Callable, minimum_size: int):
+        self.send = send
+        self.encoding = encoding
+        self.encoder_factory = encoder_factory
+        self.minimum_size = minimum_size
+        self.start: Optional[Message] = None
+        self.passthrough = False
+        self.buffer = bytearray()
+        self.encoder = None
+
+    async def __call__(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            if _compressible(message):
+                self.start = message
+            else:
+                self.passthrough = True
+                await self.send(message)
+            return
+
+        if self.passthrough or message["type"] != "http.response.body":
+            # e.g. http.response.pathsend, which the server streams from disk
+            await self._flush_start()
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is not None:
+            await self._send_compressed(body, more_body)
+            return
+
+        self.buffer += body
+        if len(self.buffer) < self.minimum_size:
+            if more_body:
+                return
+            # Too small to be worth it, send it as it came
+            await self._flush_start()
+            await self.send({"type": "http.response.body", "body": bytes(self.buffer)})
+            return
+
+        self.encoder = self.encoder_factory()
+        buffered, self.buffer = bytes(self.buffer), bytearray()
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        etag = headers.get("etag")
+        if etag and not etag.startswith("W/"):
+            # The encoded bytes differ, so a strong validator no longer holds
+            headers["ETag"] = "W/" + etag
+
+        if not more_body:
+            compressed = self.encoder.compress(buffered) + self.encoder.finish()
+            headers["Content-Length"] = str(len(compressed))
+            self._count(len(buffered), len(compressed))
+            await self._flush_start()
+            await self.send({"type": "http.response.body", "body": compressed})
+            return
+
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        await self._flush_start()
+        await self._send_compressed(buffered, more_body=True)
+
+    async def _flush_start(self) -> None:
+        if self.start is not None:
+            start, self.start = self.start, None
+            await self.send(start)
+
+    async def _send_compressed(self, body: bytes, more_body: bool) -> None:
+        compressed = self.encoder.compress(body)
+        if not more_body:
+            compressed += self.encoder.finish()
+        self._count(len(body), len(compressed))
+        # The compressor buffers internally; skip empty frames mid-stream
+        if compressed or not more_body:
+            await self.send(
+                {"type": "http.response.body", "body": compressed, "more_body": more_body}
+            )
+
+    def _count(self, identity: int, encoded: int) -> None:
+        response_bytes_total.inc(identity, encoding=self.encoding, stage="identity")
+        response_bytes_total.inc(encoded, encoding=self.encoding, stage="encoded")
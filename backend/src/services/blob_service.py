@@ -0,0 +1,199 @@
+"""Content-addressed, deduplicated storage for uploaded files.
+
+Uploads are hashed with SHA-256 while they stream to a temporary file and
+then stored once under the key ``blobs/<aa>/<bb>/<sha256>`` of the
+configured storage backend, however many file records point at them. The ``blobs`` collection counts those records:
+adding a file record takes a reference, deleting one releases it. Blobs
+whose count drops to zero are only marked as unreferenced; removing them
+from disk is left to the garbage collector, which must first mark the blob
+as ``deleting`` so a concurrent upload of the same content waits instead of
+losing its bytes.
+"""
+
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Iterable, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from storage import UPLOAD_DIR, get_storage
+
+BLOB_DIRNAME = "blobs"
+# Uploads are hashed into local temporary files whatever the backend
+TEMP_DIR = os.path.join(UPLOAD_DIR, BLOB_DIRNAME, "tmp")
+CHUNK_SIZE = 1024 * 1024
+# How long add_reference waits for a blob that is being garbage collected
+_DELETING_RETRY_SECONDS = 0.05
+_DELETING_RETRIES = 100
+
+_blobs_collection = db.get_collection("blobs")
+
+
+def blob_key(sha256: str) -> str:
+    # Two levels of fan-out keep directories small
+    return f"{BLOB_DIRNAME}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+def _temp_path(temp_dir: str) -> str:
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, uuid.uuid4().hex)
+
+
+def write_chunks(chunks: Iterable[bytes], temp_dir: str = TEMP_DIR) -> Tuple[str, int, str]:
+    """Stream ``chunks`` to a temporary file, hashing as they are written.
+
+    Returns ``(sha256, size, temp_path)``; pass the result to ``commit``.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = _temp_path(temp_dir)
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in chunks:
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        discard(temp_path)
+        raise
+    return digest.hexdigest(), size, temp_path
+
+
+async def write_upload(upload, temp_dir: str = TEMP_DIR) -> Tuple[str, int, str]:
+    """``write_chunks`` for a Starlette ``UploadFile``, never holding it in memory."""
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = _temp_path(temp_dir)
+    try:
+        with open(temp_path, "wb") as f:
+            while chunk := await upload.read(CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+    except BaseException:
+        discard(temp_path)
+        raise
+    return digest.hexdigest(), size, temp_path
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file assembled elsewhere (e.g. from upload chunks)."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def place(sha256: str, temp_path: str, store=None) -> bool:
+    """Move a hashed temporary file into storage.
+
+    Returns False (and drops the temporary file) when identical content is
+    already stored. Callers must hold a reference before placing.
+    """
+    store = store or get_storage()
+    key = blob_key(sha256)
+    if store.exists(key):
+        discard(temp_path)
+        return False
+    store.put_file(key, temp_path)
+    return True
+
+
+def discard(temp_path: str):
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+
+
+def add_reference(sha256: str, size: int):
+    """Count one more file record pointing at ``sha256``, creating the blob entry."""
+    for _ in range(_DELETING_RETRIES):
+        now = datetime.now(timezone.utc)
+        try:
+            _blobs_collection.update_one(
+                {"_id": sha256, "deleting": {"$ne": True}},
+                {
+                    "$inc": {"refcount": 1},
+                    # Lets the garbage collector tell a fresh reference, whose
+                    # record is still being saved, from a leaked one
+                    "$set": {"referenced_at": now},
+                    "$setOnInsert": {"size": size, "created_at": now},
+                    "$unset": {"unreferenced_at": ""},
+                },
+                upsert=True,
+            )
+            return
+        except DuplicateKeyError:
+            # The garbage collector is removing this blob; once its entry is
+            # gone the upsert creates a fresh one
+            time.sleep(_DELETING_RETRY_SECONDS)
+    raise RuntimeError(f"Blob {sha256} stayed locked by garbage collection")
+
+
+def commit(sha256: str, size: int, temp_path: str, store=None) -> bool:
+    """Take a reference and place the content; True when new bytes hit the disk."""
+    try:
+        add_reference(sha256, size)
+    except BaseException:
+        discard(temp_path)
+        raise
+    try:
+        return place(sha256, temp_path, store)
+    except BaseException:
+        discard(temp_path)
+        release(sha256)
+        raise
+
+
+def download_response(sha256: str, filename: str, media_type: str = "application/octet-stream"):
+    """A response serving the blob (or redirecting to it), None if it is missing."""
+    return get_storage().download_response(blob_key(sha256), filename, media_type)
+
+
+def release(sha256: Optional[str]):
+    """Drop one reference; at zero the blob is marked for garbage collection."""
+    if not sha256:
+        return
+    blob = _blobs_collection.find_one_and_update(
+        {"_id": sha256, "refcount": {"$gt": 0}},
+        {"$inc": {"refcount": -1}},
+        projection={"refcount": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if blob is not None and blob["refcount"] <= 0:
+        _blobs_collection.update_one(
+            {"_id": sha256, "refcount": {"$lte": 0}},
+            {"$set": {"unreferenced_at": datetime.now(timezone.utc)}},
+        )
+
+
+def stats() -> dict:
+    """Logical bytes referenced versus bytes actually stored."""
+    result = list(
+        _blobs_collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": None,
+                        "blobs": {"$sum": 1},
+                        "references": {"$sum": "$refcount"},
+                        "stored_bytes": {"$sum": "$size"},
+                        "logical_bytes": {"$sum": {"$multiply": ["$size", "$refcount"]}},
+                    }
+                }
+            ]
+        )
+    )
+    if not result:
+        return {"blobs": 0, "references": 0, "stored_bytes": 0, "logical_bytes": 0, "saved_bytes": 0}
+    totals = result[0]
+    totals.pop("_id")
+    totals["saved_bytes"] = totals["logical_bytes"] - totals["stored_bytes"]
+    return totals
@@ -0,0 +1,375 @@
+"""Background removal of what hangs off a deleted school, competition or user.
+
+Deleting a record removes only the record itself inside the request. Its
+dependents (competitions, teams with their chat and files, join requests,
+registration tokens, and a user's memberships, messages and uploads) can
+number in the thousands, so they are recorded as a cascade in the
+``deletions`` collection and removed by a ``cascade`` job in batches of
+``CASCADE_BATCH_SIZE``. Each batch adds what it removed to the deletion's
+``progress``, which clients can poll as the report of what was touched.
+
+Erasing a user finds their content through the indexes on
+``members.user_id``, ``chat.user_id``, ``files.user_id`` and the join
+request and token user fields rather than scanning every team. Their chat
+messages are removed, or kept under ``DELETED_USER_NAME`` when the cascade
+was started with ``anonymize_messages``.
+
+Every batch looks up what is left and removes it, so an interrupted cascade
+just carries on. The job queue leases and retries cascades; failed ones are
+retried with exponential backoff, up to ``CASCADE_MAX_ATTEMPTS`` times.
+"""
+
+import os
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from database import db
+from etags import touch
+from pagination import any_id, id_match
+from services import blob_service, competition_cache, job_service, quota_service
+
+CASCADE_BATCH_SIZE = int(os.getenv("CASCADE_BATCH_SIZE", "100"))
+CASCADE_MAX_ATTEMPTS = int(os.getenv("CASCADE_MAX_ATTEMPTS", "5"))
+CASCADE_CONCURRENCY = int(os.getenv("CASCADE_CONCURRENCY", "2"))
+CASCADE_JOB = "cascade"
+# How long a queued cascade waits for its record to be deleted
+HOLD = job_service.LEASE
+# Author of messages kept after their writer was erased
+DELETED_USER_ID = ObjectId("0" * 24)
+DELETED_USER_NAME = "Deleted user"
+
+_deletions_collection = db.get_collection("deletions")
+_competitions_collection = db.get_collection("competitions")
+_teams_collection = db.get_collection("teams")
+_join_requests_collection = db.get_collection("join_requests")
+_tokens_collection = db.get_collection("registration_tokens")
+_users_collection = db.get_collection("users")
+_schools_collection = db.get_collection("schools")
+
+# Where the record a cascade hangs off lives, by kind
+_roots = {
+    "school": _schools_collection,
+    "competition": _competitions_collection,
+    "user": _users_collection,
+}
+
+
+def _ids(collection, query: dict, limit: int) -> List:
+    return [document["_id"] for document in collection.find(query, {"_id": 1}).limit(limit)]
+
+
+# Steps take the deletion and a batch size. They return what they removed,
+# or None once nothing is left.
+
+
+def _remove_teams(query: dict, limit: int, school_id: Optional[str]) -> Optional[Dict[str, int]]:
+    teams = list(
+        _teams_collection.find(
+            query, {"storage_used": 1, "files.sha256": 1, "chat._id": 1}
+        ).limit(limit)
+    )
+    if not teams:
+        return None
+    team_ids = [team["_id"] for team in teams]
+    join_requests = _join_requests_collection.delete_many({"team_id": any_id(team_ids)})
+    _teams_collection.delete_many({"_id": {"$in": team_ids}})
+    files = [file for team in teams for file in team.get("files", [])]
+    for file in files:
+        blob_service.release(file.get("sha256"))
+    # Legacy files without a blob are reclaimed by the garbage collector
+    quota_service.release_school_storage(
+        school_id, sum(team.get("storage_used", 0) for team in teams)
+    )
+    return {
+        "teams": len(teams),
+        "files": len(files),
+        "messages": sum(len(team.get("chat", [])) for team in teams),
+        "join_requests": join_requests.deleted_count,
+    }
+
+
+def _competition_teams(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    return _remove_teams(
+        {"competition_id": id_match(deletion["target_id"])}, limit, deletion.get("school_id")
+    )
+
+
+def _school_competitions(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    competition_ids = _ids(
+        _competitions_collection, {"school_id": id_match(deletion["target_id"])}, limit
+    )
+    if not competition_ids:
+        return None
+    # Teams first, so a competition is only gone once its teams are
+    removed = _remove_teams({"competition_id": any_id(competition_ids)}, limit, None)
+    if removed:
+        return removed
+    _competitions_collection.delete_many({"_id": {"$in": competition_ids}})
+    competition_cache.invalidate(school_id=deletion["target_id"])
+    return {"competitions": len(competition_ids)}
+
+
+def _school_tokens(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    token_ids = _ids(_tokens_collection, {"school_id": id_match(deletion["target_id"])}, limit)
+    if not token_ids:
+        return None
+    _tokens_collection.delete_many({"_id": {"$in": token_ids}})
+    return {"tokens": len(token_ids)}
+
+
+def _school_headteacher(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    headteacher_id = deletion.get("headteacher_id")
+    if not headteacher_id:
+        return None
+    result = _users_collection.delete_one({"_id": id_match(headteacher_id)})
+    return {"users": 1} if result.deleted_count else None
+
+
+def _user_memberships(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    user_id = deletion["target_id"]
+    team_ids = _ids(_teams_collection, {"members.user_id": id_match(user_id)}, limit)
+    if not team_ids:
+        return None
+    forms = any_id([user_id])["$in"]
+    _teams_collection.update_many(
+        {"_id": {"$in": team_ids}}, touch(_member_removal(forms))
+    )
+    return {"memberships": len(team_ids)}
+
+
+def _member_removal(user_ids: list) -> list:
+    # Imported late: team_service imports the competition service, which
+    # starts cascades
+    from services.team_service import member_removal
+
+    return member_removal(*user_ids)
+
+
+def _user_messages(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    forms = any_id([deletion["target_id"]])
+    teams = list(
+        _teams_collection.find({"chat.user_id": forms}, {"chat.user_id": 1}).limit(limit)
+    )
+    if not teams:
+        return None
+    team_ids = [team["_id"] for team in teams]
+    authored = sum(
+        1
+        for team in teams
+        for message in team.get("chat", [])
+        if message.get("user_id") in forms["$in"]
+    )
+    if deletion.get("anonymize_messages"):
+        # The messages stay for the rest of the team, without their author
+        _teams_collection.update_many(
+            {"_id": {"$in": team_ids}},
+            touch(
+                {
+                    "$set": {
+                        "chat.$[mine].user_id": DELETED_USER_ID,
+                        "chat.$[mine].user_name": DELETED_USER_NAME,
+                    }
+                }
+            ),
+            array_filters=[{"mine.user_id": forms}],
+        )
+        return {"messages_anonymized": authored}
+    _teams_collection.update_many(
+        {"_id": {"$in": team_ids}},
+        touch({"$pull": {"chat": {"user_id": forms}}}),
+    )
+    return {"messages": authored}
+
+
+def _user_files(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    forms = any_id([deletion["target_id"]])
+    team_ids = _ids(_teams_collection, {"files.user_id": forms}, limit)
+    if not team_ids:
+        return None
+    removed = 0
+    for team_id in team_ids:
+        # The files as they were just before the pull, so each removed file
+        # gives back its space and its blob reference exactly once
+        before = _teams_collection.find_one_and_update(
+            {"_id": team_id, "files.user_id": forms},
+            touch({"$pull": {"files": {"user_id": forms}}}),
+            projection={"files.user_id": 1, "files.size": 1, "files.sha256": 1},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            continue
+        files = [file for file in before.get("files", []) if file.get("user_id") in forms["$in"]]
+        quota_service.release_team_storage(team_id, sum(file.get("size") or 0 for file in files))
+        for file in files:
+            blob_service.release(file.get("sha256"))
+        removed += len(files)
+    return {"files": removed}
+
+
+def _user_tokens(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    token_ids = _ids(_tokens_collection, {"used_by": id_match(deletion["target_id"])}, limit)
+    if not token_ids:
+        return None
+    _tokens_collection.delete_many({"_id": {"$in": token_ids}})
+    return {"tokens": len(token_ids)}
+
+
+def _user_join_requests(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    request_ids = _ids(
+        _join_requests_collection, {"user_id": id_match(deletion["target_id"])}, limit
+    )
+    if not request_ids:
+        return None
+    _join_requests_collection.delete_many({"_id": {"$in": request_ids}})
+    return {"join_requests": len(request_ids)}
+
+
+def _user_approvals(deletion: dict, limit: int) -> Optional[Dict[str, int]]:
+    forms = any_id([deletion["target_id"]])
+    request_ids = _ids(_join_requests_collection, {"approvals": forms}, limit)
+    if not request_ids:
+        return None
+    _join_requests_collection.update_many(
+        {"_id": {"$in": request_ids}}, {"$pull": {"approvals": forms}}
+    )
+    return {"approvals": len(request_ids)}
+
+
+STEPS: Dict[str, List[Callable[[dict, int], Optional[Dict[str, int]]]]] = {
+    "competition": [_competition_teams],
+    "school": [_school_competitions, _school_tokens, _school_headteacher],
+    "user": [
+        _user_memberships,
+        _user_messages,
+        _user_files,
+        _user_join_requests,
+        _user_approvals,
+        _user_tokens,
+    ],
+}
+
+
+def start(
+    kind: str,
+    target_id,
+    delete_root: Callable[[], int],
+    requested_by=None,
+    **context,
+) -> Optional[dict]:
+    """Delete a record with ``delete_root`` and queue the removal of its dependents.
+
+    The cascade is queued first, held back by ``HOLD``, and released once
+    the record is gone, so the dependents are removed even if the process
+    dies right after. Returns None, queueing nothing, when ``delete_root``
+    found nothing to delete.
+    """
+    now = datetime.now(timezone.utc)
+    deletion_id = ObjectId()
+    job = job_service.enqueue(CASCADE_JOB, {"deletion_id": str(deletion_id)}, delay=HOLD)
+    deletion = {
+        "_id": deletion_id,
+        "kind": kind,
+        "target_id": str(target_id),
+        "requested_by": str(requested_by) if requested_by else None,
+        "job_id": job["_id"],
+        "status": "pending",
+        "step": 0,
+        "progress": {},
+        "created_at": now,
+        "updated_at": now,
+        **context,
+    }
+    _deletions_collection.insert_one(deletion)
+    try:
+        deleted = delete_root()
+    except BaseException:
+        _discard(deletion)
+        raise
+    if not deleted:
+        _discard(deletion)
+        return None
+    job_service.run_now(job["_id"])
+    return deletion
+
+
+def _discard(deletion: dict):
+    job_service.cancel(deletion["job_id"])
+    _deletions_collection.delete_one({"_id": deletion["_id"]})
+
+
+def get(deletion_id, requested_by=None) -> Optional[dict]:
+    query = {"_id": id_match(deletion_id)}
+    if requested_by is not None:
+        query["requested_by"] = str(requested_by)
+    deletion = _deletions_collection.find_one(query)
+    return public(deletion) if deletion else None
+
+
+def public(deletion: dict) -> dict:
+    """What clients see of a deletion, with the state of its job."""
+    job = job_service.get(deletion["job_id"]) if deletion.get("job_id") else None
+    status = deletion["status"]
+    if status != "done" and job is not None:
+        status = job["status"]
+    return {
+        "id": str(deletion["_id"]),
+        "kind": deletion["kind"],
+        "target_id": deletion["target_id"],
+        "status": status,
+        "progress": deletion.get("progress", {}),
+        "attempts": job["attempts"] if job else 0,
+        "error": job["error"] if job and status != "done" else None,
+        "created_at": deletion["created_at"],
+        "finished_at": deletion.get("finished_at"),
+    }
+
+
+def _checkpoint(deletion: dict, step: int, removed: Dict[str, int]):
+    update = {"$set": {"step": step, "updated_at": datetime.now(timezone.utc)}}
+    if removed:
+        update["$inc"] = {f"progress.{name}": count for name, count in removed.items()}
+    _deletions_collection.update_one({"_id": deletion["_id"]}, update)
+
+
+def run(deletion: dict, batch_size: int = CASCADE_BATCH_SIZE):
+    """Work through a deletion from its last checkpoint.
+
+    Raises ``job_service.Interrupted`` between batches when the worker is
+    shutting down; the job then carries on elsewhere.
+    """
+    steps = STEPS[deletion["kind"]]
+    _deletions_collection.update_one(
+        {"_id": deletion["_id"]},
+        {"$set": {"status": "running", "updated_at": datetime.now(timezone.utc)}},
+    )
+    for step in range(deletion.get("step", 0), len(steps)):
+        while (removed := steps[step](deletion, batch_size)) is not None:
+            _checkpoint(deletion, step, removed)
+            if job_service.stopping():
+                raise job_service.Interrupted()
+        _checkpoint(deletion, step + 1, {})
+    now = datetime.now(timezone.utc)
+    _deletions_collection.update_one(
+        {"_id": deletion["_id"]},
+        {"$set": {"status": "done", "finished_at": now, "updated_at": now}},
+    )
+
+
+def _cascade_job(payload: dict):
+    deletion = _deletions_collection.find_one({"_id": ObjectId(payload["deletion_id"])})
+    if deletion is None or deletion["status"] == "done":
+        return None
+    if _roots[deletion["kind"]].count_documents({"_id": id_match(deletion["target_id"])}, limit=1):
+        # The process queueing the cascade died before deleting the record
+        _deletions_collection.delete_one({"_id": deletion["_id"]})
+        return None
+    run(deletion)
+    return None
+
+
+job_service.register(
+    CASCADE_JOB, _cascade_job, concurrency=CASCADE_CONCURRENCY, max_attempts=CASCADE_MAX_ATTEMPTS
+)
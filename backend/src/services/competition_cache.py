@@ -0,0 +1,94 @@
+"""Cached competition listings, per school plus one entry for global ones.
+
+Competitions change rarely but are listed on every student and headteacher
+page load, so each process keeps the competitions of recently seen schools,
+and the shared ``is_global`` set, for ``COMPETITION_CACHE_TTL_SECONDS``.
+Every write to a competition in this process calls ``invalidate``; writes in
+other processes arrive through the invalidation bus, or show up once the
+entry expires where change streams are not available. Callers get copies
+and may modify them.
+"""
+
+import os
+from typing import List
+
+from cache import TTLCache
+from database import db
+from pagination import id_match
+from services import invalidation_bus
+
+COMPETITION_CACHE_TTL_SECONDS = float(os.getenv("COMPETITION_CACHE_TTL_SECONDS", "30"))
+COMPETITION_CACHE_SIZE = int(os.getenv("COMPETITION_CACHE_SIZE", "1000"))
+
+GLOBAL = "global"
+
+_competitions_collection = db.get_collection("competitions")
+
+_cache = TTLCache(COMPETITION_CACHE_SIZE, COMPETITION_CACHE_TTL_SECONDS)
+
+
+def _copies(competitions: List[dict]) -> List[dict]:
+    return [dict(competition) for competition in competitions]
+
+
+def school_competitions(school_id) -> List[dict]:
+    """All competitions of a school, global or not, in creation order."""
+    return _copies(
+        _cache.get_or_load(
+            ("school", str(school_id)),
+            lambda: list(
+                _competitions_collection.find(
+                    {"school_id": id_match(school_id)}, sort=[("_id", 1)]
+                )
+            ),
+        )
+    )
+
+
+def global_competitions() -> List[dict]:
+    return _copies(
+        _cache.get_or_load(
+            GLOBAL,
+            lambda: list(_competitions_collection.find({"is_global": True}, sort=[("_id", 1)])),
+        )
+    )
+
+
+def visible_competitions(school_id) -> List[dict]:
+    """A school's competitions and every global one, each once, in creation order."""
+    competitions = {str(c["_id"]): c for c in global_competitions()}
+    competitions.update((str(c["_id"]), c) for c in school_competitions(school_id))
+    return sorted(competitions.values(), key=lambda competition: str(competition["_id"]))
+
+
+def invalidate(school_id=None, competition_id=None):
+    """Forget cached listings a competition write may have changed.
+
+    ``school_id`` drops that school's entry and the global one (the
+    competition may have become, or stopped being, global);
+    ``competition_id`` drops every entry holding that competition.
+    """
+    if school_id is not None:
+        _cache.invalidate(("school", str(school_id)))
+        _cache.invalidate(GLOBAL)
+    if competition_id is not None:
+        competition_id = str(competition_id)
+        _cache.invalidate_where(
+            lambda key, competitions: any(str(c["_id"]) == competition_id for c in competitions)
+        )
+
+
+def clear():
+    _cache.clear()
+
+
+def _on_change(event: invalidation_bus.InvalidationEvent):
+    if event.operation == invalidation_bus.RESET:
+        clear()
+        return
+    invalidate(event.school_id, event.document_id)
+    if "is_global" in event.fields:
+        _cache.invalidate(GLOBAL)
+
+
+invalidation_bus.subscribe("competitions", _on_change)
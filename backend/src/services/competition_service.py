@@ -2,8 +2,26 @@ from database import db
 from models import Competition, PydanticObjectId
 from typing import List, Optional
 from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pagination import id_match, page_query, projection_for
+from etags import touch
+from services import cascade_service, competition_cache
 
 _competitions_collection = db.get_collection("competitions")
+_teams_collection = db.get_collection("teams")
+
+# Fields _competition_helper cannot do without, always part of a field selection
+COMPETITION_REQUIRED_FIELDS = (
+    "name",
+    "description",
+    "school_id",
+    "is_global",
+    "max_teams",
+    "max_members_per_team",
+    "created_by",
+    "created_at",
+    "updated_at",
+)
 
 def _competition_helper(competition_data) -> Competition:
     return Competition(
@@ -23,30 +41,129 @@ def create_competition(competition: Competition) -> Competition:
     competition_dict = competition.model_dump(by_alias=True)
     competition_dict["created_at"] = datetime.now(timezone.utc)
     competition_dict["updated_at"] = datetime.now(timezone.utc)
+    competition_dict["team_count"] = 0
     result = _competitions_collection.insert_one(competition_dict)
+    competition_cache.invalidate(school_id=competition_dict.get("school_id"))
     competition.id = result.inserted_id
     return competition
 
-def get_competition(competition_id: PydanticObjectId) -> Optional[Competition]:
-    competition_data = _competitions_collection.find_one({"_id": competition_id})
+def get_competition(competition_id: PydanticObjectId, fields: Optional[List[str]] = None) -> Optional[Competition]:
+    competition_data = _competitions_collection.find_one(
+        {"_id": competition_id}, projection_for(fields, COMPETITION_REQUIRED_FIELDS)
+    )
     if competition_data:
         return _competition_helper(competition_data)
     return None
 
-def get_competitions() -> List[Competition]:
+def get_competitions(
+    filters: Optional[dict] = None,
+    after: Optional[PydanticObjectId] = None,
+    limit: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+) -> List[Competition]:
     competitions = []
-    for competition_data in _competitions_collection.find():
+    for competition_data in _competitions_collection.find(
+        page_query(filters or {}, after),
+        projection_for(fields, COMPETITION_REQUIRED_FIELDS),
+        sort=[("_id", 1)],
+        limit=limit or 0,
+    ):
         competitions.append(_competition_helper(competition_data))
     return competitions
 
+def count_competitions(filters: Optional[dict] = None) -> int:
+    return _competitions_collection.count_documents(filters or {})
+
 def update_competition(competition_id: PydanticObjectId, competition_data: dict) -> Optional[Competition]:
-    # Check if competition exists first
-    if not _competitions_collection.find_one({"_id": competition_id}):
-        return None
-    competition_data["updated_at"] = datetime.now(timezone.utc)
-    _competitions_collection.update_one({"_id": competition_id}, {"$set": competition_data})
-    return get_competition(competition_id)
-
-def delete_competition(competition_id: PydanticObjectId):
-    result = _competitions_collection.delete_one({"_id": competition_id})
-    return {"message": "Competition deleted successfully", "deleted_count": result.deleted_count}
\ No newline at end of file
+    # Single round trip: None means the competition does not exist
+    updated = _competitions_collection.find_one_and_update(
+        {"_id": competition_id},
+        touch({"$set": competition_data}),
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated:
+        competition_cache.invalidate(updated.get("school_id"), competition_id)
+        return _competition_helper(updated)
+    return None
+
+def delete_competition(competition_id: PydanticObjectId, requested_by=None):
+    """Delete a competition; its teams are removed in the background."""
+    deletion = None
+    competition = _competitions_collection.find_one({"_id": competition_id}, {"school_id": 1})
+    if competition:
+        deletion = cascade_service.start(
+            "competition",
+            competition_id,
+            lambda: _competitions_collection.delete_one({"_id": competition_id}).deleted_count,
+            requested_by,
+            # Storage of the removed teams is given back to the school
+            school_id=str(competition["school_id"]) if competition.get("school_id") else None,
+        )
+        competition_cache.invalidate(competition.get("school_id"), competition_id)
+    return {
+        "message": "Competition deleted successfully",
+        "deleted_count": 1 if deletion else 0,
+        "deletion_id": str(deletion["_id"]) if deletion else None,
+    }
+
+
+def _backfill_team_count(competition_id) -> bool:
+    """Initialise team_count on competitions created before it was maintained.
+
+    Returns False when the competition does not exist or already has one.
+    """
+    competition = _competitions_collection.find_one(
+        {"_id": id_match(competition_id), "team_count": {"$exists": False}}, {"_id": 1}
+    )
+    if competition is None:
+        return False
+    count = _teams_collection.count_documents({"competition_id": str(competition["_id"])})
+    # A concurrent caller may have got there first; either way the field is set
+    _competitions_collection.update_one(
+        {"_id": competition["_id"], "team_count": {"$exists": False}},
+        touch({"$set": {"team_count": count}}),
+    )
+    competition_cache.invalidate(competition_id=competition["_id"])
+    return True
+
+def reserve_team_slot(competition_id) -> bool:
+    """Atomically take one of the competition's ``max_teams`` slots.
+
+    The limit is compared with team_count inside the update itself, so
+    concurrent creators cannot exceed it. Returns False when the competition
+    is full or does not exist; callers release the slot if their insert fails.
+    """
+    for _ in range(2):
+        result = _competitions_collection.update_one(
+            {
+                "_id": id_match(competition_id),
+                "team_count": {"$exists": True},
+                "$expr": {"$lt": ["$team_count", "$max_teams"]},
+            },
+            touch({"$inc": {"team_count": 1}}),
+        )
+        if result.modified_count:
+            competition_cache.invalidate(competition_id=competition_id)
+            return True
+        if not _backfill_team_count(competition_id):
+            return False
+    return False
+
+def release_team_slot(competition_id):
+    _competitions_collection.update_one(
+        {"_id": id_match(competition_id), "team_count": {"$gt": 0}},
+        touch({"$inc": {"team_count": -1}}),
+    )
+    competition_cache.invalidate(competition_id=competition_id)
+
+def track_team_created(competition_id):
+    """Count a team created without a reservation (no limit is enforced).
+
+    Competitions whose counter has not been initialised yet are skipped; the
+    backfill will count the new team.
+    """
+    _competitions_collection.update_one(
+        {"_id": id_match(competition_id), "team_count": {"$exists": True}},
+        touch({"$inc": {"team_count": 1}}),
+    )
+    competition_cache.invalidate(competition_id=competition_id)
@@ -0,0 +1,131 @@
+"""Personal data exports, streamed record by record.
+
+An export is newline-delimited JSON: one ``{"type": ..., ...}`` object per
+line, starting with the user and followed by their team memberships, the
+chat messages they wrote, their join requests and the files they uploaded.
+Each kind is read through a cursor over an index on the user's id, and the
+teams' embedded chats and file lists are filtered down to the user's own
+entries by the database, so no more than one cursor batch is held in memory
+however much the user wrote.
+
+``zip_entries`` packs the same lines as ``data.ndjson`` together with
+the content of the uploaded files, a folder per team.
+"""
+
+from typing import Iterable, Iterator
+
+from archives import ArchiveEntry, team_file_entries
+from database import db
+from pagination import any_id
+from responses import dumps
+
+# Teams (with the user's part of their chat and files) per cursor batch
+EXPORT_BATCH_SIZE = 50
+
+_teams_collection = db.get_collection("teams")
+_join_requests_collection = db.get_collection("join_requests")
+
+_PRIVATE_USER_FIELDS = ("password",)
+
+
+def _authored(user_id, field: str) -> Iterator[dict]:
+    """Teams with the user's entries of ``field`` (chat or files), filtered server-side."""
+    forms = any_id([user_id])
+    return _teams_collection.aggregate(
+        [
+            {"$match": {f"{field}.user_id": forms}},
+            {
+                "$project": {
+                    "name": 1,
+                    field: {
+                        "$filter": {
+                            "input": f"${field}",
+                            "cond": {"$in": ["$$this.user_id", forms["$in"]]},
+                        }
+                    },
+                }
+            },
+        ],
+        batchSize=EXPORT_BATCH_SIZE,
+    )
+
+
+def memberships(user_id) -> Iterator[dict]:
+    teams = _teams_collection.find(
+        {"members.user_id": any_id([user_id])},
+        {"name": 1, "competition_id": 1, "url": 1},
+        batch_size=EXPORT_BATCH_SIZE,
+    )
+    for team in teams:
+        yield {
+            "type": "membership",
+            "team_id": team["_id"],
+            "team_name": team.get("name"),
+            "competition_id": team.get("competition_id"),
+            "team_url": team.get("url"),
+        }
+
+
+def messages(user_id) -> Iterator[dict]:
+    for team in _authored(user_id, "chat"):
+        for message in team.get("chat", []):
+            yield {"type": "message", "team_id": team["_id"], "team_name": team.get("name"), **message}
+
+
+def files(user_id) -> Iterator[dict]:
+    for team in _authored(user_id, "files"):
+        for record in team.get("files", []):
+            yield {"type": "file", "team_id": team["_id"], "team_name": team.get("name"), **record}
+
+
+def join_requests(user_id) -> Iterator[dict]:
+    requests = _join_requests_collection.find(
+        {"user_id": any_id([user_id])}, batch_size=EXPORT_BATCH_SIZE
+    )
+    for request in requests:
+        yield {"type": "join_request", **request}
+
+
+def records(user: dict) -> Iterator[dict]:
+    """Everything stored about ``user``, one record at a time."""
+    profile = {key: value for key, value in user.items() if key not in _PRIVATE_USER_FIELDS}
+    yield {"type": "user", **profile}
+    user_id = user["_id"]
+    yield from memberships(user_id)
+    yield from messages(user_id)
+    yield from join_requests(user_id)
+    yield from files(user_id)
+
+
+def stream_ndjson(user: dict) -> Iterator[bytes]:
+    for record in records(user):
+        yield dumps(record) + b"\n"
+
+
+class _IteratorReader:
+    """Read-only file object over an iterator of byte chunks."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def close(self):
+        pass
+
+
+def zip_entries(user: dict) -> Iterator[ArchiveEntry]:
+    """``data.ndjson`` followed by the user's uploaded files, a folder per team."""
+    yield ArchiveEntry("data.ndjson", 0, None, lambda: _IteratorReader(stream_ndjson(user)))
+    yield from team_file_entries(_authored(user["_id"], "files"))
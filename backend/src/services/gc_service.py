@@ -0,0 +1,405 @@
+"""Incremental garbage collection of uploaded file content.
+
+Removing file records never deletes bytes on the spot. Deleted files release
+their blob, which is only marked unreferenced. Uploads from before the blob
+store are simply forgotten. Records removed wholesale (a user's data, the
+teams of a deleted competition or school) may never release anything. The
+collector reconciles storage with the file records and reclaims whatever
+nothing points at any more.
+
+It works through four phases in small batches:
+
+- ``blobs``: walks the ``blobs`` collection, repairs reference counts from
+  the records using each blob, and deletes blobs (and their previews) that
+  have been unreferenced for longer than ``GC_GRACE_HOURS``.
+- ``objects``: walks the stored ``blobs/`` keys and deletes content with no
+  ``blobs`` entry, left behind by crashes.
+- ``legacy``: walks uploads stored before the blob store, at
+  ``uploads/<file id>_<name>`` and ``uploads/<team id>/<name>``, and deletes
+  those no record points at.
+- ``temp``: deletes abandoned temporary upload files.
+
+Where it got to is saved in the ``gc_state`` collection, so each run
+continues from the last one instead of scanning all of storage in one go.
+``GC_RATE_PER_SECOND`` caps how many items a run examines per second.
+
+Runs are ``storage.gc`` jobs, queued every ``GC_INTERVAL_MINUTES`` and by
+admins. The job type allows one running job across all workers, so runs
+never overlap on the checkpoint.
+
+Deletion follows the blob store's protocol: a blob is marked ``deleting``
+before its bytes go, so a concurrent upload of the same content waits
+instead of losing its bytes. A dry run changes nothing and keeps its own
+checkpoint, so it never makes a real run skip work.
+"""
+
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from database import db
+from pagination import id_match
+from services import blob_service, job_service, preview_service
+from storage import UPLOAD_DIR, get_storage
+
+logger = logging.getLogger(__name__)
+
+GC_GRACE = timedelta(hours=float(os.getenv("GC_GRACE_HOURS", "24")))
+GC_RATE_PER_SECOND = float(os.getenv("GC_RATE_PER_SECOND", "200"))
+GC_BATCH_SIZE = int(os.getenv("GC_BATCH_SIZE", "100"))
+GC_JOB = "storage.gc"
+# Items examined by each periodic run; 0 disables periodic runs
+GC_ITEMS_PER_RUN = int(os.getenv("GC_ITEMS_PER_RUN", "5000"))
+GC_INTERVAL_SECONDS = float(os.getenv("GC_INTERVAL_MINUTES", "60")) * 60
+# A collector that died while deleting a blob leaves it locked this long
+LOCK_TIMEOUT = timedelta(minutes=15)
+PHASES = ("blobs", "objects", "legacy", "temp")
+# Reports list at most this many reclaimed items
+REPORTED_ITEMS = 100
+
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+_PREVIEW_SUFFIX = ".preview.jpg"
+
+_blobs_collection = db.get_collection("blobs")
+_teams_collection = db.get_collection("teams")
+_sessions_collection = db.get_collection("upload_sessions")
+_state_collection = db.get_collection("gc_state")
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    # PyMongo returns naive datetimes unless the client is tz_aware
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def reference_count(sha256: str) -> int:
+    """How many file records point at ``sha256``, whatever its refcount says."""
+    result = list(
+        _teams_collection.aggregate(
+            [
+                {"$match": {"files.sha256": sha256}},
+                {
+                    "$project": {
+                        "count": {
+                            "$size": {
+                                "$filter": {
+                                    "input": "$files",
+                                    "cond": {"$eq": ["$$this.sha256", {"$literal": sha256}]},
+                                }
+                            }
+                        }
+                    }
+                },
+                {"$group": {"_id": None, "count": {"$sum": "$count"}}},
+            ]
+        )
+    )
+    return result[0]["count"] if result else 0
+
+
+def _delete_blob(sha256: str, store):
+    """Delete a locked blob's content and preview, then its entry."""
+    store.delete(blob_service.blob_key(sha256))
+    store.delete(preview_service.preview_key(sha256))
+    _blobs_collection.delete_one({"_id": sha256, "deleting": True})
+
+
+def _local_files(directory: str, start_after: Optional[str], skip=()) -> Iterator[Tuple[str, str]]:
+    """``(key, path)`` of files one or two levels below ``directory``, in order."""
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name in skip:
+            continue
+        path = os.path.join(directory, name)
+        if os.path.isdir(path):
+            if start_after is None or start_after.startswith(name + "/") or name > start_after:
+                for child in sorted(os.listdir(path)):
+                    key = f"{name}/{child}"
+                    child_path = os.path.join(path, child)
+                    if (start_after is None or key > start_after) and os.path.isfile(child_path):
+                        yield key, child_path
+        elif start_after is None or name > start_after:
+            yield name, path
+
+
+class _Run:
+    """One collector run: its settings, the phase batches and the report."""
+
+    def __init__(self, dry_run: bool, store, upload_dir: str, now: datetime):
+        self.dry_run = dry_run
+        self.store = store
+        self.upload_dir = upload_dir
+        self.now = now
+        self.cutoff = now - GC_GRACE
+        self.report = {
+            "dry_run": dry_run,
+            "examined": 0,
+            "references_fixed": 0,
+            "reclaimed": 0,
+            "reclaimed_bytes": 0,
+            "items": [],
+        }
+
+    def _older(self, value: Optional[datetime]) -> bool:
+        value = _utc(value)
+        return value is None or value < self.cutoff
+
+    def _reclaimed(self, item: str, size: int):
+        self.report["reclaimed"] += 1
+        self.report["reclaimed_bytes"] += size or 0
+        if len(self.report["items"]) < REPORTED_ITEMS:
+            self.report["items"].append(item)
+
+    # Each batch returns (checkpoint, items examined, phase finished)
+
+    def blobs(self, after: Optional[str], limit: int) -> Tuple[Optional[str], int, bool]:
+        query = {} if after is None else {"_id": {"$gt": after}}
+        batch = list(_blobs_collection.find(query).sort("_id", 1).limit(limit))
+        for blob in batch:
+            self._check_blob(blob)
+        return (batch[-1]["_id"] if batch else after), len(batch), len(batch) < limit
+
+    def _check_blob(self, blob: dict):
+        sha256 = blob["_id"]
+        if blob.get("deleting"):
+            # Finish the job of a collector that died halfway through
+            if _utc(blob.get("deleting_at")) and _utc(blob["deleting_at"]) < self.now - LOCK_TIMEOUT:
+                self._reclaimed(blob_service.blob_key(sha256), blob.get("size", 0))
+                if not self.dry_run:
+                    _delete_blob(sha256, self.store)
+            return
+
+        refcount = blob.get("refcount", 0)
+        references = reference_count(sha256)
+        if references > refcount:
+            # A reference was released twice; raising it is always safe
+            self.report["references_fixed"] += 1
+            if not self.dry_run:
+                _blobs_collection.update_one(
+                    {"_id": sha256},
+                    {"$max": {"refcount": references}, "$unset": {"unreferenced_at": ""}},
+                )
+        elif references == 0 and refcount > 0:
+            # Records removed without releasing. A fresh reference may belong
+            # to an upload whose record is not saved yet, so leave those be.
+            if self._older(blob.get("referenced_at") or blob.get("created_at")):
+                self.report["references_fixed"] += 1
+                if not self.dry_run:
+                    _blobs_collection.update_one(
+                        {"_id": sha256, "refcount": refcount},
+                        {"$set": {"refcount": 0, "unreferenced_at": self.now}},
+                    )
+        elif references == 0:
+            if "unreferenced_at" not in blob:
+                if not self.dry_run:
+                    _blobs_collection.update_one(
+                        {"_id": sha256, "refcount": {"$lte": 0}},
+                        {"$set": {"unreferenced_at": self.now}},
+                    )
+            elif self._older(blob["unreferenced_at"]):
+                self._reclaim_blob(sha256, blob.get("size", 0))
+
+    def _reclaim_blob(self, sha256: str, size: int):
+        if self.dry_run:
+            self._reclaimed(blob_service.blob_key(sha256), size)
+            return
+        locked = _blobs_collection.update_one(
+            {"_id": sha256, "refcount": {"$lte": 0}, "deleting": {"$ne": True}},
+            {"$set": {"deleting": True, "deleting_at": self.now}},
+        )
+        if not locked.modified_count:
+            # Uploaded again since the batch was read
+            return
+        if reference_count(sha256):
+            # A record appeared without taking a reference; the next pass
+            # counts it instead of deleting its content
+            _blobs_collection.update_one(
+                {"_id": sha256}, {"$unset": {"deleting": "", "deleting_at": ""}}
+            )
+            return
+        _delete_blob(sha256, self.store)
+        self._reclaimed(blob_service.blob_key(sha256), size)
+
+    def objects(self, after: Optional[str], limit: int) -> Tuple[Optional[str], int, bool]:
+        keys = list(islice(self.store.keys("blobs", after), limit))
+        by_sha256 = {}
+        for key in keys:
+            name = key.rsplit("/", 1)[-1]
+            if name.endswith(_PREVIEW_SUFFIX):
+                name = name[: -len(_PREVIEW_SUFFIX)]
+            # Temporary files and anything else that is not a blob are left alone
+            if _SHA256.fullmatch(name):
+                by_sha256.setdefault(name, []).append(key)
+        known = {
+            blob["_id"]
+            for blob in _blobs_collection.find({"_id": {"$in": list(by_sha256)}}, {"_id": 1})
+        }
+        for sha256, orphans in by_sha256.items():
+            if sha256 not in known:
+                self._reclaim_object(sha256, orphans)
+        return (keys[-1] if keys else after), len(keys), len(keys) < limit
+
+    def _reclaim_object(self, sha256: str, keys: List[str]):
+        sizes = [self.store.size(key) or 0 for key in keys]
+        if not self.dry_run:
+            try:
+                # Lock the content the same way as a blob being collected
+                _blobs_collection.insert_one(
+                    {"_id": sha256, "refcount": 0, "size": 0, "deleting": True, "deleting_at": self.now}
+                )
+            except DuplicateKeyError:
+                # Uploaded again since the batch was read
+                return
+            _delete_blob(sha256, self.store)
+        for key, size in zip(keys, sizes):
+            self._reclaimed(key, size)
+
+    def legacy(self, after: Optional[str], limit: int) -> Tuple[Optional[str], int, bool]:
+        files = list(
+            islice(_local_files(self.upload_dir, after, skip={blob_service.BLOB_DIRNAME}), limit)
+        )
+        for key, path in files:
+            team_id, _, name = key.rpartition("/")
+            if team_id:
+                if not ObjectId.is_valid(team_id):
+                    # Only team folders hold uploads
+                    continue
+                query = {"files.url": f"/api/teams/{team_id}/files/{name}"}
+            elif "_" in name:
+                file_id = name.split("_", 1)[0]
+                query = {"$or": [{"files._id": id_match(file_id)}, {"files.id": file_id}]}
+            else:
+                # Not an upload
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # Files are written before their record is saved
+            if not self._older(datetime.fromtimestamp(stat.st_mtime, timezone.utc)):
+                continue
+            if _teams_collection.count_documents(query, limit=1):
+                continue
+            if not self.dry_run:
+                blob_service.discard(path)
+            self._reclaimed(key, stat.st_size)
+        return (files[-1][0] if files else after), len(files), len(files) < limit
+
+    def temp(self, after: Optional[str], limit: int) -> Tuple[Optional[str], int, bool]:
+        temp_dir = os.path.join(self.upload_dir, blob_service.BLOB_DIRNAME, "tmp")
+        files = [
+            (name, path)
+            for name, path in islice(_local_files(temp_dir, after), limit)
+            if "/" not in name
+        ]
+        for name, path in files:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if not self._older(datetime.fromtimestamp(stat.st_mtime, timezone.utc)):
+                continue
+            if name.startswith("upload-"):
+                upload_id = name[len("upload-"):]
+                # Open upload sessions own their file until they expire
+                if ObjectId.is_valid(upload_id) and _sessions_collection.count_documents(
+                    {"_id": ObjectId(upload_id)}, limit=1
+                ):
+                    continue
+            if not self.dry_run:
+                blob_service.discard(path)
+            self._reclaimed(f"{blob_service.BLOB_DIRNAME}/tmp/{name}", stat.st_size)
+        return (files[-1][0] if files else after), len(files), len(files) < limit
+
+
+def collect(
+    limit: int = GC_ITEMS_PER_RUN,
+    dry_run: bool = False,
+    rate: float = GC_RATE_PER_SECOND,
+    batch_size: int = GC_BATCH_SIZE,
+    store=None,
+    upload_dir: str = UPLOAD_DIR,
+    should_stop: Callable[[], bool] = lambda: False,
+) -> dict:
+    """Examine up to ``limit`` items, continuing from the saved checkpoint.
+
+    A run stops early once it completes a full pass over all phases, or
+    when ``should_stop()`` turns true between batches; the next one carries
+    on. Returns what was (or, with ``dry_run``, would be) reclaimed and where
+    the run stopped.
+    """
+    run = _Run(dry_run, store or get_storage(), upload_dir, datetime.now(timezone.utc))
+    state_id = "storage:dry-run" if dry_run else "storage"
+    state = _state_collection.find_one({"_id": state_id}) or {}
+    phase = state.get("phase") if state.get("phase") in PHASES else PHASES[0]
+    after = state.get("after")
+    cycle_complete = False
+
+    while run.report["examined"] < limit and not should_stop():
+        started = time.monotonic()
+        after, examined, finished = getattr(run, phase)(
+            after, min(batch_size, limit - run.report["examined"])
+        )
+        run.report["examined"] += examined
+        update = {"phase": phase, "after": after, "updated_at": run.now}
+        if finished:
+            if phase == PHASES[-1]:
+                cycle_complete = True
+                update["completed_at"] = datetime.now(timezone.utc)
+            phase, after = PHASES[(PHASES.index(phase) + 1) % len(PHASES)], None
+            update.update(phase=phase, after=None)
+        _state_collection.update_one({"_id": state_id}, {"$set": update}, upsert=True)
+        if cycle_complete:
+            break
+        if rate > 0:
+            time.sleep(max(0.0, examined / rate - (time.monotonic() - started)))
+
+    return {**run.report, "phase": phase, "checkpoint": after, "cycle_complete": cycle_complete}
+
+
+def _collect_job(payload: dict) -> dict:
+    report = collect(
+        limit=payload.get("limit", GC_ITEMS_PER_RUN),
+        dry_run=payload.get("dry_run", False),
+        should_stop=job_service.stopping,
+    )
+    if report["reclaimed"] or report["references_fixed"]:
+        logger.info(
+            "Collected orphaned storage",
+            extra={
+                "reclaimed": report["reclaimed"],
+                "reclaimed_bytes": report["reclaimed_bytes"],
+                "references_fixed": report["references_fixed"],
+            },
+        )
+    return report
+
+
+def start_collection(limit: int = GC_ITEMS_PER_RUN, dry_run: bool = False) -> dict:
+    """Queue a run; it waits for any run already in progress."""
+    return job_service.enqueue(GC_JOB, {"limit": limit, "dry_run": dry_run})
+
+
+# One run at a time across all workers, so runs never share a checkpoint
+job_service.register(
+    GC_JOB,
+    _collect_job,
+    concurrency=1,
+    max_attempts=1,
+    every=(
+        timedelta(seconds=GC_INTERVAL_SECONDS)
+        if GC_ITEMS_PER_RUN > 0 and GC_INTERVAL_SECONDS > 0
+        else None
+    ),
+)
@@ -0,0 +1,232 @@
+"""Cache invalidation across workers, driven by MongoDB change streams.
+
+Each process tails one change stream over the ``users``, ``teams``,
+``competitions`` and ``schools`` collections and hands every write to the
+in-process subscribers of that collection as an ``InvalidationEvent``, so a
+cache filled in one worker is dropped when another worker (or another host)
+changes the data behind it. Only document ids, the names of updated fields
+and a ``school_id`` are read from the stream, never chat or file contents.
+
+The last resume token is saved to ``change_stream_tokens`` every few
+seconds and on shutdown; a restarted worker carries on from there. If the
+token is too old to resume from, subscribers get a ``RESET`` event and
+should drop everything they cache.
+
+Change streams need a replica set. On a standalone server the bus logs
+once and stays off, and caches fall back to their own expiry.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure, PyMongoError
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from database import db
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_BUS_ENABLED = os.getenv("INVALIDATION_BUS_ENABLED", "true").lower() != "false"
+COLLECTIONS = ("users", "teams", "competitions", "schools")
+TOKEN_SAVE_INTERVAL_SECONDS = 5
+MAX_AWAIT_MS = 1000
+RETRY_INTERVAL_SECONDS = 5
+
+RESET = "reset"
+# Server error codes
+_NOT_A_REPLICA_SET = 40573
+_HISTORY_LOST = 286
+
+_tokens_collection = db.get_collection("change_stream_tokens")
+
+invalidation_events_total = metrics.REGISTRY.register(
+    metrics.Counter(
+        "projektor_invalidation_events_total",
+        "Change stream events handed to cache subscribers, by collection.",
+        ("collection",),
+    )
+)
+
+
+@dataclass(frozen=True)
+class InvalidationEvent:
+    collection: str
+    # insert, update, replace, delete, or RESET when events may have been missed
+    operation: str
+    document_id: Optional[str] = None
+    # Updated or removed top-level fields, for updates
+    fields: Tuple[str, ...] = ()
+    # The document's school, when an insert or the update itself carries it
+    school_id: Optional[str] = None
+
+
+Subscriber = Callable[[InvalidationEvent], None]
+
+_subscribers: Dict[str, List[Subscriber]] = defaultdict(list)
+
+
+def subscribe(collection: str, subscriber: Subscriber):
+    """Call ``subscriber(event)`` for every change to ``collection``."""
+    if collection not in COLLECTIONS:
+        raise ValueError(f"Not watched: {collection}")
+    _subscribers[collection].append(subscriber)
+
+
+def publish(event: InvalidationEvent):
+    if event.operation == RESET:
+        targets = [subscriber for subscribers in _subscribers.values() for subscriber in subscribers]
+    else:
+        targets = list(_subscribers.get(event.collection, ()))
+        invalidation_events_total.inc(collection=event.collection)
+    for subscriber in targets:
+        try:
+            subscriber(event)
+        except Exception:
+            logger.warning("Invalidation subscriber failed", exc_info=True)
+
+
+# Keeps only what subscribers need; the rest of each change never leaves
+# the server
+PIPELINE = [
+    {
+        "$match": {
+            "ns.coll": {"$in": list(COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }
+    },
+    {
+        "$project": {
+            "operationType": 1,
+            "ns.coll": 1,
+            "documentKey._id": 1,
+            "fields": {
+                "$concatArrays": [
+                    {
+                        "$map": {
+                            "input": {
+                                "$objectToArray": {
+                                    "$ifNull": ["$updateDescription.updatedFields", {}]
+                                }
+                            },
+                            "in": "$$this.k",
+                        }
+                    },
+                    {"$ifNull": ["$updateDescription.removedFields", []]},
+                ]
+            },
+            "school_id": {
+                "$ifNull": ["$fullDocument.school_id", "$updateDescription.updatedFields.school_id"]
+            },
+        }
+    },
+]
+
+
+def event_from_change(change: dict) -> InvalidationEvent:
+    document_id = change.get("documentKey", {}).get("_id")
+    school_id = change.get("school_id")
+    return InvalidationEvent(
+        collection=change["ns"]["coll"],
+        operation=change["operationType"],
+        document_id=str(document_id) if document_id is not None else None,
+        # "chat.3.message" is a change to "chat"
+        fields=tuple(sorted({field.split(".")[0] for field in change.get("fields") or ()})),
+        school_id=str(school_id) if school_id is not None else None,
+    )
+
+
+def load_token(name: str) -> Optional[dict]:
+    saved = _tokens_collection.find_one({"_id": name})
+    return saved["token"] if saved else None
+
+
+def save_token(name: str, token: Optional[dict]):
+    if token is not None:
+        _tokens_collection.update_one(
+            {"_id": name}, {"$set": {"token": token, "saved_at": time.time()}}, upsert=True
+        )
+
+
+class InvalidationBus:
+    """Tails the change stream and publishes what it sees."""
+
+    def __init__(self, name: Optional[str] = None):
+        # Workers on a host share a token: the stream is the same for all of
+        # them, so any recent position is a valid place to resume from
+        self.name = name or f"invalidation:{socket.gethostname()}"
+        self._task: Optional[asyncio.Task] = None
+        self._stream = None
+        self._token: Optional[dict] = None
+
+    def _open(self, token: Optional[dict]):
+        return db.watch(PIPELINE, start_after=token, max_await_time_ms=MAX_AWAIT_MS)
+
+    async def _tail(self):
+        self._token = await run_in_threadpool(load_token, self.name)
+        try:
+            self._stream = await run_in_threadpool(self._open, self._token)
+        except OperationFailure as exc:
+            if exc.code != _HISTORY_LOST:
+                raise
+            logger.warning("Change stream history lost, caches reset")
+            publish(InvalidationEvent(collection="*", operation=RESET))
+            self._token = None
+            self._stream = await run_in_threadpool(self._open, None)
+        saved_at = time.monotonic()
+        while True:
+            change = await run_in_threadpool(self._stream.try_next)
+            if change is not None:
+                publish(event_from_change(change))
+            self._token = self._stream.resume_token
+            if time.monotonic() - saved_at >= TOKEN_SAVE_INTERVAL_SECONDS:
+                await run_in_threadpool(save_token, self.name, self._token)
+                saved_at = time.monotonic()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tail()
+            except OperationFailure as exc:
+                if exc.code == _NOT_A_REPLICA_SET:
+                    logger.info("Change streams unavailable, cache invalidation stays local")
+                    return
+                logger.warning("Change stream failed", exc_info=True)
+            except PyMongoError:
+                logger.warning("Change stream failed", exc_info=True)
+            finally:
+                await self._close()
+            await asyncio.sleep(RETRY_INTERVAL_SECONDS)
+
+    async def _close(self):
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            try:
+                await run_in_threadpool(save_token, self.name, self._token)
+                await run_in_threadpool(stream.close)
+            except Exception:
+                logger.warning("Could not close the change stream", exc_info=True)
+
+    def start(self):
+        if not INVALIDATION_BUS_ENABLED:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+invalidation_bus = InvalidationBus()
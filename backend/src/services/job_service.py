@@ -0,0 +1,467 @@
+"""Durable background jobs, queued in the ``jobs`` collection.
+
+Handlers register under a job type with ``register``; request handlers
+``enqueue`` work and return right away. A ``JobWorker`` leases due jobs,
+runs them in the threadpool and renews the lease while they run, so a job
+whose worker died is picked up again once its lease expires. Failed jobs are
+retried with exponential backoff until their type's ``max_attempts``.
+
+Each type allows at most ``concurrency`` running jobs across all workers. A
+running job holds one of its type's numbered slots, and a unique index on
+running (type, slot) pairs keeps two workers from taking the same slot.
+A handler that raises ``Interrupted`` hands its job back to be picked up
+again without using up an attempt.
+
+Types registered with ``every`` also run periodically: workers queue one job
+per period, under an id naming the period, so however many workers are
+running the job is queued once. Long handlers should check ``stopping()``
+between steps so a worker shutting down is not held up by them.
+
+The worker runs inside every API process unless ``JOB_WORKER_EMBEDDED`` is
+off; ``python -m worker`` runs one next to uvicorn instead.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+
+import metrics
+from database import db
+from pagination import id_match
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+LEASE = timedelta(minutes=2)
+RETRY_BACKOFF = timedelta(seconds=30)
+POLL_INTERVAL_SECONDS = 2
+# How often workers check that periodic jobs are queued
+SCHEDULE_INTERVAL_SECONDS = 60
+# Jobs finished within this window count towards the latency figures
+STATS_WINDOW = timedelta(hours=1)
+
+_jobs_collection = db.get_collection("jobs")
+
+job_latency_seconds = metrics.REGISTRY.register(
+    metrics.Histogram(
+        "projektor_job_latency_seconds",
+        "Time from a job becoming due to a worker starting it.",
+        ("type",),
+        buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900),
+    )
+)
+job_runs_total = metrics.REGISTRY.register(
+    metrics.Counter(
+        "projektor_job_runs_total", "Job runs, by type and outcome.", ("type", "outcome")
+    )
+)
+
+
+@dataclass
+class JobType:
+    handler: Callable[[dict], Optional[dict]]
+    concurrency: int = 1
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    every: Optional[timedelta] = None
+
+
+JOB_TYPES: Dict[str, JobType] = {}
+
+# Set while the workers of this process shut down
+_stopping = threading.Event()
+
+
+class Interrupted(Exception):
+    """Raised by a handler that stopped early and should be run again."""
+
+
+def register(
+    job_type: str,
+    handler: Callable[[dict], Optional[dict]],
+    concurrency: int = 1,
+    max_attempts: int = JOB_MAX_ATTEMPTS,
+    every: Optional[timedelta] = None,
+):
+    """Run ``handler(payload)`` for jobs of ``job_type``.
+
+    Handlers may run more than once for the same job, after a crash or a
+    lost lease, so they must be safe to repeat. Whatever they return is
+    stored as the job's result. With ``every``, a job with an empty payload
+    is also queued once per period.
+    """
+    JOB_TYPES[job_type] = JobType(handler, concurrency, max_attempts, every)
+
+
+def _new_job(
+    job_type: str, payload: Optional[dict], run_after: datetime, now: datetime, job_id=None
+) -> dict:
+    return {
+        "_id": job_id or ObjectId(),
+        "type": job_type,
+        "payload": payload or {},
+        "status": "pending",
+        "attempts": 0,
+        "run_after": run_after,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def enqueue(job_type: str, payload: Optional[dict] = None, delay: timedelta = timedelta(0)) -> dict:
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type: {job_type}")
+    now = datetime.now(timezone.utc)
+    job = _new_job(job_type, payload, now + delay, now)
+    _jobs_collection.insert_one(job)
+    return job
+
+
+def schedule_periodic(job_types: Optional[Iterable[str]] = None, now: Optional[datetime] = None):
+    """Queue this period's job for each periodic type with none pending or running."""
+    now = now or datetime.now(timezone.utc)
+    for job_type in job_types or list(JOB_TYPES):
+        every = JOB_TYPES[job_type].every
+        if not every or every <= timedelta(0):
+            continue
+        if _jobs_collection.count_documents(
+            {"type": job_type, "status": {"$in": ["pending", "running"]}}, limit=1
+        ):
+            continue
+        seconds = every.total_seconds()
+        period = datetime.fromtimestamp(now.timestamp() // seconds * seconds, timezone.utc)
+        try:
+            _jobs_collection.insert_one(
+                _new_job(job_type, None, period, now, job_id=f"{job_type}@{period.isoformat()}")
+            )
+        except DuplicateKeyError:
+            # Queued by another worker, or already run this period
+            continue
+
+
+def stopping() -> bool:
+    """Whether this process is shutting down; long handlers return early when it is."""
+    return _stopping.is_set()
+
+
+def run_now(job_id):
+    """Make a pending job due right away."""
+    now = datetime.now(timezone.utc)
+    _jobs_collection.update_one(
+        {"_id": job_id, "status": "pending"}, {"$set": {"run_after": now, "updated_at": now}}
+    )
+
+
+def cancel(job_id):
+    """Drop a job that has not started yet."""
+    _jobs_collection.delete_one({"_id": job_id, "status": "pending"})
+
+
+def get(job_id) -> Optional[dict]:
+    job = _jobs_collection.find_one({"_id": id_match(job_id)})
+    return public(job) if job else None
+
+
+def public(job: dict) -> dict:
+    """What clients see of a job."""
+    return {
+        "id": str(job["_id"]),
+        "type": job["type"],
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "created_at": job["created_at"],
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+    }
+
+
+def _take_over(job_type: str, worker_id: str, now: datetime) -> Optional[dict]:
+    # A running job whose worker stopped renewing keeps its slot
+    return _jobs_collection.find_one_and_update(
+        {"type": job_type, "status": "running", "lease_until": {"$lt": now}},
+        {
+            "$set": {"lease_owner": worker_id, "lease_until": now + LEASE, "updated_at": now},
+            "$inc": {"attempts": 1},
+        },
+        sort=[("lease_until", 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _claim_pending(job_type: str, slots: int, worker_id: str, now: datetime) -> Optional[dict]:
+    for slot in range(slots):
+        try:
+            return _jobs_collection.find_one_and_update(
+                {"type": job_type, "status": "pending", "run_after": {"$lte": now}},
+                {
+                    "$set": {
+                        "status": "running",
+                        "slot": slot,
+                        "lease_owner": worker_id,
+                        "lease_until": now + LEASE,
+                        "started_at": now,
+                        "updated_at": now,
+                    },
+                    "$inc": {"attempts": 1},
+                },
+                sort=[("run_after", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another running job of this type holds the slot
+            continue
+    return None
+
+
+def claim(worker_id: str, job_types: Optional[Iterable[str]] = None) -> Optional[dict]:
+    """Lease one due job of ``job_types`` (default: all), within its type's limit."""
+    now = datetime.now(timezone.utc)
+    for job_type in job_types or list(JOB_TYPES):
+        job = _take_over(job_type, worker_id, now)
+        if job is not None:
+            return job
+        job = _claim_pending(job_type, JOB_TYPES[job_type].concurrency, worker_id, now)
+        if job is not None:
+            job_latency_seconds.observe(
+                max((now - _aware(job["run_after"])).total_seconds(), 0), type=job_type
+            )
+            return job
+    return None
+
+
+def _aware(moment: datetime) -> datetime:
+    # pymongo hands back naive UTC datetimes unless the client is tz_aware
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def renew(job: dict, worker_id: str) -> bool:
+    """Extend the lease on a running job; False if another worker took over."""
+    now = datetime.now(timezone.utc)
+    result = _jobs_collection.update_one(
+        {"_id": job["_id"], "lease_owner": worker_id},
+        {"$set": {"lease_until": now + LEASE, "updated_at": now}},
+    )
+    return result.modified_count > 0
+
+
+def complete(job: dict, worker_id: str, result: Optional[dict] = None):
+    now = datetime.now(timezone.utc)
+    _jobs_collection.update_one(
+        {"_id": job["_id"], "lease_owner": worker_id},
+        {
+            "$set": {"status": "done", "result": result, "finished_at": now, "updated_at": now},
+            "$unset": {"slot": "", "lease_owner": "", "lease_until": "", "error": ""},
+        },
+    )
+    job_runs_total.inc(type=job["type"], outcome="done")
+
+
+def fail(job: dict, worker_id: str, exc: Exception):
+    attempts = job.get("attempts", 1)
+    job_type = JOB_TYPES.get(job["type"])
+    max_attempts = job_type.max_attempts if job_type else 1
+    now = datetime.now(timezone.utc)
+    logger.warning(
+        "Job failed",
+        exc_info=exc,
+        extra={"job_id": str(job["_id"]), "job_type": job["type"], "attempts": attempts},
+    )
+    update = {"error": str(exc) or type(exc).__name__, "updated_at": now}
+    if attempts >= max_attempts:
+        update.update(status="failed", finished_at=now)
+    else:
+        update.update(status="pending", run_after=now + RETRY_BACKOFF * 2 ** (attempts - 1))
+    _jobs_collection.update_one(
+        {"_id": job["_id"], "lease_owner": worker_id},
+        {"$set": update, "$unset": {"slot": "", "lease_owner": "", "lease_until": ""}},
+    )
+    job_runs_total.inc(type=job["type"], outcome=update["status"])
+
+
+def release(job: dict, worker_id: str):
+    """Hand an interrupted job back, due right away and without using up an attempt."""
+    now = datetime.now(timezone.utc)
+    _jobs_collection.update_one(
+        {"_id": job["_id"], "lease_owner": worker_id},
+        {
+            "$set": {"status": "pending", "run_after": now, "updated_at": now},
+            "$unset": {"slot": "", "lease_owner": "", "lease_until": ""},
+            "$inc": {"attempts": -1},
+        },
+    )
+    job_runs_total.inc(type=job["type"], outcome="interrupted")
+
+
+def run(job: dict, worker_id: str):
+    """Run a claimed job to completion or failure."""
+    job_type = JOB_TYPES.get(job["type"])
+    try:
+        if job_type is None:
+            raise LookupError(f"No handler for job type {job['type']}")
+        result = job_type.handler(job.get("payload", {}))
+    except Interrupted:
+        release(job, worker_id)
+    except Exception as exc:
+        fail(job, worker_id, exc)
+    else:
+        complete(job, worker_id, result)
+
+
+def stats(now: Optional[datetime] = None) -> List[dict]:
+    """Queue depth and latency per job type, for the admin dashboard."""
+    now = now or datetime.now(timezone.utc)
+    by_type: Dict[str, dict] = {}
+
+    def entry(job_type: str) -> dict:
+        return by_type.setdefault(
+            job_type,
+            {
+                "type": job_type,
+                "pending": 0,
+                "due": 0,
+                "running": 0,
+                "failed": 0,
+                "oldest_due_seconds": None,
+                "latency_seconds": None,
+                "duration_seconds": None,
+                "done_recently": 0,
+            },
+        )
+
+    for row in _jobs_collection.aggregate(
+        [
+            {"$match": {"status": {"$in": ["pending", "running", "failed"]}}},
+            {
+                "$group": {
+                    "_id": {"type": "$type", "status": "$status"},
+                    "count": {"$sum": 1},
+                    "due": {"$sum": {"$cond": [{"$lte": ["$run_after", now]}, 1, 0]}},
+                    "oldest_due": {
+                        "$min": {"$cond": [{"$lte": ["$run_after", now]}, "$run_after", None]}
+                    },
+                }
+            },
+        ]
+    ):
+        counts = entry(row["_id"]["type"])
+        counts[row["_id"]["status"]] = row["count"]
+        if row["_id"]["status"] == "pending":
+            counts["due"] = row["due"]
+            if row.get("oldest_due"):
+                counts["oldest_due_seconds"] = (now - _aware(row["oldest_due"])).total_seconds()
+
+    for row in _jobs_collection.aggregate(
+        [
+            {"$match": {"status": "done", "finished_at": {"$gte": now - STATS_WINDOW}}},
+            {
+                "$group": {
+                    "_id": "$type",
+                    "count": {"$sum": 1},
+                    "latency_ms": {"$avg": {"$subtract": ["$started_at", "$created_at"]}},
+                    "duration_ms": {"$avg": {"$subtract": ["$finished_at", "$started_at"]}},
+                }
+            },
+        ]
+    ):
+        counts = entry(row["_id"])
+        counts["done_recently"] = row["count"]
+        counts["latency_seconds"] = row["latency_ms"] / 1000 if row.get("latency_ms") is not None else None
+        counts["duration_seconds"] = row["duration_ms"] / 1000 if row.get("duration_ms") is not None else None
+
+    for job_type in JOB_TYPES:
+        entry(job_type)
+    return sorted(by_type.values(), key=lambda counts: counts["type"])
+
+
+class JobWorker:
+    """Runs up to ``concurrency`` jobs at a time in this process, polling for new ones."""
+
+    def __init__(
+        self,
+        concurrency: int = JOB_WORKER_CONCURRENCY,
+        interval: float = POLL_INTERVAL_SECONDS,
+        job_types: Optional[Iterable[str]] = None,
+    ):
+        self.concurrency = concurrency
+        self.interval = interval
+        self.job_types = list(job_types) if job_types else None
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._task: Optional[asyncio.Task] = None
+        self._scheduler: Optional[asyncio.Task] = None
+        self._running: set = set()
+
+    async def _heartbeat(self, job: dict):
+        while True:
+            await asyncio.sleep(LEASE.total_seconds() / 3)
+            try:
+                if not await run_in_threadpool(renew, job, self.worker_id):
+                    logger.warning("Lost the lease on a running job", extra={"job_id": str(job["_id"])})
+                    return
+            except Exception:
+                logger.warning("Could not renew a job lease", exc_info=True)
+
+    async def _execute(self, job: dict):
+        heartbeat = asyncio.get_running_loop().create_task(self._heartbeat(job))
+        try:
+            await run_in_threadpool(run, job, self.worker_id)
+        finally:
+            heartbeat.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                while len(self._running) < self.concurrency:
+                    job = await run_in_threadpool(claim, self.worker_id, self.job_types)
+                    if job is None:
+                        break
+                    task = asyncio.get_running_loop().create_task(self._execute(job))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+            except Exception:
+                logger.warning("Job worker failed", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def _schedule(self):
+        while True:
+            try:
+                await run_in_threadpool(schedule_periodic, self.job_types)
+            except Exception:
+                logger.warning("Could not queue periodic jobs", exc_info=True)
+            await asyncio.sleep(SCHEDULE_INTERVAL_SECONDS)
+
+    def start(self):
+        _stopping.clear()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self._scheduler = asyncio.get_running_loop().create_task(self._schedule())
+
+    async def stop(self):
+        _stopping.set()
+        for task in (self._task, self._scheduler):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._scheduler = None
+        # Jobs already running finish, or return early where their handler
+        # checks stopping(); those cut short are retried once their lease
+        # expires
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+
+job_worker = JobWorker()
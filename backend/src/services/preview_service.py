@@ -0,0 +1,260 @@
+"""Thumbnails of uploaded images and first-page previews of PDFs.
+
+File lists only need a small picture of each file, so after an upload is
+stored the blob is rendered once into a JPEG of at most ``PREVIEW_MAX_PX``
+pixels on a side. Rendering is a ``preview`` job, done on a process pool
+outside the GIL, and the result is kept next to the blob under
+``<blob key>.preview.jpg``. Every file record sharing the blob then gets a
+``preview_url``.
+
+The blob document tracks the state (``pending``, ``ready`` or ``failed``),
+so identical uploads are rendered only once and a pending render abandoned
+by a restart is picked up again after ``CLAIM_TIMEOUT``.
+
+Images need ``Pillow``; PDFs additionally need ``pypdfium2``. Without them
+previews are simply not generated.
+"""
+
+import io
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from database import db
+from etags import touch
+from services import blob_service, job_service
+from storage import LocalStorage, get_storage
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+try:
+    import pypdfium2
+except ImportError:  # pragma: no cover - optional dependency
+    pypdfium2 = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_MAX_PX = int(os.getenv("PREVIEW_MAX_PX", "320"))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+# Larger sources are not worth decoding for a thumbnail
+PREVIEW_MAX_SOURCE_BYTES = int(os.getenv("PREVIEW_MAX_SOURCE_MB", "50")) * 1024 * 1024
+JPEG_QUALITY = 80
+PREVIEW_JOB = "preview"
+CLAIM_TIMEOUT = timedelta(minutes=10)
+IMAGE_EXTENSIONS = {".bmp", ".gif", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"}
+PDF_EXTENSIONS = {".pdf"}
+
+_blobs_collection = db.get_collection("blobs")
+_teams_collection = db.get_collection("teams")
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def preview_kind(filename: str) -> Optional[str]:
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in IMAGE_EXTENSIONS and Image is not None:
+        return "image"
+    if extension in PDF_EXTENSIONS and Image is not None and pypdfium2 is not None:
+        return "pdf"
+    return None
+
+
+def preview_key(sha256: str) -> str:
+    return f"{blob_service.blob_key(sha256)}.preview.jpg"
+
+
+def preview_url(file_id: str) -> str:
+    return f"/student/files/{file_id}/preview"
+
+
+def render_preview(source_path: str, kind: str, max_px: int = PREVIEW_MAX_PX) -> bytes:
+    """JPEG preview of an image or a PDF's first page; runs in a worker process."""
+    if kind == "pdf":
+        document = pypdfium2.PdfDocument(source_path)
+        try:
+            page = document[0]
+            # Render close to the target size instead of at full resolution
+            scale = max_px / max(page.get_size())
+            image = page.render(scale=max(scale, 0.1)).to_pil()
+        finally:
+            document.close()
+    else:
+        image = Image.open(source_path)
+        # Decode at a reduced size where the format supports it (JPEG)
+        image.draft("RGB", (max_px, max_px))
+    image.thumbnail((max_px, max_px))
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PREVIEW_WORKERS)
+    return _executor
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def claim(sha256: str, size: int) -> bool:
+    """Take the job of rendering ``sha256``; False if done, running or hopeless."""
+    if size > PREVIEW_MAX_SOURCE_BYTES:
+        return False
+    now = datetime.now(timezone.utc)
+    result = _blobs_collection.update_one(
+        {
+            "_id": sha256,
+            "$or": [
+                {"preview": {"$exists": False}},
+                {"preview": "pending", "preview_claimed_at": {"$lt": now - CLAIM_TIMEOUT}},
+            ],
+        },
+        {"$set": {"preview": "pending", "preview_claimed_at": now}},
+    )
+    return result.modified_count > 0
+
+
+def publish(sha256: str):
+    """Point every file record with this content at its preview."""
+    _blobs_collection.update_one(
+        {"_id": sha256}, {"$set": {"preview": "ready"}, "$unset": {"preview_claimed_at": ""}}
+    )
+    _teams_collection.update_many(
+        {"files.sha256": sha256},
+        touch(
+            [
+                {
+                    "$set": {
+                        "files": {
+                            "$map": {
+                                "input": "$files",
+                                "in": {
+                                    "$cond": [
+                                        {"$eq": ["$$this.sha256", {"$literal": sha256}]},
+                                        {
+                                            "$mergeObjects": [
+                                                "$$this",
+                                                {
+                                                    "preview_url": {
+                                                        "$concat": [
+                                                            "/student/files/",
+                                                            {"$toString": "$$this._id"},
+                                                            "/preview",
+                                                        ]
+                                                    }
+                                                },
+                                            ]
+                                        },
+                                        "$$this",
+                                    ]
+                                },
+                            }
+                        }
+                    }
+                }
+            ]
+        ),
+    )
+
+
+def _mark(sha256: str, state: str):
+    _blobs_collection.update_one(
+        {"_id": sha256}, {"$set": {"preview": state}, "$unset": {"preview_claimed_at": ""}}
+    )
+
+
+def _local_source(sha256: str):
+    """A local path to the blob and whether it is a temporary copy."""
+    store = get_storage()
+    key = blob_service.blob_key(sha256)
+    if isinstance(store, LocalStorage):
+        return store.path(key), False
+    fd, path = tempfile.mkstemp(dir=blob_service.TEMP_DIR)
+    with os.fdopen(fd, "wb") as target:
+        source = store.open(key)
+        try:
+            shutil.copyfileobj(source, target, blob_service.CHUNK_SIZE)
+        finally:
+            source.close()
+    return path, True
+
+
+def _store(sha256: str, preview: bytes):
+    fd, path = tempfile.mkstemp(dir=blob_service.TEMP_DIR)
+    with os.fdopen(fd, "wb") as f:
+        f.write(preview)
+    get_storage().put_file(preview_key(sha256), path)
+
+
+def generate(sha256: str, kind: str):
+    source = None
+    temporary = False
+    try:
+        os.makedirs(blob_service.TEMP_DIR, exist_ok=True)
+        source, temporary = _local_source(sha256)
+        preview = _get_executor().submit(render_preview, source, kind).result()
+        _store(sha256, preview)
+        publish(sha256)
+    except Exception:
+        logger.warning("Preview generation failed", exc_info=True, extra={"sha256": sha256})
+        _mark(sha256, "failed")
+    finally:
+        if temporary:
+            blob_service.discard(source)
+
+
+def _preview_job(payload: dict):
+    generate(payload["sha256"], payload["kind"])
+
+
+def schedule(sha256: str, filename: str, size: int):
+    """Queue a preview for freshly stored content, if it has none yet."""
+    kind = preview_kind(filename)
+    if kind is None or not claim(sha256, size):
+        return
+    job_service.enqueue(PREVIEW_JOB, {"sha256": sha256, "kind": kind})
+
+
+def after_upload(team_id, file_id: str, sha256: str, filename: str, size: int) -> Optional[str]:
+    """Give a just-listed file record its preview, now or once rendered.
+
+    Returns the preview URL when the content was rendered before. Runs after
+    the record is pushed, so a render finishing concurrently cannot miss it.
+    """
+    if _blobs_collection.count_documents({"_id": sha256, "preview": "ready"}, limit=1):
+        url = preview_url(file_id)
+        _teams_collection.update_one(
+            {"_id": team_id, "files._id": file_id},
+            touch({"$set": {"files.$.preview_url": url}}),
+        )
+        return url
+    schedule(sha256, filename, size)
+    return None
+
+
+def download_response(sha256: str):
+    return get_storage().download_response(preview_key(sha256), "preview.jpg", "image/jpeg")
+
+
+# A failed render is recorded on the blob rather than retried
+job_service.register(PREVIEW_JOB, _preview_job, concurrency=PREVIEW_WORKERS, max_attempts=1)
@@ -0,0 +1,310 @@
+"""Per-team (and per-school) upload storage accounting.
+
+Teams keep a ``storage_used`` byte counter next to their ``files`` array.
+Uploads reserve space with a single conditional ``$inc`` before the file is
+written and release it again if the write fails or the file is deleted, so
+concurrent uploads cannot overshoot the quota and no handler has to sum the
+file list. Schools carry a rolled-up ``storage_used`` over all their teams.
+
+Counters only ever drift if a process dies between reserving and writing;
+``reconcile_storage`` recomputes them from what is actually on disk plus
+what open resumable uploads have reserved.
+"""
+
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from bson import ObjectId
+
+from database import db
+from etags import touch
+from services import blob_service, job_service
+from storage import get_storage
+from pagination import id_match
+
+TEAM_STORAGE_LIMIT = int(os.getenv("TEAM_STORAGE_LIMIT_MB", "100")) * 1024 * 1024
+# Unset: schools are only accounted, not limited
+SCHOOL_STORAGE_LIMIT = (
+    int(os.environ["SCHOOL_STORAGE_LIMIT_MB"]) * 1024 * 1024
+    if os.getenv("SCHOOL_STORAGE_LIMIT_MB")
+    else None
+)
+UPLOAD_DIR = "uploads"
+BLOB_DIRNAME = "blobs"
+RECONCILE_JOB = "storage.reconcile"
+
+_teams_collection = db.get_collection("teams")
+_competitions_collection = db.get_collection("competitions")
+_schools_collection = db.get_collection("schools")
+_sessions_collection = db.get_collection("upload_sessions")
+_reconciliations_collection = db.get_collection("storage_reconciliations")
+
+logger = logging.getLogger(__name__)
+
+
+def _backfill_team_storage(team_id) -> bool:
+    """Initialise storage_used on teams created before it was maintained."""
+    result = _teams_collection.update_one(
+        {"_id": team_id, "storage_used": {"$exists": False}},
+        touch(
+            [
+                {
+                    "$set": {
+                        "storage_used": {
+                            "$sum": {
+                                "$map": {
+                                    "input": {"$ifNull": ["$files", []]},
+                                    "in": {"$ifNull": ["$$this.size", 0]},
+                                }
+                            }
+                        }
+                    }
+                }
+            ]
+        ),
+    )
+    return result.modified_count > 0
+
+
+def school_id_for_competition(competition_id) -> Optional[str]:
+    if not competition_id:
+        return None
+    competition = _competitions_collection.find_one(
+        {"_id": id_match(competition_id)}, {"school_id": 1}
+    )
+    if not competition or not competition.get("school_id"):
+        return None
+    return str(competition["school_id"])
+
+
+def school_id_for_team(team_id) -> Optional[str]:
+    team = _teams_collection.find_one({"_id": team_id}, {"competition_id": 1})
+    if not team:
+        return None
+    return school_id_for_competition(team.get("competition_id"))
+
+
+def _reserve_school_storage(school_id: Optional[str], size: int) -> bool:
+    if school_id is None:
+        return True
+    query = {"_id": id_match(school_id), "storage_used": {"$exists": True}}
+    if SCHOOL_STORAGE_LIMIT is not None:
+        query["storage_used"] = {"$exists": True, "$lte": SCHOOL_STORAGE_LIMIT - size}
+    result = _schools_collection.update_one(query, touch({"$inc": {"storage_used": size}}))
+    if result.modified_count:
+        return True
+    # Schools are only rolled up once reconciliation has initialised them
+    return (
+        _schools_collection.count_documents(
+            {"_id": id_match(school_id), "storage_used": {"$exists": True}}, limit=1
+        )
+        == 0
+    )
+
+
+def reserve_team_storage(team_id, size: int, limit: int = TEAM_STORAGE_LIMIT) -> bool:
+    """Reserve ``size`` bytes of the team's quota (and its school's).
+
+    Returns False, reserving nothing, when either quota would be exceeded.
+    """
+    reserved = False
+    for _ in range(2):
+        result = _teams_collection.update_one(
+            {"_id": team_id, "storage_used": {"$lte": limit - size}},
+            touch({"$inc": {"storage_used": size}}),
+        )
+        if result.modified_count:
+            reserved = True
+            break
+        if not _backfill_team_storage(team_id):
+            break
+    if not reserved:
+        return False
+
+    if not _reserve_school_storage(school_id_for_team(team_id), size):
+        _teams_collection.update_one({"_id": team_id}, touch({"$inc": {"storage_used": -size}}))
+        return False
+    return True
+
+
+def release_team_storage(team_id, size: int, school_id: Optional[str] = None):
+    """Give back ``size`` bytes after a failed write or a deleted file."""
+    if not size:
+        return
+    _teams_collection.update_one(
+        {"_id": team_id, "storage_used": {"$exists": True}},
+        touch({"$inc": {"storage_used": -size}}),
+    )
+    release_school_storage(school_id or school_id_for_team(team_id), size)
+
+
+def release_school_storage(school_id: Optional[str], size: int):
+    if school_id is None or not size:
+        return
+    _schools_collection.update_one(
+        {"_id": id_match(school_id), "storage_used": {"$exists": True}},
+        touch({"$inc": {"storage_used": -size}}),
+    )
+
+
+def _disk_sizes(upload_dir: str) -> Dict[str, int]:
+    """Sizes of uploaded files keyed by the id they are stored under.
+
+    Student uploads live at ``uploads/<file id>_<name>``; uploads through
+    the generic teams API at ``uploads/<team id>/<uuid>.<ext>`` and are keyed
+    by ``<team id>/<uuid>.<ext>``. The blob store is sized separately.
+    """
+    sizes: Dict[str, int] = {}
+    if not os.path.isdir(upload_dir):
+        return sizes
+    with os.scandir(upload_dir) as entries:
+        for entry in entries:
+            if entry.is_file():
+                sizes[entry.name.split("_", 1)[0]] = entry.stat().st_size
+            elif entry.name == BLOB_DIRNAME:
+                continue
+            elif entry.is_dir():
+                with os.scandir(entry.path) as team_entries:
+                    for team_entry in team_entries:
+                        if team_entry.is_file():
+                            sizes[f"{entry.name}/{team_entry.name}"] = team_entry.stat().st_size
+    return sizes
+
+
+def _file_key(team_id: str, file: dict) -> str:
+    if file.get("sha256"):
+        return f"blob:{file['sha256']}"
+    file_id = file.get("_id") or file.get("id")
+    url = file.get("url") or ""
+    if url.startswith("/api/teams/"):
+        return f"{team_id}/{url.rsplit('/', 1)[-1]}"
+    return str(file_id)
+
+
+def reconcile_storage(upload_dir: str = UPLOAD_DIR, dry_run: bool = False, store=None) -> dict:
+    """Recompute team and school storage_used from the files actually stored.
+
+    Space reserved by open upload sessions stays charged, since completing
+    or abandoning a session settles it later. A plain upload that is between
+    reserving and writing while this runs is undercounted until the next
+    run, so schedule it for quiet hours.
+    Returns the teams and schools whose counters were (or, with ``dry_run``,
+    would be) corrected.
+    """
+    store = store or get_storage()
+    sizes = _disk_sizes(upload_dir)
+    legacy_bytes = sum(sizes.values())
+    blob_sizes: Dict[str, int] = {}
+    school_of_competition = {
+        str(competition["_id"]): str(competition["school_id"])
+        for competition in _competitions_collection.find(
+            {"school_id": {"$exists": True}}, {"school_id": 1}
+        )
+    }
+    school_totals: Dict[str, int] = {}
+    team_fixes = []
+    reserved = {
+        str(session["_id"]): session["size"]
+        for session in _sessions_collection.aggregate(
+            [{"$group": {"_id": "$team_id", "size": {"$sum": "$size"}}}]
+        )
+    }
+
+    for team in _teams_collection.find(
+        {},
+        {
+            "competition_id": 1,
+            "storage_used": 1,
+            "files._id": 1,
+            "files.id": 1,
+            "files.url": 1,
+            "files.sha256": 1,
+        },
+    ):
+        team_id = str(team["_id"])
+        for file in team.get("files", []):
+            # Shared blobs are looked up once, wherever the backend keeps them
+            sha256 = file.get("sha256")
+            if sha256 and f"blob:{sha256}" not in sizes:
+                sizes[f"blob:{sha256}"] = blob_sizes[sha256] = (
+                    store.size(blob_service.blob_key(sha256)) or 0
+                )
+        actual = sum(sizes.get(_file_key(team_id, file), 0) for file in team.get("files", []))
+        actual += reserved.get(team_id, 0)
+        school_id = school_of_competition.get(str(team.get("competition_id")))
+        if school_id:
+            school_totals[school_id] = school_totals.get(school_id, 0) + actual
+        if team.get("storage_used") != actual:
+            team_fixes.append(
+                {"team_id": team_id, "recorded": team.get("storage_used"), "actual": actual}
+            )
+            if not dry_run:
+                _teams_collection.update_one(
+                    {"_id": team["_id"]}, touch({"$set": {"storage_used": actual}})
+                )
+
+    school_fixes = []
+    for school in _schools_collection.find({}, {"storage_used": 1}):
+        school_id = str(school["_id"])
+        actual = school_totals.get(school_id, 0)
+        if school.get("storage_used") != actual:
+            school_fixes.append(
+                {"school_id": school_id, "recorded": school.get("storage_used"), "actual": actual}
+            )
+            if not dry_run:
+                _schools_collection.update_one(
+                    {"_id": school["_id"]}, touch({"$set": {"storage_used": actual}})
+                )
+
+    return {
+        "dry_run": dry_run,
+        "teams_corrected": team_fixes,
+        "schools_corrected": school_fixes,
+        # Shared blobs are charged to every team using them but stored once
+        "bytes_on_disk": legacy_bytes + sum(blob_sizes.values()),
+    }
+
+
+def start_reconciliation(dry_run: bool = False, requested_by=None) -> dict:
+    """Record a reconcile run and queue it; a job worker runs it later."""
+    run = {
+        "_id": ObjectId(),
+        "dry_run": dry_run,
+        "status": "queued",
+        "requested_by": str(requested_by) if requested_by else None,
+        "started_at": datetime.now(timezone.utc),
+    }
+    _reconciliations_collection.insert_one(run)
+    job = job_service.enqueue(RECONCILE_JOB, {"run_id": str(run["_id"]), "dry_run": dry_run})
+    _reconciliations_collection.update_one({"_id": run["_id"]}, {"$set": {"job_id": str(job["_id"])}})
+    return run
+
+
+def run_reconciliation(run_id, dry_run: bool = False):
+    """Reconcile and store the report on the run, off the request path."""
+    _reconciliations_collection.update_one({"_id": run_id}, {"$set": {"status": "running"}})
+    try:
+        report = reconcile_storage(dry_run=dry_run)
+    except Exception as exc:
+        logger.warning("Storage reconciliation failed", exc_info=True, extra={"run_id": str(run_id)})
+        update = {"status": "failed", "error": str(exc) or type(exc).__name__}
+    else:
+        update = {"status": "done", "report": report}
+    update["finished_at"] = datetime.now(timezone.utc)
+    _reconciliations_collection.update_one({"_id": run_id}, {"$set": update})
+
+
+def _reconcile_job(payload: dict):
+    run_reconciliation(ObjectId(payload["run_id"]), payload.get("dry_run", False))
+
+
+job_service.register(RECONCILE_JOB, _reconcile_job, concurrency=1, max_attempts=3)
+
+
+def get_reconciliation(run_id) -> Optional[dict]:
+    run = _reconciliations_collection.find_one({"_id": id_match(run_id)})
+    if run is not None:
+        run["id"] = str(run.pop("_id"))
+    return run
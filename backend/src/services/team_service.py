@@ -2,9 +2,19 @@ from database import db
 from models import Team, PydanticObjectId, ChatMessage, File
 from typing import List, Optional
 from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pagination import id_match, page_query, projection_for
+from etags import touch
+from services import blob_service, competition_service, quota_service
 
 _teams_collection = db.get_collection("teams")
 
+# Everything except the unbounded embedded arrays, for writes whose caller
+# does not need the chat history or file list back
+SUMMARY_PROJECTION = {"chat": 0, "files": 0}
+# Fields _team_helper cannot do without, always part of a field selection
+TEAM_REQUIRED_FIELDS = ("name", "competition_id", "created_at", "updated_at")
+
 def _team_helper(team_data) -> Team:
     members = []
     for member in team_data.get("members", []):
@@ -21,84 +31,195 @@ def _team_helper(team_data) -> Team:
         updated_at=team_data["updated_at"],
     )
 
+def _update_and_return(
+    team_id: PydanticObjectId,
+    update: dict,
+    projection: Optional[dict] = None,
+    conditions: Optional[dict] = None,
+) -> Optional[Team]:
+    """Apply an update and fetch the result in a single round trip.
+
+    Returns None when the team does not exist or does not meet ``conditions``.
+    """
+    team_data = _teams_collection.find_one_and_update(
+        {"_id": team_id, **(conditions or {})},
+        touch(update),
+        projection=projection,
+        return_document=ReturnDocument.AFTER,
+    )
+    if team_data:
+        return _team_helper(team_data)
+    return None
+
 def create_team(team: Team) -> Team:
     team_dict = team.model_dump(by_alias=True)
     team_dict["created_at"] = datetime.now(timezone.utc)
     team_dict["updated_at"] = datetime.now(timezone.utc)
+    team_dict["member_count"] = len(team_dict.get("members", []))
+    team_dict["storage_used"] = sum(f.get("size", 0) for f in team_dict.get("files", []))
     result = _teams_collection.insert_one(team_dict)
     team.id = result.inserted_id
+    competition_service.track_team_created(team_dict["competition_id"])
     return team
 
-def get_team(team_id: PydanticObjectId) -> Optional[Team]:
-    team_data = _teams_collection.find_one({"_id": team_id})
+def get_team(team_id: PydanticObjectId, fields: Optional[List[str]] = None) -> Optional[Team]:
+    team_data = _teams_collection.find_one(
+        {"_id": team_id}, projection_for(fields, TEAM_REQUIRED_FIELDS)
+    )
     if team_data:
         return _team_helper(team_data)
     return None
 
-def get_teams() -> List[Team]:
+def get_teams(
+    filters: Optional[dict] = None,
+    after: Optional[PydanticObjectId] = None,
+    limit: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+) -> List[Team]:
     teams = []
-    for team_data in _teams_collection.find():
+    for team_data in _teams_collection.find(
+        page_query(filters or {}, after),
+        projection_for(fields, TEAM_REQUIRED_FIELDS),
+        sort=[("_id", 1)],
+        limit=limit or 0,
+    ):
         teams.append(_team_helper(team_data))
     return teams
 
+def count_teams(filters: Optional[dict] = None) -> int:
+    return _teams_collection.count_documents(filters or {})
+
 def update_team(team_id: PydanticObjectId, team_data: dict) -> Optional[Team]:
-    # Check if team exists first
-    if not _teams_collection.find_one({"_id": team_id}):
-        return None
     team_data["updated_at"] = datetime.now(timezone.utc)
-    _teams_collection.update_one({"_id": team_id}, {"$set": team_data})
-    return get_team(team_id)
+    return _update_and_return(team_id, {"$set": team_data})
 
 def delete_team(team_id: PydanticObjectId):
-    result = _teams_collection.delete_one({"_id": team_id})
-    return {"message": "Team deleted successfully", "deleted_count": result.deleted_count}
+    deleted = _teams_collection.find_one_and_delete(
+        {"_id": team_id},
+        projection={"competition_id": 1, "storage_used": 1, "files.sha256": 1},
+    )
+    if deleted:
+        competition_service.release_team_slot(deleted["competition_id"])
+        for file in deleted.get("files", []):
+            blob_service.release(file.get("sha256"))
+        quota_service.release_school_storage(
+            quota_service.school_id_for_competition(deleted["competition_id"]),
+            deleted.get("storage_used", 0),
+        )
+    return {"message": "Team deleted successfully", "deleted_count": 1 if deleted else 0}
 
 def add_member_to_team(team_id: PydanticObjectId, user_id: PydanticObjectId, user_name: str) -> Optional[Team]:
-    # Check if team exists first
-    if not _teams_collection.find_one({"_id": team_id}):
-        return None
     member_data = {"user_id": user_id, "name": user_name}
-    _teams_collection.update_one({"_id": team_id}, {"$push": {"members": member_data}})
-    return get_team(team_id)
+    return _update_and_return(team_id, member_addition(member_data))
+
+def member_addition(member: dict) -> list:
+    """Pipeline update appending a member and recounting member_count."""
+    return [
+        {
+            "$set": {
+                "members": {
+                    "$concatArrays": [{"$ifNull": ["$members", []]}, [{"$literal": member}]]
+                }
+            }
+        },
+        {"$set": {"member_count": {"$size": "$members"}}},
+    ]
+
+def member_removal(*user_ids) -> list:
+    """Pipeline update removing members and recounting member_count.
+
+    Recounting from the array (rather than decrementing) keeps the counter
+    exact and initialises it on teams created before it was maintained.
+    """
+    return [
+        {
+            "$set": {
+                "members": {
+                    "$filter": {
+                        "input": {"$ifNull": ["$members", []]},
+                        "cond": {"$not": [{"$in": ["$$this.user_id", list(user_ids)]}]},
+                    }
+                }
+            }
+        },
+        {"$set": {"member_count": {"$size": "$members"}}},
+    ]
 
 def remove_member_from_team(team_id: PydanticObjectId, user_id: PydanticObjectId) -> Optional[Team]:
-    # Check if team exists first
-    if not _teams_collection.find_one({"_id": team_id}):
-        return None
-    _teams_collection.update_one({"_id": team_id}, {"$pull": {"members": {"user_id": user_id}}})
-    return get_team(team_id)
+    updated = _update_and_return(
+        team_id, member_removal(user_id), conditions={"members.user_id": user_id}
+    )
+    # Not a member: nothing to change, return the team as it is
+    return updated or get_team(team_id)
+
+def _backfill_member_count(team_id) -> bool:
+    """Initialise member_count on teams created before it was maintained."""
+    result = _teams_collection.update_one(
+        {"_id": team_id, "member_count": {"$exists": False}},
+        [{"$set": {"member_count": {"$size": {"$ifNull": ["$members", []]}}}}],
+    )
+    return result.modified_count > 0
+
+def join_team(team_id, member: dict, max_members: int) -> bool:
+    """Atomically add ``member`` unless the team already has ``max_members``.
+
+    The limit is checked against the team's member_count in the same update
+    that pushes the member, so concurrent approvals cannot overfill a team.
+    Returns False when the team is full or already contains the user.
+    """
+    for _ in range(2):
+        result = _teams_collection.update_one(
+            {
+                "_id": team_id,
+                "member_count": {"$lt": max_members},
+                "members.user_id": {"$ne": member["user_id"]},
+            },
+            touch({"$push": {"members": member}, "$inc": {"member_count": 1}}),
+        )
+        if result.modified_count:
+            return True
+        if not _backfill_member_count(team_id):
+            return False
+    return False
 
 
 def add_chat_message(team_id: PydanticObjectId, message: ChatMessage) -> Optional[Team]:
     """Add a chat message to a team"""
-    if not _teams_collection.find_one({"_id": team_id}):
-        return None
     message_dict = message.model_dump(by_alias=True)
-    _teams_collection.update_one(
-        {"_id": team_id},
-        {"$push": {"chat": message_dict}}
-    )
-    return get_team(team_id)
+    return _update_and_return(team_id, {"$push": {"chat": message_dict}})
 
 
-def add_file(team_id: PydanticObjectId, file: File) -> Optional[Team]:
+def add_file(team_id: PydanticObjectId, file: File, projection: Optional[dict] = None) -> Optional[Team]:
     """Add a file to a team"""
-    if not _teams_collection.find_one({"_id": team_id}):
-        return None
     file_dict = file.model_dump(by_alias=True)
-    _teams_collection.update_one(
-        {"_id": team_id},
-        {"$push": {"files": file_dict}}
-    )
-    return get_team(team_id)
+    return _update_and_return(team_id, {"$push": {"files": file_dict}}, projection)
 
 
-def delete_file(team_id: PydanticObjectId, file_id: str) -> Optional[Team]:
-    """Delete a file from a team"""
-    if not _teams_collection.find_one({"_id": team_id}):
+def get_file(team_id: PydanticObjectId, url: str) -> Optional[File]:
+    """Look up one file record by its download URL without loading the team"""
+    team_data = _teams_collection.find_one(
+        {"_id": team_id, "files.url": url}, {"files.$": 1}
+    )
+    if not team_data:
         return None
-    _teams_collection.update_one(
-        {"_id": team_id},
-        {"$pull": {"files": {"id": file_id}}}
+    return File(**team_data["files"][0])
+
+
+def delete_file(team_id: PydanticObjectId, file_id: str) -> Optional[dict]:
+    """Remove a file record; returns the removed record, None if there was none.
+
+    Only the call that actually pulled the record gets it back, so its space
+    and blob reference are given back exactly once.
+    """
+    removed = _teams_collection.find_one_and_update(
+        {"_id": team_id, "files._id": id_match(file_id)},
+        touch({"$pull": {"files": {"_id": id_match(file_id)}}}),
+        projection={"files.$": 1},
+        return_document=ReturnDocument.BEFORE,
     )
-    return get_team(team_id)
\ No newline at end of file
+    return removed["files"][0] if removed else None
+
+
+def team_exists(team_id: PydanticObjectId) -> bool:
+    """Cheap existence check that transfers only the _id"""
+    return _teams_collection.find_one({"_id": team_id}, {"_id": 1}) is not None
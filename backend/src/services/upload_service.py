@@ -0,0 +1,219 @@
+"""Resumable, chunked uploads of team files.
+
+A client opens a session declaring the file's name and size, which reserves
+that much of the team's quota up front. It then PUTs the content in chunks,
+each at the offset the server has acknowledged so far, and finalizes once
+everything has arrived; the assembled file then goes through the blob store
+like any other upload. After a dropped connection the client asks for the
+current offset and carries on from there.
+
+Chunks are appended to a local temporary file. A short lease on the session
+keeps two requests from writing at the same time, and a chunk only counts
+once it has been written completely, so a half-written chunk is simply
+overwritten by the retry. Sessions nobody touches for
+``UPLOAD_SESSION_TTL_HOURS`` are expired by a periodic ``uploads.expire``
+job, giving their quota back.
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterable, Optional
+
+from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+from database import db
+from services import blob_service, job_service, quota_service
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SESSION_TTL = timedelta(hours=int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24")))
+# Suggested to clients; any chunk size is accepted
+CHUNK_SIZE = 8 * 1024 * 1024
+# How long a chunk write may hold the session before another request may take over
+CHUNK_LEASE = timedelta(minutes=5)
+# Bytes of a chunk held in memory between disk writes
+WRITE_BUFFER_SIZE = 1024 * 1024
+EXPIRY_INTERVAL_SECONDS = 300
+EXPIRY_JOB = "uploads.expire"
+
+_sessions_collection = db.get_collection("upload_sessions")
+
+
+class ChunkTooLarge(Exception):
+    """The chunk would take the upload past its declared size."""
+
+
+def _temp_path(upload_id) -> str:
+    os.makedirs(blob_service.TEMP_DIR, exist_ok=True)
+    return os.path.join(blob_service.TEMP_DIR, f"upload-{upload_id}")
+
+
+def _unleased(now: datetime) -> dict:
+    return {"$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]}
+
+
+def create_session(team_id, user_id: str, user_name: str, filename: str, size: int) -> Optional[dict]:
+    """Open a session, reserving ``size`` bytes of the team's quota.
+
+    Returns None, reserving nothing, when the quota would be exceeded.
+    """
+    if not quota_service.reserve_team_storage(team_id, size):
+        return None
+    now = datetime.now(timezone.utc)
+    upload_id = ObjectId()
+    session = {
+        "_id": upload_id,
+        "team_id": team_id,
+        "user_id": user_id,
+        "user_name": user_name,
+        "filename": filename,
+        "size": size,
+        "received": 0,
+        "path": _temp_path(upload_id),
+        "created_at": now,
+        "expires_at": now + UPLOAD_SESSION_TTL,
+    }
+    try:
+        open(session["path"], "wb").close()
+        _sessions_collection.insert_one(session)
+    except Exception:
+        quota_service.release_team_storage(team_id, size)
+        blob_service.discard(session["path"])
+        raise
+    return session
+
+
+def get_session(upload_id, user_id: str) -> Optional[dict]:
+    return _sessions_collection.find_one({"_id": upload_id, "user_id": user_id})
+
+
+def claim_chunk(upload_id, user_id: str, offset: int) -> Optional[dict]:
+    """Lease the session for writing at ``offset``.
+
+    None when the session is missing, expired, busy or expects another offset.
+    """
+    now = datetime.now(timezone.utc)
+    return _sessions_collection.find_one_and_update(
+        {
+            "_id": upload_id,
+            "user_id": user_id,
+            "received": offset,
+            "expires_at": {"$gt": now},
+            **_unleased(now),
+        },
+        {"$set": {"lease_until": now + CHUNK_LEASE}},
+    )
+
+
+def _write_at(path: str, offset: int, data: bytes, truncate: bool = False):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+        if truncate:
+            # Drop whatever an interrupted earlier attempt left past this chunk
+            f.truncate()
+
+
+async def write_chunk(session: dict, offset: int, stream: AsyncIterable[bytes]) -> int:
+    """Write a request body at ``offset``; returns the number of bytes written.
+
+    The body is gathered into ``WRITE_BUFFER_SIZE`` pieces, each written from
+    the threadpool so disk waits do not stall the event loop.
+    """
+    written = 0
+    buffer = bytearray()
+    async for chunk in stream:
+        if offset + written + len(buffer) + len(chunk) > session["size"]:
+            raise ChunkTooLarge()
+        buffer += chunk
+        if len(buffer) >= WRITE_BUFFER_SIZE:
+            await run_in_threadpool(_write_at, session["path"], offset + written, bytes(buffer))
+            written += len(buffer)
+            buffer.clear()
+    await run_in_threadpool(
+        _write_at, session["path"], offset + written, bytes(buffer), truncate=True
+    )
+    return written + len(buffer)
+
+
+def acknowledge_chunk(session: dict, offset: int, written: int) -> int:
+    """Record a completely written chunk and release the lease; returns the new offset."""
+    received = offset + written
+    _sessions_collection.update_one(
+        {"_id": session["_id"], "received": offset},
+        {
+            "$set": {
+                "received": received,
+                "expires_at": datetime.now(timezone.utc) + UPLOAD_SESSION_TTL,
+            },
+            "$unset": {"lease_until": ""},
+        },
+    )
+    return received
+
+
+def release_chunk(session: dict):
+    """Give up the lease after a failed chunk; the retry overwrites it."""
+    _sessions_collection.update_one({"_id": session["_id"]}, {"$unset": {"lease_until": ""}})
+
+
+def take_completed(upload_id, user_id: str) -> Optional[dict]:
+    """Remove and return a fully received session for finalizing.
+
+    The caller owns the reserved quota and the temporary file from here on.
+    """
+    now = datetime.now(timezone.utc)
+    return _sessions_collection.find_one_and_delete(
+        {
+            "_id": upload_id,
+            "user_id": user_id,
+            "$expr": {"$eq": ["$received", "$size"]},
+            **_unleased(now),
+        }
+    )
+
+
+def _discard(session: dict):
+    quota_service.release_team_storage(session["team_id"], session["size"])
+    blob_service.discard(session["path"])
+
+
+def abort(upload_id, user_id: str) -> bool:
+    session = _sessions_collection.find_one_and_delete({"_id": upload_id, "user_id": user_id})
+    if session is None:
+        return False
+    _discard(session)
+    return True
+
+
+def expire_sessions(now: Optional[datetime] = None) -> int:
+    """Drop sessions past their expiry, returning their quota; returns how many."""
+    now = now or datetime.now(timezone.utc)
+    expired = 0
+    # One at a time, so concurrent sweepers never release the same quota twice
+    while True:
+        session = _sessions_collection.find_one_and_delete(
+            {"expires_at": {"$lt": now}, **_unleased(now)}
+        )
+        if session is None:
+            return expired
+        _discard(session)
+        expired += 1
+
+
+def _expire_job(payload: dict) -> dict:
+    expired = expire_sessions()
+    if expired:
+        logger.info("Expired abandoned upload sessions", extra={"count": expired})
+    return {"expired": expired}
+
+
+job_service.register(
+    EXPIRY_JOB,
+    _expire_job,
+    concurrency=1,
+    max_attempts=1,
+    every=timedelta(seconds=EXPIRY_INTERVAL_SECONDS),
+)
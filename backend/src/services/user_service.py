@@ -2,9 +2,15 @@ from database import db
 from models import User, UserOut, PydanticObjectId
 from typing import List, Optional
 from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pagination import page_query, projection_for
+from services import cascade_service
 
 _users_collection = db.get_collection("users")
 
+# Fields _user_helper cannot do without, always part of a field selection
+USER_REQUIRED_FIELDS = ("name", "email", "role", "created_at", "updated_at")
+
 
 def _user_helper(user_data) -> UserOut:
     return UserOut(
@@ -29,33 +35,70 @@ def create_user(user: User) -> User:
     return user
 
 
-def get_user(user_id: PydanticObjectId) -> Optional[UserOut]:
-    user_data = _users_collection.find_one({"_id": user_id})
+def get_user(
+    user_id: PydanticObjectId, fields: Optional[List[str]] = None
+) -> Optional[UserOut]:
+    user_data = _users_collection.find_one(
+        {"_id": user_id},
+        projection_for(fields, USER_REQUIRED_FIELDS, excluded=("password",)),
+    )
     if user_data:
         return _user_helper(user_data)
     return None
 
 
-def get_users() -> List[UserOut]:
+def get_users(
+    filters: Optional[dict] = None,
+    after: Optional[PydanticObjectId] = None,
+    limit: Optional[int] = None,
+    fields: Optional[List[str]] = None,
+) -> List[UserOut]:
     users = []
-    for user_data in _users_collection.find():
+    for user_data in _users_collection.find(
+        page_query(filters or {}, after),
+        projection_for(fields, USER_REQUIRED_FIELDS, excluded=("password",)),
+        sort=[("_id", 1)],
+        limit=limit or 0,
+    ):
         users.append(_user_helper(user_data))
     return users
 
 
+def count_users(filters: Optional[dict] = None) -> int:
+    return _users_collection.count_documents(filters or {})
+
+
 def update_user(user_id: PydanticObjectId, user_data: dict) -> Optional[UserOut]:
-    # Check if user exists first
-    if not _users_collection.find_one({"_id": user_id}):
-        return None
     user_data["updated_at"] = datetime.now(timezone.utc)
-    _users_collection.update_one({"_id": user_id}, {"$set": user_data})
-    return get_user(user_id)
+    # Single round trip: None means the user does not exist. The password
+    # hash is never part of UserOut, so it is not transferred back either.
+    updated = _users_collection.find_one_and_update(
+        {"_id": user_id},
+        {"$set": user_data},
+        projection={"password": 0},
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated:
+        return _user_helper(updated)
+    return None
 
 
-def delete_user(user_id: PydanticObjectId):
-    result = _users_collection.delete_one({"_id": user_id})
+def delete_user(user_id: PydanticObjectId, requested_by=None, anonymize_messages: bool = False):
+    """Delete a user; what they left in teams is erased in the background.
+
+    With ``anonymize_messages`` their chat messages stay, credited to a
+    deleted user, instead of being removed.
+    """
+    deletion = cascade_service.start(
+        "user",
+        user_id,
+        lambda: _users_collection.delete_one({"_id": user_id}).deleted_count,
+        requested_by,
+        anonymize_messages=anonymize_messages,
+    )
     return {
         "message": "User deleted successfully",
-        "deleted_count": result.deleted_count,
+        "deleted_count": 1 if deletion else 0,
+        "deletion_id": str(deletion["_id"]) if deletion else None,
     }
 
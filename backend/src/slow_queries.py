@@ -0,0 +1,207 @@
+"""Opt-in slow MongoDB command log with sampled explain plans.
+
+Enabled by setting ``MONGO_SLOW_QUERY_MS``. Every command slower than the
+threshold is logged with the route that issued it and the *shape* of its
+filter (values replaced by their type names, so logs carry no user data).
+A sample of those commands is re-run through ``explain`` on a background
+thread to record whether an index was used.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from pymongo import monitoring
+
+import metrics
+from request_context import current_request_id, current_route
+
+logger = logging.getLogger("slow_queries")
+
+SLOW_QUERY_MS = os.getenv("MONGO_SLOW_QUERY_MS")
+EXPLAIN_SAMPLE_RATE = float(os.getenv("MONGO_SLOW_QUERY_EXPLAIN_RATE", "0.1"))
+
+# Commands that carry a query filter and can be passed to explain as-is
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Driver/session fields that explain rejects or that are irrelevant to the plan
+_INTERNAL_FIELDS = {
+    "lsid",
+    "$db",
+    "$clusterTime",
+    "$readPreference",
+    "txnNumber",
+    "autocommit",
+    "startTransaction",
+    "readConcern",
+    "writeConcern",
+}
+# Index-backed leaf stages reported by the query planner
+_INDEX_STAGES = {"IXSCAN", "IDHACK", "EXPRESS_IXSCAN", "EXPRESS_CLUSTERED_IXSCAN", "COUNT_SCAN", "DISTINCT_SCAN"}
+
+slow_queries_total = metrics.REGISTRY.register(
+    metrics.Counter(
+        "projektor_mongo_slow_queries_total",
+        "MongoDB commands slower than MONGO_SLOW_QUERY_MS.",
+        ("collection", "command"),
+    )
+)
+collection_scans_total = metrics.REGISTRY.register(
+    metrics.Counter(
+        "projektor_mongo_collection_scans_total",
+        "Sampled slow commands whose winning plan was a collection scan.",
+        ("collection", "command"),
+    )
+)
+
+_explaining = threading.local()
+
+
+def filter_shape(value: Any) -> Any:
+    """Replace literal values with their type names, keeping operators and keys."""
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        # Array shape is the shape of its first element; length is not part of it
+        return [filter_shape(value[0])] if value else []
+    return type(value).__name__
+
+
+def _query_of(command: Dict[str, Any]) -> Any:
+    name = next(iter(command))
+    if name in ("find", "count", "distinct"):
+        return command.get("filter", command.get("query", {}))
+    if name == "findAndModify":
+        return command.get("query", {})
+    if name == "aggregate":
+        pipeline = command.get("pipeline", [])
+        return pipeline[0].get("$match", {}) if pipeline else {}
+    if name == "update":
+        updates = command.get("updates", [])
+        return updates[0].get("q", {}) if updates else {}
+    if name == "delete":
+        deletes = command.get("deletes", [])
+        return deletes[0].get("q", {}) if deletes else {}
+    return None
+
+
+def _plan_stages(plan: Dict[str, Any]):
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _plan_stages(child)
+
+
+def summarize_plan(explain_result: Dict[str, Any]) -> Dict[str, Any]:
+    planner = explain_result.get("queryPlanner")
+    if planner is None:
+        # Aggregations nest the planner output under their first stage
+        for stage in explain_result.get("stages", []):
+            if "$cursor" in stage:
+                planner = stage["$cursor"].get("queryPlanner")
+                break
+    planner = planner or {}
+    stages = list(_plan_stages(planner.get("winningPlan", {})))
+    return {
+        "stages": stages,
+        "index_used": any(stage in _INDEX_STAGES for stage in stages),
+        "collection_scan": "COLLSCAN" in stages,
+    }
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float, explain_sample_rate: float = EXPLAIN_SAMPLE_RATE):
+        self.threshold_micros = threshold_ms * 1000
+        self.explain_sample_rate = explain_sample_rate
+        self._pending: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _key(self, event):
+        return (event.connection_id, event.request_id)
+
+    def started(self, event):
+        if getattr(_explaining, "active", False):
+            return
+        command = event.command
+        collection = command.get(event.command_name)
+        if not isinstance(collection, str):
+            # Admin commands (ping, hello, ...) have no collection
+            return
+        with self._lock:
+            self._pending[self._key(event)] = {
+                "command": dict(command),
+                "collection": collection,
+                "route": current_route(),
+                "request_id": current_request_id(),
+            }
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            pending = self._pending.pop(self._key(event), None)
+        if pending is None or event.duration_micros < self.threshold_micros:
+            return
+
+        command = pending["command"]
+        entry = {
+            "route": pending["route"],
+            "request_id": pending["request_id"],
+            "database": event.database_name,
+            "collection": pending["collection"],
+            "command": event.command_name,
+            "duration_ms": round(event.duration_micros / 1000, 2),
+            "filter_shape": filter_shape(_query_of(command)),
+        }
+        slow_queries_total.inc(collection=entry["collection"], command=entry["command"])
+
+        if event.command_name in EXPLAINABLE and random.random() < self.explain_sample_rate:
+            self._explain_later(event.database_name, command, entry)
+        else:
+            logger.warning("slow query %s", json.dumps(entry, default=str))
+
+    def _explain_later(self, database_name, command, entry):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="slow-query-explain"
+            )
+        self._executor.submit(self._explain, database_name, command, entry)
+
+    def _explain(self, database_name, command, entry):
+        from database import client
+
+        explainable = {k: v for k, v in command.items() if k not in _INTERNAL_FIELDS}
+        _explaining.active = True
+        try:
+            result = client[database_name].command(
+                {"explain": explainable, "verbosity": "queryPlanner"}
+            )
+            entry["plan"] = summarize_plan(result)
+            if entry["plan"]["collection_scan"]:
+                collection_scans_total.inc(
+                    collection=entry["collection"], command=entry["command"]
+                )
+        except Exception as e:
+            entry["plan"] = {"error": str(e)}
+        finally:
+            _explaining.active = False
+        logger.warning("slow query %s", json.dumps(entry, default=str))
+
+
+def listener_from_env() -> Optional[SlowQueryListener]:
+    if not SLOW_QUERY_MS:
+        return None
+    return SlowQueryListener(float(SLOW_QUERY_MS))
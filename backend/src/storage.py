@@ -0,0 +1,182 @@
+"""Where uploaded file content lives.
+
+The blob store talks to a ``Storage`` backend through object keys such as
+``blobs/ab/cd/<sha256>``:
+
+- ``LocalStorage`` keeps objects under ``uploads/`` and serves them as
+  configured in ``file_serving`` (directly or through the proxy).
+- ``S3Storage`` keeps them in an S3-compatible bucket (AWS, MinIO, Ceph...)
+  and answers downloads with a redirect to a short-lived presigned URL, so
+  file bytes never pass through Python.
+
+``STORAGE_BACKEND`` selects the backend; the S3 backend needs ``boto3``.
+"""
+
+import os
+from typing import BinaryIO, Iterator, Optional
+
+from fastapi.responses import RedirectResponse
+from starlette.responses import Response
+
+from file_serving import UPLOAD_DIR, content_disposition, file_response
+
+try:
+    import boto3
+except ImportError:  # pragma: no cover - optional dependency
+    boto3 = None
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+# Set for S3-compatible services, e.g. http://localhost:9000 for MinIO
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PRESIGN_SECONDS = int(os.getenv("S3_PRESIGN_SECONDS", "300"))
+
+
+class LocalStorage:
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put_file(self, key: str, source_path: str):
+        """Move a finished local file into storage."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path(key), "rb")
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.path(key))
+        except FileNotFoundError:
+            return None
+
+    def keys(self, prefix: str, start_after: Optional[str] = None) -> Iterator[str]:
+        """Keys under the directory ``prefix`` in order, resuming after ``start_after``."""
+        prefix = prefix.strip("/")
+        yield from self._walk(self.path(prefix), prefix, start_after)
+
+    def _walk(self, directory: str, prefix: str, start_after: Optional[str]) -> Iterator[str]:
+        try:
+            names = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return
+        for name in names:
+            key = f"{prefix}/{name}" if prefix else name
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                # Whole directories before the checkpoint are not listed again
+                if start_after is None or start_after.startswith(key + "/") or key > start_after:
+                    yield from self._walk(path, key, start_after)
+            elif start_after is None or key > start_after:
+                yield key
+
+    def download_response(
+        self, key: str, filename: str, media_type: str = "application/octet-stream"
+    ) -> Optional[Response]:
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        return file_response(path, filename, media_type, root=self.root)
+
+
+class S3Storage:
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        client=None,
+        presign_seconds: int = S3_PRESIGN_SECONDS,
+    ):
+        if client is None:
+            if boto3 is None:
+                raise RuntimeError("STORAGE_BACKEND=s3 requires the boto3 package")
+            # Credentials come from the usual AWS_* variables or instance role
+            client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+        self.bucket = bucket
+        self.client = client
+        self.presign_seconds = presign_seconds
+
+    def exists(self, key: str) -> bool:
+        return self.size(key) is not None
+
+    def put_file(self, key: str, source_path: str):
+        # upload_file switches to multipart uploads for large files
+        self.client.upload_file(source_path, self.bucket, key)
+        os.remove(source_path)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def keys(self, prefix: str, start_after: Optional[str] = None) -> Iterator[str]:
+        """Keys under ``prefix`` in order, resuming after ``start_after``."""
+        arguments = {"Bucket": self.bucket, "Prefix": prefix.strip("/") + "/"}
+        if start_after:
+            arguments["StartAfter"] = start_after
+        for page in self.client.get_paginator("list_objects_v2").paginate(**arguments):
+            for item in page.get("Contents", []):
+                yield item["Key"]
+
+    def open(self, key: str) -> BinaryIO:
+        """Streaming body of the object; read it in chunks and close it."""
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def size(self, key: str) -> Optional[int]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["ContentLength"]
+        except self.client.exceptions.ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def download_url(
+        self, key: str, filename: str, media_type: str = "application/octet-stream"
+    ) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": key,
+                "ResponseContentDisposition": content_disposition(filename),
+                "ResponseContentType": media_type,
+            },
+            ExpiresIn=self.presign_seconds,
+        )
+
+    def download_response(
+        self, key: str, filename: str, media_type: str = "application/octet-stream"
+    ) -> Optional[Response]:
+        # No HEAD round trip: a missing object is reported by the bucket
+        return RedirectResponse(
+            self.download_url(key, filename, media_type),
+            status_code=307,
+            headers={"Cache-Control": "private, no-store"},
+        )
+
+
+_storage = None
+
+
+def get_storage():
+    """The configured backend, created on first use."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3Storage()
+        elif STORAGE_BACKEND == "local":
+            _storage = LocalStorage()
+        else:
+            raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+    return _storage
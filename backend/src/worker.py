@@ -0,0 +1,40 @@
+"""Standalone job worker, run next to uvicorn with ``python -m worker``.
+
+Set ``JOB_WORKER_EMBEDDED=false`` on the API processes so jobs only run
+here.
+"""
+
+import asyncio
+import logging
+import signal
+
+from logging_config import configure_logging
+from services import job_service
+
+# Imported for the job types they register
+from services import (  # noqa: F401
+    cascade_service,
+    gc_service,
+    preview_service,
+    quota_service,
+    upload_service,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def main():
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    job_service.job_worker.start()
+    logger.info("Job worker started", extra={"worker_id": job_service.job_worker.worker_id})
+    await stopping.wait()
+    await job_service.job_worker.stop()
+    preview_service.shutdown()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(main())
@@ -85,8 +85,7 @@ def test_get_competition_not_found(mocker):
 
 def test_update_competition(mocker, sample_competition_data):
     mock_collection = mocker.patch('services.competition_service._competitions_collection')
-    mock_collection.find_one.side_effect = [sample_competition_data, {**sample_competition_data, "name": "Updated Competition"}]
-    mock_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_collection.find_one_and_update.return_value = {**sample_competition_data, "name": "Updated Competition"}
     
     response = client.put(f"/api/competitions/{sample_competition_data['_id']}", json={"name": "Updated Competition"})
     assert response.status_code == 200
@@ -94,7 +93,7 @@ def test_update_competition(mocker, sample_competition_data):
 
 def test_update_competition_not_found(mocker):
     mock_collection = mocker.patch('services.competition_service._competitions_collection')
-    mock_collection.find_one.return_value = None
+    mock_collection.find_one_and_update.return_value = None
     
     response = client.put(f"/api/competitions/{PydanticObjectId()}", json={"name": "Updated Competition"})
     assert response.status_code == 404
@@ -102,14 +101,21 @@ def test_update_competition_not_found(mocker):
 
 def test_delete_competition(mocker, sample_competition_data):
     mock_collection = mocker.patch('services.competition_service._competitions_collection')
+    mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
+    mock_collection.find_one.return_value = {"_id": sample_competition_data["_id"]}
     mock_collection.delete_one.return_value = MagicMock(deleted_count=1)
     
     response = client.delete(f"/api/competitions/{sample_competition_data['_id']}")
     assert response.status_code == 200
     assert response.json()["message"] == "Competition deleted successfully"
+    assert response.json()["deletion_id"]
 
 def test_delete_competition_not_found(mocker):
     mock_collection = mocker.patch('services.competition_service._competitions_collection')
+    mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
+    mock_collection.find_one.return_value = None
     mock_collection.delete_one.return_value = MagicMock(deleted_count=0)
     
     response = client.delete(f"/api/competitions/{PydanticObjectId()}")
@@ -20,6 +20,9 @@ def mock_db_connection(mocker):
     mocker.patch('services.user_service._users_collection', new=MagicMock())
     mocker.patch('services.team_service._teams_collection', new=MagicMock())
     mocker.patch('services.competition_service._competitions_collection', new=MagicMock())
+    mocker.patch('services.quota_service._teams_collection', new=MagicMock())
+    mocker.patch('services.quota_service._competitions_collection', new=MagicMock())
+    mocker.patch('services.quota_service._schools_collection', new=MagicMock())
     mocker.patch('api.auth.db.get_collection', return_value=MagicMock())
     mocker.patch('api.admin.db.get_collection', return_value=MagicMock())
     mocker.patch('api.headteacher.db.get_collection', return_value=MagicMock())
@@ -78,8 +81,7 @@ def test_get_team_not_found(mocker):
 
 def test_update_team(mocker, sample_team_data):
     mock_collection = mocker.patch('services.team_service._teams_collection')
-    mock_collection.find_one.side_effect = [sample_team_data, {**sample_team_data, "name": "Updated Team"}]
-    mock_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_collection.find_one_and_update.return_value = {**sample_team_data, "name": "Updated Team"}
     
     response = client.put(f"/api/teams/{sample_team_data['_id']}", json={"name": "Updated Team"})
     assert response.status_code == 200
@@ -87,7 +89,7 @@ def test_update_team(mocker, sample_team_data):
 
 def test_update_team_not_found(mocker):
     mock_collection = mocker.patch('services.team_service._teams_collection')
-    mock_collection.find_one.return_value = None
+    mock_collection.find_one_and_update.return_value = None
     
     response = client.put(f"/api/teams/{PydanticObjectId()}", json={"name": "Updated Team"})
     assert response.status_code == 404
@@ -95,7 +97,7 @@ def test_update_team_not_found(mocker):
 
 def test_delete_team(mocker, sample_team_data):
     mock_collection = mocker.patch('services.team_service._teams_collection')
-    mock_collection.delete_one.return_value = MagicMock(deleted_count=1)
+    mock_collection.find_one_and_delete.return_value = {"_id": sample_team_data["_id"], "competition_id": sample_team_data["competition_id"]}
     
     response = client.delete(f"/api/teams/{sample_team_data['_id']}")
     assert response.status_code == 200
@@ -103,7 +105,7 @@ def test_delete_team(mocker, sample_team_data):
 
 def test_delete_team_not_found(mocker):
     mock_collection = mocker.patch('services.team_service._teams_collection')
-    mock_collection.delete_one.return_value = MagicMock(deleted_count=0)
+    mock_collection.find_one_and_delete.return_value = None
     
     response = client.delete(f"/api/teams/{PydanticObjectId()}")
     assert response.status_code == 404
@@ -114,11 +116,10 @@ def test_add_member_to_team(mocker, sample_team_data):
     new_member_id = PydanticObjectId()
     new_member_name = "New Member"
     
-    mock_collection.find_one.side_effect = [
-        sample_team_data,
-        {**sample_team_data, "members": [*sample_team_data["members"], {"user_id": new_member_id, "name": new_member_name}]}
-    ]
-    mock_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_collection.find_one_and_update.return_value = {
+        **sample_team_data,
+        "members": [*sample_team_data["members"], {"user_id": new_member_id, "name": new_member_name}],
+    }
     
     response = client.post(f"/api/teams/{sample_team_data['_id']}/members", json={"user_id": str(new_member_id), "user_name": new_member_name})
     assert response.status_code == 200
@@ -129,12 +130,102 @@ def test_remove_member_from_team(mocker, sample_team_data):
     mock_collection = mocker.patch('services.team_service._teams_collection')
     member_to_remove_id = sample_team_data["members"][0]["user_id"]
     
-    mock_collection.find_one.side_effect = [
-        sample_team_data,
-        {**sample_team_data, "members": []}
-    ]
-    mock_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_collection.find_one_and_update.return_value = {**sample_team_data, "members": []}
     
     response = client.delete(f"/api/teams/{sample_team_data['_id']}/members/{member_to_remove_id}")
     assert response.status_code == 200
     assert len(response.json()["members"]) == 0
+
+def test_get_teams_paginates_with_cursor(mocker, sample_team_data):
+    mock_collection = mocker.patch('services.team_service._teams_collection')
+    mock_collection.find.return_value = [sample_team_data]
+    mock_collection.count_documents.return_value = 7
+    after = PydanticObjectId()
+    
+    response = client.get(
+        "/api/teams/",
+        params={"limit": 1, "after": str(after), "competition_id": sample_team_data["competition_id"], "include_total": "true"},
+    )
+    assert response.status_code == 200
+    assert response.headers["X-Next-Cursor"] == sample_team_data["_id"]
+    assert response.headers["X-Total-Count"] == "7"
+    query = mock_collection.find.call_args[0][0]
+    assert query["_id"] == {"$gt": after}
+    assert sample_team_data["competition_id"] in query["competition_id"]["$in"]
+    assert mock_collection.find.call_args[1]["limit"] == 1
+
+def test_get_teams_last_page_has_no_cursor(mocker, sample_team_data):
+    mock_collection = mocker.patch('services.team_service._teams_collection')
+    mock_collection.find.return_value = [sample_team_data]
+    
+    response = client.get("/api/teams/", params={"limit": 10})
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+    assert "X-Total-Count" not in response.headers
+    mock_collection.count_documents.assert_not_called()
+
+def test_get_teams_field_selection_keeps_required_fields(mocker, sample_team_data):
+    mock_collection = mocker.patch('services.team_service._teams_collection')
+    mock_collection.find.return_value = [sample_team_data]
+    
+    response = client.get("/api/teams/", params={"fields": "url"})
+    assert response.status_code == 200
+    projection = mock_collection.find.call_args[0][1]
+    assert projection["url"] == 1
+    assert projection["name"] == 1
+    assert "chat" not in projection
+    assert set(response.json()[0]) == {"_id", "url"}
+
+def test_get_team_trims_to_requested_fields(mocker, sample_team_data):
+    mock_collection = mocker.patch('services.team_service._teams_collection')
+    mock_collection.find_one.return_value = sample_team_data
+    
+    response = client.get(f"/api/teams/{sample_team_data['_id']}", params={"fields": "members.name"})
+    assert response.status_code == 200
+    assert response.json() == {"_id": sample_team_data["_id"], "members": [{"name": "Member One"}]}
+
+def test_delete_file_releases_quota_and_blob_once(mocker, sample_team_data):
+    mock_collection = mocker.patch('services.team_service._teams_collection')
+    release_storage = mocker.patch('api.teams.quota_service.release_team_storage')
+    release_blob = mocker.patch('api.teams.blob_service.release')
+    mock_collection.find_one_and_update.side_effect = [
+        {"_id": sample_team_data["_id"], "files": [{"_id": "f1", "size": 10, "sha256": "ab" * 32}]},
+        None,
+    ]
+
+    response = client.delete(f"/api/teams/{sample_team_data['_id']}/files/f1")
+    assert response.status_code == 200
+    release_storage.assert_called_once_with(PydanticObjectId(sample_team_data["_id"]), 10)
+    release_blob.assert_called_once_with("ab" * 32)
+
+    # A repeated delete finds nothing to pull and gives nothing back
+    response = client.delete(f"/api/teams/{sample_team_data['_id']}/files/f1")
+    assert response.status_code == 404
+    assert release_storage.call_count == 1 and release_blob.call_count == 1
+
+def test_upload_stores_the_blob_off_the_event_loop(mocker, monkeypatch, tmp_path, sample_team_data):
+    import asyncio
+    monkeypatch.chdir(tmp_path)
+    mocker.patch('services.team_service.team_exists', return_value=True)
+    mocker.patch('api.teams.quota_service.reserve_team_storage', return_value=True)
+    mocker.patch('services.team_service.add_file', return_value=MagicMock())
+    mocker.patch('api.teams.preview_service.after_upload', return_value=None)
+    in_event_loop = []
+
+    def commit(sha256, size, temp_path):
+        try:
+            asyncio.get_running_loop()
+            in_event_loop.append(True)
+        except RuntimeError:
+            in_event_loop.append(False)
+
+    mocker.patch('api.teams.blob_service.commit', side_effect=commit)
+
+    response = client.post(
+        f"/api/teams/{sample_team_data['_id']}/files",
+        files={"file": ("a.txt", b"hello")},
+        data={"user_id": str(PydanticObjectId()), "user_name": "Member One"},
+    )
+
+    assert response.status_code == 200
+    assert in_event_loop == [False]
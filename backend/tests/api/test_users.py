@@ -83,8 +83,7 @@ def test_get_user_not_found(mocker):
 
 def test_update_user(mocker, sample_user_data):
     mock_collection = mocker.patch('services.user_service._users_collection')
-    mock_collection.find_one.side_effect = [sample_user_data, {**sample_user_data, "name": "Updated Name"}]
-    mock_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_collection.find_one_and_update.return_value = {**sample_user_data, "name": "Updated Name"}
     
     response = client.put(f"/api/users/{sample_user_data['_id']}", json={"name": "Updated Name"})
     assert response.status_code == 200
@@ -92,21 +91,26 @@ def test_update_user(mocker, sample_user_data):
 
 def test_update_user_not_found(mocker):
     mock_collection = mocker.patch('services.user_service._users_collection')
-    mock_collection.find_one.return_value = None
+    mock_collection.find_one_and_update.return_value = None
     
     response = client.put(f"/api/users/{PydanticObjectId()}", json={"name": "Updated Name"})
     assert response.status_code == 404
     assert response.json()["detail"] == "User not found"
 
 def test_delete_user(mocker, sample_user_data):
+    mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
     mock_collection = mocker.patch('services.user_service._users_collection')
     mock_collection.delete_one.return_value = MagicMock(deleted_count=1)
     
     response = client.delete(f"/api/users/{sample_user_data['_id']}")
     assert response.status_code == 200
     assert response.json()["message"] == "User deleted successfully"
+    assert response.json()["deletion_id"]
 
 def test_delete_user_not_found(mocker):
+    mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
     mock_collection = mocker.patch('services.user_service._users_collection')
     mock_collection.delete_one.return_value = MagicMock(deleted_count=0)
     
@@ -0,0 +1,125 @@
+import io
+import zipfile
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+import archives
+from api.headteacher import verify_headteacher_token
+from main import app
+from models import User
+from storage import LocalStorage
+
+client = TestClient(app)
+
+
+class _Source(io.BytesIO):
+    def __init__(self, data, log):
+        super().__init__(data)
+        self.log = log
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.log.append(len(data))
+        return data
+
+
+def _entry(name, data, log=None):
+    return archives.ArchiveEntry(
+        name, len(data), datetime(2026, 5, 1, tzinfo=timezone.utc),
+        lambda: _Source(data, log if log is not None else []),
+    )
+
+
+def test_stream_zip_round_trips_and_stores_compressed_formats():
+    text = b"chapter one " * 1000
+    image = bytes(range(256)) * 40
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(archives.stream_zip([
+        _entry("Team A/notes.txt", text),
+        _entry("Team A/photo.JPG", image),
+    ]))))
+
+    assert archive.testzip() is None
+    assert archive.read("Team A/notes.txt") == text
+    assert archive.read("Team A/photo.JPG") == image
+    notes, photo = archive.infolist()
+    assert notes.compress_type == zipfile.ZIP_DEFLATED
+    assert notes.compress_size < notes.file_size
+    assert photo.compress_type == zipfile.ZIP_STORED
+    assert notes.date_time == (2026, 5, 1, 0, 0, 0)
+
+
+def test_stream_zip_yields_as_it_reads(mocker):
+    mocker.patch.object(archives, "READ_CHUNK_SIZE", 1024)
+    log = []
+    pieces = archives.stream_zip([_entry("big.bin", b"\x00\xff" * 8192, log)])
+
+    first = next(pieces)
+    # Output starts before the source is exhausted and stays chunk-sized
+    assert len(log) == 1
+    assert len(first) < 2048
+    assert max(len(piece) for piece in pieces) < 2048
+
+
+def test_missing_source_is_skipped():
+    def gone():
+        raise FileNotFoundError()
+
+    entries = [archives.ArchiveEntry("t/gone.txt", 3, None, gone), _entry("t/kept.txt", b"ok")]
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(archives.stream_zip(entries))))
+
+    assert archive.namelist() == ["t/kept.txt"]
+
+
+def test_unique_names_number_collisions_and_strip_paths():
+    used = {}
+
+    assert archives.unique_name("Team", "report.pdf", used) == "Team/report.pdf"
+    assert archives.unique_name("Team", "Report.pdf", used) == "Team/Report (2).pdf"
+    assert archives.unique_name("Team", "../../etc/report.pdf", used) == "Team/report (3).pdf"
+
+
+@pytest.fixture
+def headteacher():
+    user = User(name="Head", email="h@example.com", password="x", role="headteacher")
+    app.dependency_overrides[verify_headteacher_token] = lambda: user
+    yield user
+    app.dependency_overrides.clear()
+
+
+def test_team_archive_endpoint_streams_blob_and_legacy_files(mocker, tmp_path, headteacher):
+    store = LocalStorage(str(tmp_path))
+    sha256 = "ab" * 32
+    (tmp_path / "blobs" / "ab" / "ab").mkdir(parents=True)
+    (tmp_path / "blobs" / "ab" / "ab" / sha256).write_bytes(b"from the blob store")
+    team_id = ObjectId()
+    (tmp_path / str(team_id)).mkdir()
+    (tmp_path / str(team_id) / "old.txt").write_bytes(b"legacy upload")
+    mocker.patch("archives.get_storage", return_value=store)
+    mocker.patch.object(archives, "UPLOAD_DIR", str(tmp_path))
+    teams = MagicMock()
+    teams.find_one.return_value = {
+        "_id": team_id,
+        "name": "Robo/Team",
+        "files": [
+            {"_id": "f1", "filename": "slides.txt", "size": 19, "sha256": sha256,
+             "created_at": "2026-05-01T10:00:00+00:00"},
+            {"_id": "f2", "filename": "old.txt", "size": 13,
+             "url": f"/api/teams/{team_id}/files/old.txt"},
+            {"_id": "f3", "filename": "lost.txt", "size": 4, "url": "/student/files/f3"},
+        ],
+    }
+    mocker.patch("api.headteacher.db.get_collection", return_value=teams)
+
+    response = client.get(f"/api/headteacher/teams/{team_id}/files/archive")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    assert 'filename="Robo-Team.zip"' in response.headers["content-disposition"]
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    # The file whose content is gone is left out
+    assert archive.namelist() == ["Robo-Team/slides.txt", "Robo-Team/old.txt"]
+    assert archive.read("Robo-Team/slides.txt") == b"from the blob store"
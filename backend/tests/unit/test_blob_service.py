@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import os
+import pytest
+from unittest.mock import MagicMock
+from pymongo.errors import DuplicateKeyError
+from services import blob_service
+from storage import LocalStorage
+
+
+@pytest.fixture
+def blobs(mocker):
+    mocker.patch.object(blob_service, "_DELETING_RETRY_SECONDS", 0)
+    return mocker.patch('services.blob_service._blobs_collection')
+
+
+def test_write_chunks_hashes_while_streaming(tmp_path):
+    sha256, size, temp_path = blob_service.write_chunks([b"hello ", b"world"], str(tmp_path))
+
+    assert sha256 == hashlib.sha256(b"hello world").hexdigest()
+    assert size == 11
+    with open(temp_path, "rb") as f:
+        assert f.read() == b"hello world"
+
+
+def test_write_upload_reads_in_chunks(mocker, tmp_path):
+    mocker.patch.object(blob_service, "CHUNK_SIZE", 4)
+    upload = MagicMock()
+    data = [b"abcd", b"efgh", b"ij", b""]
+
+    async def read(n):
+        assert n == 4
+        return data.pop(0)
+
+    upload.read = read
+    sha256, size, _ = asyncio.run(blob_service.write_upload(upload, str(tmp_path)))
+
+    assert sha256 == hashlib.sha256(b"abcdefghij").hexdigest()
+    assert size == 10
+
+
+def test_identical_content_is_stored_once(blobs, tmp_path):
+    store = LocalStorage(str(tmp_path))
+    temp_dir = str(tmp_path / "tmp")
+    first = blob_service.write_chunks([b"same bytes"], temp_dir)
+    second = blob_service.write_chunks([b"same bytes"], temp_dir)
+
+    assert blob_service.commit(*first, store=store)
+    assert not blob_service.commit(*second, store=store)
+
+    assert blobs.update_one.call_count == 2
+    assert not os.path.exists(second[2])
+    assert os.listdir(temp_dir) == []
+    sha256 = first[0]
+    path = store.path(blob_service.blob_key(sha256))
+    assert path == os.path.join(str(tmp_path), "blobs", sha256[:2], sha256[2:4], sha256)
+    with open(path, "rb") as f:
+        assert f.read() == b"same bytes"
+
+
+def test_add_reference_upserts_and_clears_unreferenced(blobs):
+    blob_service.add_reference("ab" * 32, 42)
+
+    query, update = blobs.update_one.call_args[0]
+    assert query == {"_id": "ab" * 32, "deleting": {"$ne": True}}
+    assert update["$inc"] == {"refcount": 1}
+    assert update["$setOnInsert"]["size"] == 42
+    assert update["$unset"] == {"unreferenced_at": ""}
+    assert blobs.update_one.call_args[1] == {"upsert": True}
+
+
+def test_add_reference_waits_for_garbage_collection(blobs):
+    blobs.update_one.side_effect = [DuplicateKeyError("locked"), MagicMock()]
+
+    blob_service.add_reference("cd" * 32, 1)
+
+    assert blobs.update_one.call_count == 2
+
+
+def test_failed_reference_discards_upload(blobs, tmp_path):
+    blobs.update_one.side_effect = RuntimeError("mongo down")
+    sha256, size, temp_path = blob_service.write_chunks([b"data"], str(tmp_path))
+
+    store = LocalStorage(str(tmp_path))
+
+    with pytest.raises(RuntimeError):
+        blob_service.commit(sha256, size, temp_path, store)
+    assert not os.path.exists(temp_path)
+    assert not store.exists(blob_service.blob_key(sha256))
+
+
+def test_failed_placement_gives_the_reference_back(blobs, tmp_path):
+    store = MagicMock()
+    store.exists.return_value = False
+    store.put_file.side_effect = OSError("bucket unreachable")
+    blobs.find_one_and_update.return_value = {"refcount": 0}
+    sha256, size, temp_path = blob_service.write_chunks([b"data"], str(tmp_path))
+
+    with pytest.raises(OSError):
+        blob_service.commit(sha256, size, temp_path, store)
+    assert not os.path.exists(temp_path)
+    assert blobs.find_one_and_update.call_args[0][1] == {"$inc": {"refcount": -1}}
+
+
+def test_release_marks_last_reference_unreferenced(blobs):
+    blobs.find_one_and_update.return_value = {"_id": "ef" * 32, "refcount": 0}
+
+    blob_service.release("ef" * 32)
+
+    query, update = blobs.find_one_and_update.call_args[0]
+    assert query == {"_id": "ef" * 32, "refcount": {"$gt": 0}}
+    assert update == {"$inc": {"refcount": -1}}
+    assert "unreferenced_at" in blobs.update_one.call_args[0][1]["$set"]
+
+
+def test_release_keeps_shared_blob(blobs):
+    blobs.find_one_and_update.return_value = {"_id": "ef" * 32, "refcount": 2}
+
+    blob_service.release("ef" * 32)
+
+    blobs.update_one.assert_not_called()
+
+
+def test_release_ignores_legacy_files(blobs):
+    blob_service.release(None)
+
+    blobs.find_one_and_update.assert_not_called()
@@ -0,0 +1,69 @@
+from unittest.mock import MagicMock
+
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_values_are_reused_until_they_expire():
+    clock = Clock()
+    cache = TTLCache(maxsize=10, ttl=30, clock=clock)
+    load = MagicMock(side_effect=["first", "second"])
+
+    assert cache.get_or_load("k", load) == "first"
+    clock.now = 29
+    assert cache.get_or_load("k", load) == "first"
+    clock.now = 31
+    assert cache.get_or_load("k", load) == "second"
+    assert load.call_count == 2
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=30, clock=Clock())
+    cache.get_or_load("a", lambda: 1)
+    cache.get_or_load("b", lambda: 2)
+    cache.get_or_load("a", lambda: "reloaded")
+    cache.get_or_load("c", lambda: 3)
+
+    assert len(cache) == 2
+    assert cache.get_or_load("a", lambda: "reloaded") == 1
+    assert cache.get_or_load("b", lambda: "reloaded") == "reloaded"
+
+
+def test_invalidation_during_a_load_keeps_the_stale_value_out():
+    cache = TTLCache(maxsize=10, ttl=30, clock=Clock())
+
+    def load():
+        # A write lands while the read is in flight
+        cache.invalidate("k")
+        return "stale"
+
+    assert cache.get_or_load("k", load) == "stale"
+    assert cache.get_or_load("k", lambda: "fresh") == "fresh"
+
+
+def test_invalidate_where_drops_matching_entries():
+    cache = TTLCache(maxsize=10, ttl=30, clock=Clock())
+    cache.get_or_load("a", lambda: [1, 2])
+    cache.get_or_load("b", lambda: [3])
+
+    cache.invalidate_where(lambda key, value: 2 in value)
+
+    assert cache.get_or_load("a", lambda: "reloaded") == "reloaded"
+    assert cache.get_or_load("b", lambda: "reloaded") == [3]
+
+
+def test_zero_ttl_disables_caching():
+    cache = TTLCache(maxsize=10, ttl=0)
+    load = MagicMock(return_value="v")
+
+    cache.get_or_load("k", load)
+    cache.get_or_load("k", load)
+
+    assert load.call_count == 2 and len(cache) == 0
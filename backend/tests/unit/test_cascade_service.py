@@ -0,0 +1,284 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+
+from services import cascade_service, job_service
+
+USER_ID = str(ObjectId())
+JOB_ID = ObjectId()
+
+
+@pytest.fixture
+def collections(mocker):
+    names = ("deletions", "competitions", "teams", "join_requests", "tokens", "users", "schools")
+    mocks = {name: mocker.patch(f'services.cascade_service._{name}_collection') for name in names}
+    mocks["deletions"].update_one.return_value = MagicMock(modified_count=1)
+    mocker.patch.dict(
+        cascade_service._roots,
+        {"school": mocks["schools"], "competition": mocks["competitions"], "user": mocks["users"]},
+    )
+    for root in (mocks["schools"], mocks["competitions"], mocks["users"]):
+        root.count_documents.return_value = 0
+    return mocks
+
+
+@pytest.fixture
+def jobs(mocker):
+    jobs = mocker.patch('services.cascade_service.job_service')
+    jobs.enqueue.side_effect = lambda job_type, payload, delay: {"_id": JOB_ID, "type": job_type, "payload": payload}
+    jobs.stopping.return_value = False
+    jobs.Interrupted = job_service.Interrupted
+    return jobs
+
+
+@pytest.fixture
+def released(mocker):
+    blobs = mocker.patch('services.cascade_service.blob_service.release')
+    team_storage = mocker.patch('services.cascade_service.quota_service.release_team_storage')
+    school_storage = mocker.patch('services.cascade_service.quota_service.release_school_storage')
+    return blobs, team_storage, school_storage
+
+
+def _found(collection, *batches):
+    """Successive find(...).limit(...) results, then nothing."""
+    collection.find.return_value.limit.side_effect = [list(batch) for batch in batches] + [[]] * 5
+
+
+def _deletion(kind, target_id=USER_ID, step=0, **context):
+    return {"_id": ObjectId(), "kind": kind, "target_id": target_id, "step": step, "job_id": JOB_ID, **context}
+
+
+def test_start_queues_the_cascade_before_deleting(collections, jobs):
+    order = []
+    jobs.enqueue.side_effect = lambda *args, **kwargs: order.append("queued") or {"_id": JOB_ID}
+    jobs.run_now.side_effect = lambda job_id: order.append("released")
+
+    deletion = cascade_service.start("user", USER_ID, lambda: order.append("deleted") or 1, "admin")
+
+    assert order == ["queued", "deleted", "released"]
+    job_type, payload = jobs.enqueue.call_args[0]
+    assert job_type == cascade_service.CASCADE_JOB
+    assert payload == {"deletion_id": str(deletion["_id"])}
+    # Held back until the record is gone
+    assert jobs.enqueue.call_args[1]["delay"] == cascade_service.HOLD
+    jobs.run_now.assert_called_once_with(JOB_ID)
+    assert deletion["job_id"] == JOB_ID and deletion["requested_by"] == "admin"
+
+
+def test_start_drops_the_cascade_when_nothing_was_deleted(collections, jobs):
+    assert cascade_service.start("user", USER_ID, lambda: 0) is None
+    queued = collections["deletions"].insert_one.call_args[0][0]
+    collections["deletions"].delete_one.assert_called_once_with({"_id": queued["_id"]})
+    jobs.cancel.assert_called_once_with(JOB_ID)
+    jobs.run_now.assert_not_called()
+
+
+def test_start_drops_the_cascade_when_the_delete_fails(collections, jobs):
+    def fail():
+        raise RuntimeError("down")
+
+    with pytest.raises(RuntimeError):
+        cascade_service.start("user", USER_ID, fail)
+    collections["deletions"].delete_one.assert_called_once()
+    jobs.cancel.assert_called_once_with(JOB_ID)
+
+
+def test_run_goes_through_steps_in_order(collections, jobs, mocker):
+    calls = []
+    batches = {"first": [{"a": 1}, {"a": 2}], "second": [{"b": 1}]}
+
+    def step(name):
+        return lambda deletion, limit: calls.append(name) or (batches[name].pop(0) if batches[name] else None)
+
+    mocker.patch.dict(cascade_service.STEPS, {"user": [step("first"), step("second")]})
+
+    cascade_service.run(_deletion("user"))
+
+    assert calls == ["first", "first", "first", "second", "second"]
+    updates = [c[0][1] for c in collections["deletions"].update_one.call_args_list]
+    assert updates[0]["$set"]["status"] == "running"
+    assert [update["$set"].get("step") for update in updates[1:-1]] == [0, 0, 1, 1, 2]
+    assert updates[1]["$inc"] == {"progress.a": 1}
+    assert updates[-1]["$set"]["status"] == "done"
+
+
+def test_run_resumes_at_the_recorded_step(collections, jobs, mocker):
+    first, second = MagicMock(return_value=None), MagicMock(return_value=None)
+    mocker.patch.dict(cascade_service.STEPS, {"user": [first, second]})
+
+    cascade_service.run(_deletion("user", step=1))
+
+    first.assert_not_called()
+    second.assert_called_once()
+
+
+def test_run_hands_the_job_back_when_the_worker_stops(collections, jobs, mocker):
+    step = MagicMock(return_value={"teams": 1})
+    mocker.patch.dict(cascade_service.STEPS, {"user": [step]})
+    jobs.stopping.return_value = True
+
+    with pytest.raises(job_service.Interrupted):
+        cascade_service.run(_deletion("user"))
+
+    step.assert_called_once()
+    assert collections["deletions"].update_one.call_args[0][1]["$inc"] == {"progress.teams": 1}
+
+
+def test_job_runs_the_recorded_deletion(collections, jobs, mocker):
+    deletion = {**_deletion("user"), "status": "pending"}
+    collections["deletions"].find_one.return_value = deletion
+    run = mocker.patch.object(cascade_service, "run")
+
+    cascade_service._cascade_job({"deletion_id": str(deletion["_id"])})
+
+    run.assert_called_once_with(deletion)
+
+
+def test_job_drops_a_cascade_whose_record_was_never_deleted(collections, jobs, mocker):
+    deletion = {**_deletion("user"), "status": "pending"}
+    collections["deletions"].find_one.return_value = deletion
+    collections["users"].count_documents.return_value = 1
+    run = mocker.patch.object(cascade_service, "run")
+
+    cascade_service._cascade_job({"deletion_id": str(deletion["_id"])})
+
+    run.assert_not_called()
+    collections["deletions"].delete_one.assert_called_once_with({"_id": deletion["_id"]})
+
+
+def test_competition_teams_release_files_and_storage(collections, released):
+    blobs, _, school_storage = released
+    team_id = ObjectId()
+    _found(collections["teams"], [
+        {"_id": team_id, "storage_used": 30, "files": [{"sha256": "aa"}, {}], "chat": [{}, {}, {}]}
+    ])
+    collections["join_requests"].delete_many.return_value = MagicMock(deleted_count=2)
+    deletion = _deletion("competition", str(ObjectId()), school_id="s1")
+
+    removed = cascade_service._competition_teams(deletion, 10)
+
+    assert removed == {"teams": 1, "files": 2, "messages": 3, "join_requests": 2}
+    collections["teams"].delete_many.assert_called_once_with({"_id": {"$in": [team_id]}})
+    assert [c[0][0] for c in blobs.call_args_list] == ["aa", None]
+    school_storage.assert_called_once_with("s1", 30)
+    assert cascade_service._competition_teams(deletion, 10) is None
+
+
+def test_school_competitions_go_after_their_teams(collections, released):
+    competition_id = ObjectId()
+    _found(collections["competitions"], [{"_id": competition_id}], [{"_id": competition_id}])
+    _found(collections["teams"], [{"_id": ObjectId()}])
+    deletion = _deletion("school", str(ObjectId()))
+
+    assert cascade_service._school_competitions(deletion, 10)["teams"] == 1
+    collections["competitions"].delete_many.assert_not_called()
+    assert cascade_service._school_competitions(deletion, 10) == {"competitions": 1}
+    collections["competitions"].delete_many.assert_called_once_with({"_id": {"$in": [competition_id]}})
+
+
+def test_school_tokens_and_headteacher(collections):
+    _found(collections["tokens"], [{"_id": 1}, {"_id": 2}])
+    collections["users"].delete_one.return_value = MagicMock(deleted_count=1)
+    deletion = _deletion("school", str(ObjectId()), headteacher_id=USER_ID)
+
+    assert cascade_service._school_tokens(deletion, 10) == {"tokens": 2}
+    assert cascade_service._school_tokens(deletion, 10) is None
+    assert cascade_service._school_headteacher(deletion, 10) == {"users": 1}
+    collections["users"].delete_one.return_value = MagicMock(deleted_count=0)
+    assert cascade_service._school_headteacher(deletion, 10) is None
+
+
+def test_user_memberships_are_removed(collections):
+    team_id = ObjectId()
+    _found(collections["teams"], [{"_id": team_id}])
+
+    assert cascade_service._user_memberships(_deletion("user"), 10) == {"memberships": 1}
+    query, update = collections["teams"].update_many.call_args[0]
+    assert query == {"_id": {"$in": [team_id]}}
+    assert cascade_service._user_memberships(_deletion("user"), 10) is None
+
+
+def test_user_messages_are_removed(collections):
+    _found(collections["teams"], [
+        {"_id": ObjectId(), "chat": [{"user_id": USER_ID}, {"user_id": "other"}, {"user_id": ObjectId(USER_ID)}]}
+    ])
+
+    assert cascade_service._user_messages(_deletion("user"), 10) == {"messages": 2}
+    update = collections["teams"].update_many.call_args[0][1]
+    assert update["$pull"] == {"chat": {"user_id": {"$in": [USER_ID, ObjectId(USER_ID)]}}}
+
+
+def test_user_messages_can_be_kept_anonymized(collections):
+    _found(collections["teams"], [{"_id": ObjectId(), "chat": [{"user_id": USER_ID}, {"user_id": "other"}]}])
+
+    removed = cascade_service._user_messages(_deletion("user", anonymize_messages=True), 10)
+
+    assert removed == {"messages_anonymized": 1}
+    args, kwargs = collections["teams"].update_many.call_args
+    assert args[1]["$set"]["chat.$[mine].user_name"] == cascade_service.DELETED_USER_NAME
+    assert args[1]["$set"]["chat.$[mine].user_id"] == cascade_service.DELETED_USER_ID
+    assert kwargs["array_filters"] == [{"mine.user_id": {"$in": [USER_ID, ObjectId(USER_ID)]}}]
+
+
+def test_user_files_give_back_quota_and_blobs(collections, released):
+    blobs, team_storage, _ = released
+    team_id = ObjectId()
+    _found(collections["teams"], [{"_id": team_id}])
+    collections["teams"].find_one_and_update.return_value = {
+        "_id": team_id,
+        "files": [
+            {"user_id": USER_ID, "size": 10, "sha256": "aa"},
+            {"user_id": "other", "size": 99, "sha256": "bb"},
+            {"user_id": USER_ID, "size": 5},
+        ],
+    }
+
+    assert cascade_service._user_files(_deletion("user"), 10) == {"files": 2}
+    team_storage.assert_called_once_with(team_id, 15)
+    assert [c[0][0] for c in blobs.call_args_list] == ["aa", None]
+
+
+def test_user_files_removed_meanwhile_release_nothing(collections, released):
+    blobs, team_storage, _ = released
+    _found(collections["teams"], [{"_id": ObjectId()}])
+    collections["teams"].find_one_and_update.return_value = None
+
+    assert cascade_service._user_files(_deletion("user"), 10) == {"files": 0}
+    team_storage.assert_not_called()
+    blobs.assert_not_called()
+
+
+def test_user_join_requests_and_tokens(collections):
+    _found(collections["join_requests"], [{"_id": 1}])
+    _found(collections["tokens"], [{"_id": 2}, {"_id": 3}])
+
+    assert cascade_service._user_join_requests(_deletion("user"), 10) == {"join_requests": 1}
+    assert cascade_service._user_tokens(_deletion("user"), 10) == {"tokens": 2}
+    assert collections["tokens"].find.call_args[0][0] == {"used_by": {"$in": [USER_ID, ObjectId(USER_ID)]}}
+
+
+def test_user_approvals_are_withdrawn(collections):
+    _found(collections["join_requests"], [{"_id": 1}, {"_id": 2}])
+    forms = {"$in": [USER_ID, ObjectId(USER_ID)]}
+
+    assert cascade_service._user_approvals(_deletion("user"), 10) == {"approvals": 2}
+    assert collections["join_requests"].update_many.call_args[0] == (
+        {"_id": {"$in": [1, 2]}}, {"$pull": {"approvals": forms}}
+    )
+    assert cascade_service._user_approvals(_deletion("user"), 10) is None
+
+
+def test_public_view_reports_the_job_state(jobs):
+    deletion = {**_deletion("user"), "status": "running", "created_at": datetime.now(timezone.utc)}
+    jobs.get.return_value = {"status": "pending", "attempts": 2, "error": "boom"}
+
+    view = cascade_service.public(deletion)
+
+    jobs.get.assert_called_once_with(JOB_ID)
+    assert (view["status"], view["attempts"], view["error"]) == ("pending", 2, "boom")
+    assert "job_id" not in view
+
+    view = cascade_service.public({**deletion, "status": "done"})
+    assert view["status"] == "done" and view["error"] is None
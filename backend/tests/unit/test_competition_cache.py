@@ -0,0 +1,82 @@
+import pytest
+from bson import ObjectId
+
+from services import competition_cache, competition_service
+
+SCHOOL_ID = str(ObjectId())
+OWN = {"_id": ObjectId(), "name": "Own", "school_id": SCHOOL_ID, "is_global": False}
+SHARED = {"_id": ObjectId(), "name": "Shared", "school_id": SCHOOL_ID, "is_global": True}
+OTHER = {"_id": ObjectId(), "name": "Other", "school_id": str(ObjectId()), "is_global": True}
+
+
+@pytest.fixture
+def competitions(mocker):
+    competition_cache.clear()
+    collection = mocker.patch('services.competition_cache._competitions_collection')
+
+    def find(query, sort):
+        if "is_global" in query:
+            return iter([SHARED, OTHER])
+        school_id = query["school_id"]["$in"][0]
+        return iter(c for c in (OWN, SHARED, OTHER) if c["school_id"] == school_id)
+
+    collection.find.side_effect = find
+    yield collection
+    competition_cache.clear()
+
+
+def test_school_listing_is_loaded_once(competitions):
+    first = competition_cache.school_competitions(SCHOOL_ID)
+    second = competition_cache.school_competitions(SCHOOL_ID)
+
+    assert [c["name"] for c in second] == ["Own", "Shared"]
+    assert competitions.find.call_count == 1
+    assert competitions.find.call_args[0][0] == {"school_id": {"$in": [SCHOOL_ID, ObjectId(SCHOOL_ID)]}}
+    assert first[0] is not second[0]
+
+
+def test_callers_cannot_change_the_cached_listing(competitions):
+    competition_cache.school_competitions(SCHOOL_ID)[0].pop("_id")
+
+    assert "_id" in competition_cache.school_competitions(SCHOOL_ID)[0]
+
+
+def test_visible_competitions_merge_school_and_global(competitions):
+    visible = competition_cache.visible_competitions(SCHOOL_ID)
+
+    assert [c["name"] for c in visible] == ["Own", "Shared", "Other"]
+
+
+def test_school_write_drops_the_school_and_global_entries(competitions):
+    competition_cache.visible_competitions(SCHOOL_ID)
+
+    competition_cache.invalidate(school_id=SCHOOL_ID)
+    competition_cache.visible_competitions(SCHOOL_ID)
+
+    assert competitions.find.call_count == 4
+
+
+def test_competition_write_drops_every_entry_holding_it(competitions):
+    other_school = OTHER["school_id"]
+    competition_cache.visible_competitions(SCHOOL_ID)
+    competition_cache.school_competitions(other_school)
+
+    competition_cache.invalidate(competition_id=OWN["_id"])
+    competition_cache.visible_competitions(SCHOOL_ID)
+    competition_cache.school_competitions(other_school)
+
+    # Only the first school's entry held it
+    assert competitions.find.call_count == 4
+
+
+def test_competition_service_writes_invalidate(mocker):
+    collection = mocker.patch('services.competition_service._competitions_collection')
+    invalidate = mocker.patch('services.competition_service.competition_cache.invalidate')
+    collection.find_one_and_update.return_value = None
+
+    competition_service.update_competition(OWN["_id"], {"name": "x"})
+    invalidate.assert_not_called()
+
+    collection.update_one.return_value.modified_count = 1
+    assert competition_service.reserve_team_slot(OWN["_id"])
+    invalidate.assert_called_once_with(competition_id=OWN["_id"])
@@ -45,7 +45,7 @@ def test_get_competition(mock_db_collection, sample_competition_data):
     
     assert competition.name == sample_competition_data["name"]
     assert str(competition.school_id) == str(sample_competition_data["school_id"])
-    mock_db_collection.find_one.assert_called_once_with({"_id": str(sample_competition_data["_id"])}) # Compare with string
+    mock_db_collection.find_one.assert_called_once_with({"_id": str(sample_competition_data["_id"])}, None) # Compare with string
 
 def test_get_competition_not_found(mock_db_collection):
     mock_db_collection.find_one.return_value = None
@@ -64,33 +64,93 @@ def test_get_competitions(mock_db_collection, sample_competition_data):
     mock_db_collection.find.assert_called_once()
 
 def test_update_competition(mock_db_collection, sample_competition_data):
-    mock_db_collection.find_one.return_value = {**sample_competition_data, "name": "Updated Competition"}
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_db_collection.find_one_and_update.return_value = {**sample_competition_data, "name": "Updated Competition"}
     
     updated_competition = competition_service.update_competition(str(sample_competition_data["_id"]), {"name": "Updated Competition"}) # Pass string
     
     assert updated_competition.name == "Updated Competition"
-    mock_db_collection.update_one.assert_called_once()
+    mock_db_collection.find_one_and_update.assert_called_once()
+    mock_db_collection.find_one.assert_not_called()
 
 def test_update_competition_not_found(mock_db_collection):
-    mock_db_collection.find_one.return_value = None
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=0)
+    mock_db_collection.find_one_and_update.return_value = None
     
     updated_competition = competition_service.update_competition(str(PydanticObjectId()), {"name": "Non Existent"}) # Pass string
     
     assert updated_competition is None
 
-def test_delete_competition(mock_db_collection, sample_competition_data):
+def test_delete_competition(mocker, mock_db_collection, sample_competition_data):
+    deletions = mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
+    mock_db_collection.find_one.return_value = {"_id": sample_competition_data["_id"], "school_id": "s1"}
     mock_db_collection.delete_one.return_value = MagicMock(deleted_count=1)
     
     result = competition_service.delete_competition(str(sample_competition_data["_id"])) # Pass string
     
     assert result["deleted_count"] == 1
     mock_db_collection.delete_one.assert_called_once_with({"_id": str(sample_competition_data["_id"])}) # Compare with string
+    # The cascade for the competition's teams is queued before the delete
+    queued = deletions.insert_one.call_args[0][0]
+    assert queued["kind"] == "competition" and queued["school_id"] == "s1"
+    assert result["deletion_id"] == str(queued["_id"])
+    deletions.delete_one.assert_not_called()
 
-def test_delete_competition_not_found(mock_db_collection):
-    mock_db_collection.delete_one.return_value = MagicMock(deleted_count=0)
+def test_delete_competition_not_found(mocker, mock_db_collection):
+    deletions = mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
+    mock_db_collection.find_one.return_value = None
     
     result = competition_service.delete_competition(str(PydanticObjectId())) # Pass string
     
     assert result["deleted_count"] == 0
+    deletions.insert_one.assert_not_called()
+
+def test_delete_competition_deleted_meanwhile_drops_the_cascade(mocker, mock_db_collection):
+    deletions = mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
+    mock_db_collection.find_one.return_value = {"_id": "c1", "school_id": "s1"}
+    mock_db_collection.delete_one.return_value = MagicMock(deleted_count=0)
+    
+    result = competition_service.delete_competition(str(PydanticObjectId()))
+    
+    assert result["deleted_count"] == 0
+    deletions.delete_one.assert_called_once_with({"_id": deletions.insert_one.call_args[0][0]["_id"]})
+
+def test_reserve_team_slot_guards_limit_in_the_update(mock_db_collection):
+    competition_id = ObjectId()
+    mock_db_collection.update_one.return_value = MagicMock(modified_count=1)
+
+    assert competition_service.reserve_team_slot(competition_id)
+
+    query, update = mock_db_collection.update_one.call_args[0]
+    assert query["$expr"] == {"$lt": ["$team_count", "$max_teams"]}
+    assert query["team_count"] == {"$exists": True}
+    # Bumps the stamps too, so ETags of the competition change with its count
+    assert update["$inc"] == {"team_count": 1, "version": 1}
+    assert "updated_at" in update["$set"]
+    mock_db_collection.find_one.assert_not_called()
+
+def test_reserve_team_slot_full_competition(mock_db_collection):
+    mock_db_collection.update_one.return_value = MagicMock(modified_count=0)
+    # The counter exists, so there is nothing to backfill
+    mock_db_collection.find_one.return_value = None
+
+    assert not competition_service.reserve_team_slot(ObjectId())
+    assert mock_db_collection.update_one.call_count == 1
+
+def test_reserve_team_slot_backfills_counter_once(mocker, mock_db_collection):
+    teams_collection = mocker.patch('services.competition_service._teams_collection')
+    teams_collection.count_documents.return_value = 3
+    competition_id = ObjectId()
+    mock_db_collection.find_one.return_value = {"_id": competition_id}
+    mock_db_collection.update_one.side_effect = [
+        MagicMock(modified_count=0),  # no team_count yet
+        MagicMock(modified_count=1),  # backfill
+        MagicMock(modified_count=1),  # guarded reservation
+    ]
+
+    assert competition_service.reserve_team_slot(competition_id)
+    teams_collection.count_documents.assert_called_once_with({"competition_id": str(competition_id)})
+    backfill_query, backfill_update = mock_db_collection.update_one.call_args_list[1][0]
+    assert backfill_query == {"_id": competition_id, "team_count": {"$exists": False}}
+    assert backfill_update["$set"]["team_count"] == 3
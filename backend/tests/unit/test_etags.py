@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from etags import compute_etag, etag_matches, touch, with_stamps
+from main import app
+from models import User
+from api.student import verify_student_token
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def student():
+    user = User(name="Student", email="s@example.com", password="x", role="student")
+    app.dependency_overrides[verify_student_token] = lambda: user
+    yield user
+    app.dependency_overrides.clear()
+
+
+def test_touch_bumps_version_and_keeps_update():
+    update = touch({"$push": {"chat": {"message": "hi"}}, "$set": {"url": "u"}})
+
+    assert update["$push"] == {"chat": {"message": "hi"}}
+    assert update["$set"]["url"] == "u"
+    assert isinstance(update["$set"]["updated_at"], datetime)
+    assert update["$inc"] == {"version": 1}
+
+
+def test_etag_depends_on_stamps_and_scope_not_order():
+    now = datetime.now(timezone.utc)
+    a = {"_id": ObjectId(), "updated_at": now, "version": 1}
+    b = {"_id": ObjectId(), "updated_at": now}
+
+    assert compute_etag([a, b]) == compute_etag([b, a])
+    assert compute_etag([a, b]) != compute_etag([a, {**b, "version": 1}])
+    assert compute_etag([a]) != compute_etag([a], "other-user")
+    # Documents whose _id was already renamed for the response still match
+    assert compute_etag([a]) == compute_etag([{**a, "id": str(a["_id"])}])
+
+
+def test_etag_matches_weak_comparison():
+    etag = 'W/"abc"'
+
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"x", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('W/"x"', etag)
+    assert not etag_matches(None, etag)
+
+
+def test_with_stamps_only_extends_inclusion_projections():
+    assert with_stamps(None) is None
+    assert with_stamps({"chat": 0}) == {"chat": 0}
+    assert with_stamps({"_id": 1, "name": 1}) == {
+        "_id": 1,
+        "name": 1,
+        "updated_at": 1,
+        "version": 1,
+    }
+
+
+def test_student_team_revalidates_with_304(mocker, student):
+    team_id = ObjectId()
+    updated_at = datetime.now(timezone.utc)
+    team = {
+        "_id": team_id,
+        "name": "Team",
+        "members": [{"user_id": str(student.id), "name": "Student"}],
+        "chat": [],
+        "files": [],
+        "updated_at": updated_at,
+        "version": 3,
+    }
+    teams_collection = MagicMock()
+    teams_collection.find_one.return_value = team
+    mocker.patch("api.student.db.get_collection", return_value=teams_collection)
+
+    first = client.get(f"/api/student/teams/{team_id}")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    teams_collection.find_one.reset_mock()
+    teams_collection.find_one.return_value = {
+        "_id": team_id,
+        "updated_at": updated_at,
+        "version": 3,
+    }
+    second = client.get(f"/api/student/teams/{team_id}", headers={"If-None-Match": etag})
+
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    # Revalidation only reads the stamp fields
+    assert teams_collection.find_one.call_args[0][1] == {"_id": 1, "updated_at": 1, "version": 1}
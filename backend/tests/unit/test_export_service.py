@@ -0,0 +1,103 @@
+import io
+import json
+import zipfile
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from archives import stream_zip
+from services import export_service
+
+USER_ID = ObjectId()
+TEAM_ID = ObjectId()
+USER = {"_id": USER_ID, "name": "Ada", "email": "ada@example.com", "password": "hash", "role": "student"}
+
+
+@pytest.fixture
+def collections(mocker):
+    teams = mocker.patch('services.export_service._teams_collection')
+    join_requests = mocker.patch('services.export_service._join_requests_collection')
+    teams.find.return_value = [{"_id": TEAM_ID, "name": "Robots", "competition_id": ObjectId()}]
+    join_requests.find.return_value = [{"_id": ObjectId(), "team_id": TEAM_ID, "user_id": USER_ID, "status": "PENDING"}]
+
+    def authored(pipeline, batchSize):
+        field = next(key for key in pipeline[1]["$project"] if key != "name")
+        entry = {"user_id": USER_ID, "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc)}
+        if field == "chat":
+            entry["message"] = "hi"
+        else:
+            entry.update(filename="notes.txt", url="/uploads/x", size=4)
+        return iter([{"_id": TEAM_ID, "name": "Robots", field: [entry]}])
+
+    teams.aggregate.side_effect = authored
+    return teams, join_requests
+
+
+def _lines(chunks):
+    return [json.loads(line) for line in b"".join(chunks).splitlines()]
+
+
+def test_export_streams_one_record_per_line(collections):
+    records = _lines(export_service.stream_ndjson(USER))
+
+    assert [record["type"] for record in records] == [
+        "user", "membership", "message", "join_request", "file"
+    ]
+    assert "password" not in records[0] and records[0]["email"] == "ada@example.com"
+    assert records[1]["team_id"] == str(TEAM_ID) and records[1]["team_name"] == "Robots"
+    assert records[2]["message"] == "hi"
+    assert records[4]["filename"] == "notes.txt"
+
+
+def test_export_queries_by_user_id_in_both_forms(collections):
+    teams, join_requests = collections
+
+    list(export_service.stream_ndjson(USER))
+
+    forms = {"$in": [str(USER_ID), USER_ID]}
+    assert teams.find.call_args[0][0] == {"members.user_id": forms}
+    assert join_requests.find.call_args[0][0] == {"user_id": forms}
+    matches = [c[0][0][0]["$match"] for c in teams.aggregate.call_args_list]
+    assert matches == [{"chat.user_id": forms}, {"files.user_id": forms}]
+
+
+def test_export_keeps_only_the_users_entries_of_each_team(collections):
+    teams, _ = collections
+
+    list(export_service.messages(USER_ID))
+
+    projected = teams.aggregate.call_args[0][0][1]["$project"]["chat"]["$filter"]
+    assert projected["input"] == "$chat"
+    assert projected["cond"] == {"$in": ["$$this.user_id", [str(USER_ID), USER_ID]]}
+
+
+def test_export_is_produced_lazily(collections):
+    teams, _ = collections
+
+    chunks = export_service.stream_ndjson(USER)
+    next(chunks)
+
+    teams.find.assert_not_called()
+    teams.aggregate.assert_not_called()
+
+
+def test_zip_export_holds_the_records_and_the_uploads(collections, mocker, tmp_path):
+    upload = tmp_path / "notes.txt"
+    upload.write_bytes(b"note")
+    mocker.patch('archives._source', return_value=lambda: open(upload, "rb"))
+
+    data = b"".join(stream_zip(export_service.zip_entries(USER)))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        assert archive.namelist() == ["data.ndjson", "Robots/notes.txt"]
+        assert _lines([archive.read("data.ndjson")])[0]["type"] == "user"
+        assert archive.read("Robots/notes.txt") == b"note"
+
+
+def test_iterator_reader_reads_across_chunks():
+    reader = export_service._IteratorReader([b"ab", b"cde", b"f"])
+
+    assert reader.read(4) == b"abcd"
+    assert reader.read() == b"ef"
+    assert reader.read(3) == b""
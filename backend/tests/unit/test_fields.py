@@ -0,0 +1,40 @@
+from fields import projection, subfields, trim, wants
+
+
+def test_trim_keeps_ids_and_nested_paths():
+    document = {
+        "id": "c1",
+        "name": "Hackathon",
+        "description": "long text",
+        "teams": [
+            {"id": "t1", "name": "A", "members": [{"user_id": "u1", "name": "Ann"}]},
+        ],
+    }
+
+    trimmed = trim(document, ["name", "teams.members.name"])
+
+    assert trimmed == {
+        "id": "c1",
+        "name": "Hackathon",
+        "teams": [{"id": "t1", "members": [{"name": "Ann"}]}],
+    }
+
+
+def test_trim_whole_field_wins_over_subpath():
+    document = {"_id": "t1", "members": [{"user_id": "u1", "name": "Ann"}]}
+
+    assert trim(document, ["members.name", "members"]) == document
+    assert trim(document, None) is document
+
+
+def test_wants_and_subfields():
+    assert wants(None, "teams")
+    assert wants(["teams.name"], "teams")
+    assert not wants(["name"], "teams")
+    assert subfields(["name", "teams.name"], "teams") == ["name"]
+    assert subfields(["teams"], "teams") is None
+
+
+def test_projection_uses_default_without_fields():
+    assert projection(None, default={"chat": 0}) == {"chat": 0}
+    assert projection(["url"], required=("members",)) == {"_id": 1, "members": 1, "url": 1}
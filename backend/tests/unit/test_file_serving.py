@@ -0,0 +1,79 @@
+import asyncio
+
+import file_serving
+from file_serving import DirectFileResponse, file_response
+
+
+def _run(response, extensions=None):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [],
+        "extensions": extensions or {},
+        # Servers on ASGI 2.4 report disconnects through send()
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    return sent
+
+
+def test_direct_mode_hands_the_path_to_pathsend_servers(tmp_path):
+    path = tmp_path / "blob"
+    path.write_bytes(b"x" * 10)
+
+    sent = _run(file_response(str(path), "a.pdf", root=str(tmp_path)), {"http.response.pathsend": {}})
+
+    assert sent[-1] == {"type": "http.response.pathsend", "path": str(path)}
+
+
+def test_direct_mode_reads_large_chunks_without_pathsend(tmp_path):
+    path = tmp_path / "blob"
+    path.write_bytes(b"x" * (file_serving.CHUNK_SIZE + 1))
+
+    sent = _run(file_response(str(path), "a.bin", root=str(tmp_path)))
+
+    bodies = [m for m in sent if m["type"] == "http.response.body"]
+    assert [len(m["body"]) for m in bodies[:2]] == [file_serving.CHUNK_SIZE, 1]
+
+
+def test_x_accel_redirect_returns_only_headers(tmp_path):
+    path = tmp_path / "blobs" / "ab" / "cd" / "abcd"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"x")
+
+    response = file_response(
+        str(path), "raport końcowy.pdf", "application/pdf", root=str(tmp_path), mode="x-accel-redirect"
+    )
+
+    assert response.headers["x-accel-redirect"] == "/protected-uploads/blobs/ab/cd/abcd"
+    assert response.headers["content-type"] == "application/pdf"
+    assert "filename*=UTF-8''raport%20ko%C5%84cowy.pdf" in response.headers["content-disposition"]
+    assert response.body == b""
+
+
+def test_x_sendfile_uses_the_absolute_path(tmp_path):
+    path = tmp_path / "f1_notes.txt"
+    path.write_bytes(b"x")
+
+    response = file_response(str(path), root=str(tmp_path), mode="x-sendfile")
+
+    assert response.headers["x-sendfile"] == str(path)
+
+
+def test_files_outside_the_upload_dir_are_never_offloaded(tmp_path):
+    (tmp_path / "uploads").mkdir()
+    outside = tmp_path / "secret.txt"
+    outside.write_bytes(b"x")
+
+    response = file_response(str(outside), root=str(tmp_path / "uploads"), mode="x-accel-redirect")
+
+    assert isinstance(response, DirectFileResponse)
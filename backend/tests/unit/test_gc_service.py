@@ -0,0 +1,284 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from services import blob_service, gc_service
+from storage import LocalStorage
+
+SHA = "ab" * 32
+OLD = datetime.now(timezone.utc) - timedelta(days=30)
+
+
+@pytest.fixture
+def collections(mocker):
+    blobs = mocker.patch('services.gc_service._blobs_collection')
+    teams = mocker.patch('services.gc_service._teams_collection')
+    sessions = mocker.patch('services.gc_service._sessions_collection')
+    state = mocker.patch('services.gc_service._state_collection')
+    state.find_one.return_value = None
+    blobs.find.return_value.sort.return_value.limit.return_value = []
+    teams.aggregate.return_value = []
+    teams.count_documents.return_value = 0
+    sessions.count_documents.return_value = 0
+    return blobs, teams, sessions, state
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return tmp_path / "uploads"
+
+
+def _write(path, data=b"data", age=timedelta(days=30)):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    mtime = time.time() - age.total_seconds()
+    os.utime(path, (mtime, mtime))
+
+
+def _store_blob(uploads, sha, data=b"data"):
+    _write(uploads / blob_service.blob_key(sha), data)
+
+
+def _run(uploads, phase, dry_run=False):
+    run = gc_service._Run(dry_run, LocalStorage(str(uploads)), str(uploads), datetime.now(timezone.utc))
+    return run, getattr(run, phase)
+
+
+def test_expired_unreferenced_blob_is_locked_then_deleted(collections, uploads):
+    blobs, teams, _, _ = collections
+    _store_blob(uploads, SHA)
+    _write(uploads / f"{blob_service.blob_key(SHA)}.preview.jpg")
+    blobs.find.return_value.sort.return_value.limit.return_value = [
+        {"_id": SHA, "refcount": 0, "size": 4, "unreferenced_at": OLD}
+    ]
+    blobs.update_one.return_value.modified_count = 1
+    run, blobs_phase = _run(uploads, "blobs")
+
+    checkpoint, examined, finished = blobs_phase(None, 10)
+
+    assert (checkpoint, examined, finished) == (SHA, 1, True)
+    query, update = blobs.update_one.call_args[0]
+    assert query == {"_id": SHA, "refcount": {"$lte": 0}, "deleting": {"$ne": True}}
+    assert update["$set"]["deleting"] is True
+    blobs.delete_one.assert_called_once_with({"_id": SHA, "deleting": True})
+    assert not (uploads / blob_service.blob_key(SHA)).exists()
+    assert not (uploads / f"{blob_service.blob_key(SHA)}.preview.jpg").exists()
+    assert run.report["reclaimed_bytes"] == 4
+
+
+def test_recently_released_blob_is_kept(collections, uploads):
+    blobs, _, _, _ = collections
+    _store_blob(uploads, SHA)
+    blobs.find.return_value.sort.return_value.limit.return_value = [
+        {"_id": SHA, "refcount": 0, "size": 4, "unreferenced_at": datetime.now(timezone.utc)}
+    ]
+    run, blobs_phase = _run(uploads, "blobs")
+
+    blobs_phase(None, 10)
+
+    blobs.update_one.assert_not_called()
+    assert (uploads / blob_service.blob_key(SHA)).exists()
+
+
+def test_blob_uploaded_again_is_not_deleted(collections, uploads):
+    blobs, _, _, _ = collections
+    _store_blob(uploads, SHA)
+    blobs.find.return_value.sort.return_value.limit.return_value = [
+        {"_id": SHA, "refcount": 0, "size": 4, "unreferenced_at": OLD}
+    ]
+    blobs.update_one.return_value.modified_count = 0
+    run, blobs_phase = _run(uploads, "blobs")
+
+    blobs_phase(None, 10)
+
+    blobs.delete_one.assert_not_called()
+    assert (uploads / blob_service.blob_key(SHA)).exists()
+    assert run.report["reclaimed"] == 0
+
+
+def test_leaked_references_are_dropped_once_old(collections, uploads):
+    blobs, _, _, _ = collections
+    blobs.find.return_value.sort.return_value.limit.return_value = [
+        {"_id": SHA, "refcount": 2, "size": 4, "referenced_at": OLD},
+        {"_id": "cd" * 32, "refcount": 1, "size": 4, "referenced_at": datetime.now(timezone.utc)},
+    ]
+    run, blobs_phase = _run(uploads, "blobs")
+
+    blobs_phase(None, 10)
+
+    blobs.update_one.assert_called_once()
+    query, update = blobs.update_one.call_args[0]
+    assert query == {"_id": SHA, "refcount": 2}
+    assert update["$set"]["refcount"] == 0
+    assert run.report["references_fixed"] == 1
+
+
+def test_missing_references_are_restored(collections, uploads):
+    blobs, teams, _, _ = collections
+    teams.aggregate.return_value = [{"_id": None, "count": 3}]
+    blobs.find.return_value.sort.return_value.limit.return_value = [
+        {"_id": SHA, "refcount": 0, "size": 4, "unreferenced_at": OLD}
+    ]
+    run, blobs_phase = _run(uploads, "blobs")
+
+    blobs_phase(None, 10)
+
+    blobs.update_one.assert_called_once_with(
+        {"_id": SHA}, {"$max": {"refcount": 3}, "$unset": {"unreferenced_at": ""}}
+    )
+
+
+def test_dry_run_changes_nothing(collections, uploads):
+    blobs, _, _, _ = collections
+    _store_blob(uploads, SHA)
+    blobs.find.return_value.sort.return_value.limit.return_value = [
+        {"_id": SHA, "refcount": 0, "size": 4, "unreferenced_at": OLD}
+    ]
+    run, blobs_phase = _run(uploads, "blobs", dry_run=True)
+
+    blobs_phase(None, 10)
+
+    blobs.update_one.assert_not_called()
+    assert (uploads / blob_service.blob_key(SHA)).exists()
+    assert run.report["items"] == [blob_service.blob_key(SHA)]
+
+
+def test_stored_content_without_entry_is_deleted_under_lock(collections, uploads):
+    blobs, _, _, _ = collections
+    known = "cd" * 32
+    _store_blob(uploads, SHA)
+    _store_blob(uploads, known)
+    _write(uploads / "blobs" / "tmp" / "upload-1")
+    blobs.find.return_value = [{"_id": known}]
+    run, objects = _run(uploads, "objects")
+
+    checkpoint, examined, finished = objects(None, 10)
+
+    assert finished and examined == 3
+    inserted = blobs.insert_one.call_args[0][0]
+    assert inserted["_id"] == SHA and inserted["deleting"] is True
+    assert not (uploads / blob_service.blob_key(SHA)).exists()
+    assert (uploads / blob_service.blob_key(known)).exists()
+
+
+def test_content_uploaded_meanwhile_is_kept(collections, uploads):
+    blobs, _, _, _ = collections
+    _store_blob(uploads, SHA)
+    blobs.find.return_value = []
+    blobs.insert_one.side_effect = DuplicateKeyError("uploaded")
+    run, objects = _run(uploads, "objects")
+
+    objects(None, 10)
+
+    assert (uploads / blob_service.blob_key(SHA)).exists()
+
+
+def test_legacy_uploads_without_records_are_deleted(collections, uploads):
+    _, teams, _, _ = collections
+    team_id = str(ObjectId())
+    _write(uploads / "f1_report.pdf")
+    _write(uploads / "f2_kept.pdf")
+    _write(uploads / "f3_new.pdf", age=timedelta(minutes=1))
+    _write(uploads / team_id / "a.png")
+    _write(uploads / "static" / "logo.png")
+    # Only the legacy record of f2 still exists
+    teams.count_documents.side_effect = lambda query, limit: int("'f2'" in str(query))
+    run, legacy = _run(uploads, "legacy")
+
+    legacy(None, 10)
+
+    assert sorted(run.report["items"]) == [f"{team_id}/a.png", "f1_report.pdf"]
+    assert not (uploads / "f1_report.pdf").exists()
+    assert (uploads / "f2_kept.pdf").exists()
+    assert (uploads / "f3_new.pdf").exists()
+    assert (uploads / "static" / "logo.png").exists()
+
+
+def test_abandoned_temp_files_are_deleted(collections, uploads):
+    _, _, sessions, _ = collections
+    open_session = ObjectId()
+    temp = uploads / "blobs" / "tmp"
+    _write(temp / "0123abcd")
+    _write(temp / f"upload-{open_session}")
+    _write(temp / f"upload-{ObjectId()}")
+    _write(temp / "fresh", age=timedelta(0))
+    sessions.count_documents.side_effect = lambda query, limit: int(query["_id"] == open_session)
+    run, temp_phase = _run(uploads, "temp")
+
+    temp_phase(None, 10)
+
+    assert run.report["reclaimed"] == 2
+    assert sorted(path.name for path in temp.iterdir()) == ["fresh", f"upload-{open_session}"]
+
+
+def test_collect_resumes_from_checkpoint_and_saves_progress(collections, mocker, uploads):
+    blobs, _, _, state = collections
+    state.find_one.return_value = {"phase": "blobs", "after": "aa" * 32}
+    blobs.find.return_value.sort.return_value.limit.return_value = [
+        {"_id": SHA, "refcount": 1, "size": 4}
+    ]
+    mocker.patch.object(gc_service, "reference_count", return_value=1)
+
+    report = gc_service.collect(
+        limit=1, rate=0, batch_size=1, store=LocalStorage(str(uploads)), upload_dir=str(uploads)
+    )
+
+    assert blobs.find.call_args[0][0] == {"_id": {"$gt": "aa" * 32}}
+    assert report["phase"] == "blobs" and report["checkpoint"] == SHA
+    query, update = state.update_one.call_args[0]
+    assert query == {"_id": "storage"}
+    assert update["$set"]["after"] == SHA
+
+
+def test_collect_finishes_a_cycle_and_starts_over(collections, uploads):
+    _, _, _, state = collections
+    state.find_one.return_value = {"phase": "legacy", "after": None}
+
+    report = gc_service.collect(
+        limit=100, dry_run=True, rate=0, store=LocalStorage(str(uploads)), upload_dir=str(uploads)
+    )
+
+    assert report["cycle_complete"] is True
+    assert report["phase"] == "blobs" and report["checkpoint"] is None
+    query, update = state.update_one.call_args[0]
+    assert query == {"_id": "storage:dry-run"}
+    assert "completed_at" in update["$set"]
+
+
+def test_collect_stops_between_batches_when_asked(collections, uploads):
+    _, _, _, state = collections
+    stops = iter([False, True])
+
+    report = gc_service.collect(
+        limit=100,
+        rate=0,
+        batch_size=1,
+        store=LocalStorage(str(uploads)),
+        upload_dir=str(uploads),
+        should_stop=lambda: next(stops),
+    )
+
+    # One batch, then the worker shutting down ends the run
+    assert state.update_one.call_count == 1
+    assert report["cycle_complete"] is False
+
+
+def test_runs_are_single_concurrency_jobs(mocker):
+    enqueue = mocker.patch.object(gc_service.job_service, "enqueue")
+
+    gc_service.start_collection(limit=50, dry_run=True)
+
+    enqueue.assert_called_once_with(gc_service.GC_JOB, {"limit": 50, "dry_run": True})
+    assert gc_service.job_service.JOB_TYPES[gc_service.GC_JOB].concurrency == 1
+
+
+def test_reference_count_counts_records_not_teams(collections):
+    _, teams, _, _ = collections
+    teams.aggregate.return_value = iter([{"_id": None, "count": 2}])
+
+    assert gc_service.reference_count(SHA) == 2
+    assert teams.aggregate.call_args[0][0][0] == {"$match": {"files.sha256": SHA}}
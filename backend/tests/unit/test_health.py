@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+import health
+
+client = TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fresh_probe():
+    health.readiness_probe.invalidate()
+    yield
+    health.readiness_probe.invalidate()
+
+
+def test_liveness_does_not_touch_mongo(mocker):
+    check_mongo = mocker.patch("health.check_mongo")
+
+    response = client.get("/health/live")
+
+    assert response.status_code == 200
+    assert response.json()["status"] == "ok"
+    check_mongo.assert_not_called()
+
+
+def test_readiness_ok(mocker):
+    mocker.patch("health.check_mongo", return_value={"ok": True, "latency_ms": 1.0})
+    mocker.patch("health.check_uploads", return_value={"ok": True})
+
+    response = client.get("/health/ready")
+
+    assert response.status_code == 200
+    assert response.json()["checks"]["mongo"]["ok"] is True
+
+
+def test_readiness_fails_when_mongo_down(mocker):
+    mocker.patch("health.check_mongo", return_value={"ok": False, "error": "timeout"})
+    mocker.patch("health.check_uploads", return_value={"ok": True})
+
+    response = client.get("/health/ready")
+
+    assert response.status_code == 503
+    assert response.json()["status"] == "fail"
+
+
+def test_readiness_result_is_cached(mocker):
+    check_mongo = mocker.patch(
+        "health.check_mongo", return_value={"ok": True, "latency_ms": 1.0}
+    )
+    mocker.patch("health.check_uploads", return_value={"ok": True})
+
+    client.get("/health/ready")
+    client.get("/health/ready")
+
+    check_mongo.assert_called_once()
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import defaultdict
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from services import invalidation_bus
+from services.invalidation_bus import RESET, InvalidationEvent
+
+TOKEN = {"_data": "8263"}
+
+
+@pytest.fixture
+def subscribers(mocker):
+    registry = defaultdict(list)
+    mocker.patch.object(invalidation_bus, "_subscribers", registry)
+    return registry
+
+
+@pytest.fixture
+def tokens(mocker):
+    collection = mocker.patch('services.invalidation_bus._tokens_collection')
+    collection.find_one.return_value = {"_id": "bus", "token": TOKEN}
+    return collection
+
+
+def _change(operation="update", collection="competitions", **fields):
+    return {
+        "_id": {"_data": "82"},
+        "operationType": operation,
+        "ns": {"coll": collection},
+        "documentKey": {"_id": ObjectId("65a000000000000000000001")},
+        **fields,
+    }
+
+
+def test_change_becomes_a_typed_event():
+    event = invalidation_bus.event_from_change(
+        _change(fields=["chat.3.message", "chat.3.user_id", "is_global"], school_id=ObjectId("65a000000000000000000002"))
+    )
+
+    assert event == InvalidationEvent(
+        collection="competitions",
+        operation="update",
+        document_id="65a000000000000000000001",
+        fields=("chat", "is_global"),
+        school_id="65a000000000000000000002",
+    )
+
+
+def test_events_reach_the_subscribers_of_their_collection(subscribers):
+    competitions, users = MagicMock(), MagicMock()
+    invalidation_bus.subscribe("competitions", competitions)
+    invalidation_bus.subscribe("users", users)
+    event = InvalidationEvent("competitions", "delete", "c1")
+
+    invalidation_bus.publish(event)
+
+    competitions.assert_called_once_with(event)
+    users.assert_not_called()
+
+
+def test_reset_reaches_every_subscriber_and_failures_are_contained(subscribers):
+    failing = MagicMock(side_effect=RuntimeError("boom"))
+    other = MagicMock()
+    invalidation_bus.subscribe("teams", failing)
+    invalidation_bus.subscribe("users", other)
+
+    invalidation_bus.publish(InvalidationEvent("*", RESET))
+
+    failing.assert_called_once()
+    other.assert_called_once()
+
+
+def test_unwatched_collections_are_rejected(subscribers):
+    with pytest.raises(ValueError):
+        invalidation_bus.subscribe("blobs", MagicMock())
+
+
+def _tail(bus, stream_or_error, mocker):
+    """Run the bus for a moment against a fake change stream."""
+    opened = []
+
+    def watch(pipeline, start_after, max_await_time_ms):
+        opened.append(start_after)
+        if isinstance(stream_or_error, list):
+            result = stream_or_error.pop(0)
+        else:
+            result = stream_or_error
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    mocker.patch('services.invalidation_bus.db.watch', side_effect=watch)
+
+    async def scenario():
+        task = asyncio.get_running_loop().create_task(bus._tail())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await bus._close()
+        return task
+
+    return opened, asyncio.run(scenario())
+
+
+def _stream(*changes):
+    pending = list(changes)
+
+    def try_next():
+        if pending:
+            return pending.pop(0)
+        # Like a real stream waiting for changes
+        time.sleep(0.001)
+        return None
+
+    stream = MagicMock()
+    stream.try_next.side_effect = try_next
+    stream.resume_token = {"_data": "8299"}
+    return stream
+
+
+def test_tail_resumes_from_the_saved_token_and_saves_the_new_one(subscribers, tokens, mocker):
+    received = MagicMock()
+    invalidation_bus.subscribe("competitions", received)
+    stream = _stream(_change(fields=["name"]))
+
+    opened, _ = _tail(invalidation_bus.InvalidationBus("bus"), stream, mocker)
+
+    assert opened == [TOKEN]
+    assert received.call_args[0][0].fields == ("name",)
+    query, update = tokens.update_one.call_args[0]
+    assert query == {"_id": "bus"} and update["$set"]["token"] == {"_data": "8299"}
+    stream.close.assert_called_once()
+
+
+def test_lost_history_resets_the_caches_and_starts_fresh(subscribers, tokens, mocker):
+    received = MagicMock()
+    invalidation_bus.subscribe("competitions", received)
+    lost = OperationFailure("history lost", code=286)
+
+    opened, _ = _tail(invalidation_bus.InvalidationBus("bus"), [lost, _stream()], mocker)
+
+    assert opened == [TOKEN, None]
+    assert received.call_args_list[0][0][0].operation == RESET
+
+
+def test_bus_stays_off_without_a_replica_set(tokens, mocker):
+    mocker.patch(
+        'services.invalidation_bus.db.watch',
+        side_effect=OperationFailure("not a replica set", code=40573),
+    )
+
+    async def scenario():
+        bus = invalidation_bus.InvalidationBus("bus")
+        bus.start()
+        await asyncio.wait_for(bus._task, timeout=1)
+        return bus
+
+    bus = asyncio.run(scenario())
+    assert bus._task.done() and bus._task.exception() is None
+
+
+def test_competition_changes_drop_cached_listings(mocker):
+    from services import competition_cache
+
+    invalidate = mocker.patch.object(competition_cache, "invalidate")
+    cache = mocker.patch.object(competition_cache, "_cache")
+
+    competition_cache._on_change(InvalidationEvent("competitions", "update", "c1", ("is_global",)))
+    invalidate.assert_called_once_with(None, "c1")
+    cache.invalidate.assert_called_once_with(competition_cache.GLOBAL)
+
+    competition_cache._on_change(InvalidationEvent("*", RESET))
+    cache.clear.assert_called_once()
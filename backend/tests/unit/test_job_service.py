@@ -0,0 +1,229 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from services import job_service
+
+
+@pytest.fixture
+def jobs(mocker):
+    collection = mocker.patch('services.job_service._jobs_collection')
+    collection.find_one_and_update.return_value = None
+    collection.update_one.return_value = MagicMock(modified_count=1)
+    return collection
+
+
+@pytest.fixture
+def job_types(mocker):
+    types = {}
+    mocker.patch.dict(job_service.JOB_TYPES, clear=True)
+
+    def register(name, handler=None, **options):
+        types[name] = handler or MagicMock(return_value={"ok": True})
+        job_service.register(name, types[name], **options)
+        return types[name]
+
+    return register
+
+
+def _job(job_type="test.job", attempts=1, **fields):
+    now = datetime.now(timezone.utc)
+    return {
+        "_id": ObjectId(),
+        "type": job_type,
+        "payload": {"n": 1},
+        "status": "running",
+        "attempts": attempts,
+        "run_after": now,
+        "created_at": now,
+        **fields,
+    }
+
+
+def test_enqueue_records_a_due_pending_job(jobs, job_types):
+    job_types("test.job")
+
+    job = job_service.enqueue("test.job", {"n": 1}, delay=timedelta(minutes=5))
+
+    inserted = jobs.insert_one.call_args[0][0]
+    assert inserted is job
+    assert job["status"] == "pending" and job["attempts"] == 0
+    assert job["run_after"] - job["created_at"] == timedelta(minutes=5)
+
+
+def test_enqueue_rejects_unknown_types(jobs, job_types):
+    with pytest.raises(ValueError):
+        job_service.enqueue("nope")
+    jobs.insert_one.assert_not_called()
+
+
+def test_claim_takes_over_expired_leases_first(jobs, job_types):
+    job_types("test.job")
+    expired = _job()
+    jobs.find_one_and_update.return_value = expired
+
+    assert job_service.claim("worker-2") is expired
+
+    query, update = jobs.find_one_and_update.call_args[0]
+    assert query["status"] == "running" and "$lt" in query["lease_until"]
+    assert update["$set"]["lease_owner"] == "worker-2"
+    assert "slot" not in update["$set"]
+
+
+def test_claim_takes_the_first_free_slot(jobs, job_types):
+    job_types("test.job", concurrency=3)
+    claimed = _job()
+    jobs.find_one_and_update.side_effect = [None, DuplicateKeyError("slot 0"), claimed]
+
+    assert job_service.claim("worker-1") is claimed
+
+    query, update = jobs.find_one_and_update.call_args[0]
+    assert query["status"] == "pending"
+    assert update["$set"]["slot"] == 1 and update["$set"]["status"] == "running"
+    assert update["$inc"] == {"attempts": 1}
+
+
+def test_claim_respects_the_concurrency_limit(jobs, job_types):
+    job_types("test.job", concurrency=2)
+    jobs.find_one_and_update.side_effect = [None, DuplicateKeyError("0"), DuplicateKeyError("1")]
+
+    assert job_service.claim("worker-1") is None
+    assert jobs.find_one_and_update.call_count == 3
+
+
+def test_claim_only_looks_at_the_requested_types(jobs, job_types):
+    job_types("test.job")
+    job_types("other.job")
+
+    job_service.claim("worker-1", ["other.job"])
+
+    assert {c[0][0]["type"] for c in jobs.find_one_and_update.call_args_list} == {"other.job"}
+
+
+def test_run_stores_the_handler_result(jobs, job_types):
+    handler = job_types("test.job")
+    job = _job()
+
+    job_service.run(job, "worker-1")
+
+    handler.assert_called_once_with({"n": 1})
+    query, update = jobs.update_one.call_args[0]
+    assert query == {"_id": job["_id"], "lease_owner": "worker-1"}
+    assert update["$set"]["status"] == "done" and update["$set"]["result"] == {"ok": True}
+    assert "slot" in update["$unset"]
+
+
+def test_failure_is_retried_with_backoff(jobs, job_types):
+    job_types("test.job", MagicMock(side_effect=RuntimeError("boom")))
+
+    job_service.run(_job(attempts=2), "worker-1")
+
+    update = jobs.update_one.call_args[0][1]
+    assert update["$set"]["status"] == "pending" and update["$set"]["error"] == "boom"
+    delay = update["$set"]["run_after"] - update["$set"]["updated_at"]
+    assert delay == job_service.RETRY_BACKOFF * 2
+    assert update["$unset"] == {"slot": "", "lease_owner": "", "lease_until": ""}
+
+
+def test_failure_gives_up_after_the_type_limit(jobs, job_types):
+    job_types("test.job", MagicMock(side_effect=RuntimeError("boom")), max_attempts=2)
+
+    job_service.run(_job(attempts=2), "worker-1")
+
+    update = jobs.update_one.call_args[0][1]
+    assert update["$set"]["status"] == "failed" and "finished_at" in update["$set"]
+
+
+def test_interrupted_job_is_handed_back_without_using_an_attempt(jobs, job_types):
+    job_types("test.job", MagicMock(side_effect=job_service.Interrupted()))
+
+    job_service.run(_job(attempts=3), "worker-1")
+
+    update = jobs.update_one.call_args[0][1]
+    assert update["$set"]["status"] == "pending" and update["$inc"] == {"attempts": -1}
+    assert "error" not in update["$set"]
+
+
+def test_jobs_without_a_handler_fail(jobs, job_types):
+    job_service.run(_job("gone.job"), "worker-1")
+
+    assert jobs.update_one.call_args[0][1]["$set"]["status"] == "failed"
+
+
+def test_stats_report_depth_and_latency(jobs, job_types):
+    job_types("test.job")
+    job_types("idle.job")
+    now = datetime.now(timezone.utc)
+    jobs.aggregate.side_effect = [
+        [
+            {
+                "_id": {"type": "test.job", "status": "pending"},
+                "count": 3,
+                "due": 2,
+                "oldest_due": (now - timedelta(seconds=30)).replace(tzinfo=None),
+            },
+            {"_id": {"type": "test.job", "status": "running"}, "count": 1, "due": 1},
+        ],
+        [{"_id": "test.job", "count": 4, "latency_ms": 1500, "duration_ms": 250}],
+    ]
+
+    stats = job_service.stats(now)
+
+    assert [entry["type"] for entry in stats] == ["idle.job", "test.job"]
+    test_job = stats[1]
+    assert (test_job["pending"], test_job["due"], test_job["running"]) == (3, 2, 1)
+    assert test_job["oldest_due_seconds"] == pytest.approx(30)
+    assert test_job["latency_seconds"] == 1.5 and test_job["duration_seconds"] == 0.25
+    assert stats[0]["pending"] == 0 and stats[0]["latency_seconds"] is None
+
+
+def test_periodic_job_is_queued_once_per_period(jobs, job_types):
+    job_types("test.job", every=timedelta(hours=1))
+    job_types("other.job")
+    jobs.count_documents.return_value = 0
+    now = datetime(2026, 1, 1, 10, 25, tzinfo=timezone.utc)
+
+    job_service.schedule_periodic(now=now)
+
+    job = jobs.insert_one.call_args[0][0]
+    assert job["_id"] == "test.job@2026-01-01T10:00:00+00:00"
+    assert job["run_after"] == datetime(2026, 1, 1, 10, tzinfo=timezone.utc)
+    assert jobs.insert_one.call_count == 1
+
+    # Another worker got there first
+    jobs.insert_one.side_effect = DuplicateKeyError("taken")
+    job_service.schedule_periodic(now=now)
+
+
+def test_periodic_job_waits_for_the_queued_one(jobs, job_types):
+    job_types("test.job", every=timedelta(hours=1))
+    jobs.count_documents.return_value = 1
+
+    job_service.schedule_periodic()
+
+    jobs.insert_one.assert_not_called()
+
+
+def test_worker_runs_claimed_jobs_up_to_its_concurrency(mocker):
+    claimed = [_job(), _job(), _job()]
+    claim = mocker.patch.object(job_service, "claim", side_effect=claimed + [None] * 10)
+    mocker.patch.object(job_service, "schedule_periodic")
+    ran = []
+    mocker.patch.object(job_service, "run", side_effect=lambda job, worker_id: ran.append(job))
+
+    async def scenario():
+        worker = job_service.JobWorker(concurrency=2, interval=0.01)
+        worker.start()
+        await asyncio.sleep(0.1)
+        await worker.stop()
+
+    asyncio.run(scenario())
+
+    # Jobs run side by side, so they may finish in any order
+    assert sorted(job["_id"] for job in ran) == sorted(job["_id"] for job in claimed)
+    assert claim.call_count >= 3
+    assert job_service.stopping()
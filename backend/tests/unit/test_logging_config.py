@@ -0,0 +1,50 @@
+import json
+import logging
+from fastapi.testclient import TestClient
+from main import app
+import request_context
+from logging_config import JsonFormatter, RequestContextFilter, SamplingFilter
+
+client = TestClient(app)
+
+
+def _record(level=logging.INFO, **extra):
+    record = logging.LogRecord("test", level, __file__, 1, "hello %s", ("world",), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_request_context_and_extra():
+    token = request_context.bind_request_id("abc123")
+    try:
+        record = _record(team_id="t1")
+        RequestContextFilter().filter(record)
+    finally:
+        request_context.reset_request_id(token)
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "hello world"
+    assert entry["level"] == "INFO"
+    assert entry["request_id"] == "abc123"
+    assert entry["team_id"] == "t1"
+
+
+def test_sampling_filter_only_drops_debug():
+    sampler = SamplingFilter(rate=0)
+
+    assert sampler.filter(_record(logging.INFO)) is True
+    assert sampler.filter(_record(logging.DEBUG)) is False
+    assert sampler.filter(_record(logging.DEBUG, sample_rate=1.0)) is True
+
+
+def test_request_id_is_propagated_to_response():
+    response = client.get("/health", headers={"X-Request-ID": "from-proxy"})
+
+    assert response.headers["X-Request-ID"] == "from-proxy"
+
+
+def test_request_id_is_generated_when_missing():
+    response = client.get("/health")
+
+    assert len(response.headers["X-Request-ID"]) == 32
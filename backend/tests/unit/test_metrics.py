@@ -0,0 +1,73 @@
+import pytest
+from fastapi.testclient import TestClient
+from main import app
+import metrics
+
+client = TestClient(app)
+
+
+def test_counter_renders_labels():
+    counter = metrics.Counter("test_total", "Test counter.", ("route",))
+    counter.inc(route="/a")
+    counter.inc(2, route="/a")
+
+    lines = counter.render()
+
+    assert "# TYPE test_total counter" in lines
+    assert 'test_total{route="/a"} 3' in lines
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test histogram.", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    lines = histogram.render()
+
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1"} 2' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 3' in lines
+    assert "test_seconds_count 3" in lines
+
+
+def test_gauge_remove_drops_series():
+    gauge = metrics.Gauge("test_connections", "Test gauge.", ("team_id",))
+    gauge.inc(team_id="t1")
+    gauge.remove(team_id="t1")
+
+    assert gauge.render() == gauge.header()
+
+
+def test_metrics_endpoint_requires_authentication(monkeypatch):
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+
+    assert client.get("/metrics").status_code == 401
+
+
+def test_metrics_endpoint_rejects_wrong_scrape_token(monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "scrape-secret")
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer nope"})
+
+    assert response.status_code == 401
+
+
+def test_metrics_endpoint_records_route_template(monkeypatch):
+    monkeypatch.setenv("METRICS_TOKEN", "scrape-secret")
+    client.get("/health")
+
+    response = client.get(
+        "/metrics", headers={"Authorization": "Bearer scrape-secret"}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'projektor_http_requests_total{method="GET",route="/health",status="200"}'
+        in response.text
+    )
+
+
+def test_websocket_gauge_has_no_team_label():
+    assert metrics.websocket_connections.labelnames == ()
@@ -0,0 +1,33 @@
+from bson import ObjectId
+from pagination import id_match, page_query, parse_fields, projection_for
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields("") is None
+    assert parse_fields("name, url,,") == ["name", "url"]
+
+
+def test_projection_for_all_fields_only_excludes():
+    assert projection_for(None) is None
+    assert projection_for(None, excluded=("password",)) == {"password": 0}
+
+
+def test_projection_for_selection_adds_required_and_drops_excluded():
+    projection = projection_for(["url", "password"], required=("name",), excluded=("password",))
+
+    assert projection == {"_id": 1, "name": 1, "url": 1}
+
+
+def test_page_query_continues_after_cursor():
+    after = ObjectId()
+
+    assert page_query({"role": "student"}, after) == {"role": "student", "_id": {"$gt": after}}
+    assert page_query({"role": "student"}) == {"role": "student"}
+
+
+def test_id_match_accepts_both_representations():
+    value = ObjectId()
+
+    assert id_match(str(value)) == {"$in": [str(value), value]}
+    assert id_match("not-an-id") == {"$eq": "not-an-id"}
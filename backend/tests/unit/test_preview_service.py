@@ -0,0 +1,121 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
+
+import pytest
+
+from services import preview_service
+from storage import LocalStorage
+
+SHA = "ab" * 32
+
+
+@pytest.fixture
+def collections(mocker):
+    blobs = mocker.patch('services.preview_service._blobs_collection')
+    teams = mocker.patch('services.preview_service._teams_collection')
+    return blobs, teams
+
+
+@pytest.fixture
+def renderers(mocker):
+    mocker.patch.object(preview_service, "Image", MagicMock())
+    mocker.patch.object(preview_service, "pypdfium2", MagicMock())
+
+
+def test_preview_kind_by_extension(renderers):
+    assert preview_service.preview_kind("Photo.PNG") == "image"
+    assert preview_service.preview_kind("report.pdf") == "pdf"
+    assert preview_service.preview_kind("notes.docx") is None
+
+
+def test_no_previews_without_pillow(mocker):
+    mocker.patch.object(preview_service, "Image", None)
+
+    assert preview_service.preview_kind("photo.png") is None
+
+
+def test_claim_skips_huge_sources_and_takes_over_stale_claims(collections):
+    blobs, _ = collections
+    blobs.update_one.return_value = MagicMock(modified_count=1)
+
+    assert not preview_service.claim(SHA, preview_service.PREVIEW_MAX_SOURCE_BYTES + 1)
+    assert preview_service.claim(SHA, 10)
+
+    query, update = blobs.update_one.call_args[0]
+    assert {"preview": {"$exists": False}} in query["$or"]
+    assert query["$or"][1]["preview"] == "pending"
+    assert update["$set"]["preview"] == "pending"
+
+
+def test_after_upload_reuses_a_rendered_preview(collections):
+    blobs, teams = collections
+    blobs.count_documents.return_value = 1
+
+    url = preview_service.after_upload("t1", "f1", SHA, "photo.png", 10)
+
+    assert url == "/student/files/f1/preview"
+    query, update = teams.update_one.call_args[0]
+    assert query == {"_id": "t1", "files._id": "f1"}
+    assert update["$set"]["files.$.preview_url"] == url
+
+
+def test_after_upload_schedules_new_content(mocker, collections):
+    blobs, teams = collections
+    blobs.count_documents.return_value = 0
+    schedule = mocker.patch.object(preview_service, "schedule")
+
+    assert preview_service.after_upload("t1", "f1", SHA, "photo.png", 10) is None
+    schedule.assert_called_once_with(SHA, "photo.png", 10)
+    teams.update_one.assert_not_called()
+
+
+def test_schedule_queues_a_job_for_claimed_content(mocker, collections, renderers):
+    blobs, _ = collections
+    blobs.update_one.return_value.modified_count = 1
+    enqueue = mocker.patch.object(preview_service.job_service, "enqueue")
+
+    preview_service.schedule(SHA, "photo.png", 10)
+
+    enqueue.assert_called_once_with(preview_service.PREVIEW_JOB, {"sha256": SHA, "kind": "image"})
+
+
+def test_generate_stores_preview_next_to_blob_and_publishes(mocker, tmp_path, collections):
+    blobs, teams = collections
+    store = LocalStorage(str(tmp_path))
+    mocker.patch.object(preview_service, "get_storage", return_value=store)
+    mocker.patch.object(preview_service.blob_service, "TEMP_DIR", str(tmp_path / "tmp"))
+    mocker.patch.object(preview_service, "_get_executor", return_value=ThreadPoolExecutor(1))
+    render = mocker.patch.object(preview_service, "render_preview", return_value=b"jpeg")
+
+    preview_service.generate(SHA, "image")
+
+    assert render.call_args[0] == (store.path(preview_service.blob_service.blob_key(SHA)), "image")
+    assert (tmp_path / "blobs" / "ab" / "ab" / f"{SHA}.preview.jpg").read_bytes() == b"jpeg"
+    assert blobs.update_one.call_args[0][1]["$set"] == {"preview": "ready"}
+    query, pipeline = teams.update_many.call_args[0]
+    assert query == {"files.sha256": SHA}
+    assert "$$NOW" in str(pipeline[-1])
+
+
+def test_failed_render_is_recorded(mocker, tmp_path, collections):
+    blobs, teams = collections
+    mocker.patch.object(preview_service, "get_storage", return_value=LocalStorage(str(tmp_path)))
+    mocker.patch.object(preview_service, "_get_executor", return_value=ThreadPoolExecutor(1))
+    mocker.patch.object(preview_service, "render_preview", side_effect=OSError("truncated"))
+
+    preview_service.generate(SHA, "pdf")
+
+    assert blobs.update_one.call_args[0][1]["$set"] == {"preview": "failed"}
+    teams.update_many.assert_not_called()
+
+
+def test_render_image_thumbnail(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    source = tmp_path / "photo.png"
+    Image.new("RGBA", (1600, 900), (255, 0, 0, 128)).save(source)
+
+    preview = Image.open(io.BytesIO(preview_service.render_preview(str(source), "image", 320)))
+
+    assert preview.format == "JPEG"
+    assert preview.size == (320, 180)
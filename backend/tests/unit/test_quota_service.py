@@ -0,0 +1,153 @@
+import pytest
+from unittest.mock import MagicMock
+from bson import ObjectId
+from services import quota_service
+from storage import LocalStorage
+
+
+@pytest.fixture
+def collections(mocker):
+    teams = mocker.patch('services.quota_service._teams_collection')
+    competitions = mocker.patch('services.quota_service._competitions_collection')
+    schools = mocker.patch('services.quota_service._schools_collection')
+    sessions = mocker.patch('services.quota_service._sessions_collection')
+    sessions.aggregate.return_value = []
+    return teams, competitions, schools
+
+
+def test_reserve_is_a_single_guarded_increment(collections):
+    teams, competitions, schools = collections
+    team_id = ObjectId()
+    teams.update_one.return_value = MagicMock(modified_count=1)
+    teams.find_one.return_value = None  # no competition, so no school rollup
+
+    assert quota_service.reserve_team_storage(team_id, 10, limit=100)
+
+    query, update = teams.update_one.call_args[0]
+    assert query == {"_id": team_id, "storage_used": {"$lte": 90}}
+    assert update["$inc"] == {"storage_used": 10, "version": 1}
+
+
+def test_reserve_over_quota_reserves_nothing(collections):
+    teams, competitions, schools = collections
+    # Guarded increment and backfill both match nothing: counter exists and is too high
+    teams.update_one.return_value = MagicMock(modified_count=0)
+
+    assert not quota_service.reserve_team_storage(ObjectId(), 10, limit=100)
+    schools.update_one.assert_not_called()
+
+
+def test_school_over_quota_gives_team_reservation_back(mocker, collections):
+    teams, competitions, schools = collections
+    mocker.patch.object(quota_service, "SCHOOL_STORAGE_LIMIT", 50)
+    team_id = ObjectId()
+    teams.update_one.return_value = MagicMock(modified_count=1)
+    teams.find_one.return_value = {"_id": team_id, "competition_id": str(ObjectId())}
+    competitions.find_one.return_value = {"school_id": str(ObjectId())}
+    schools.update_one.return_value = MagicMock(modified_count=0)
+    schools.count_documents.return_value = 1
+
+    assert not quota_service.reserve_team_storage(team_id, 10, limit=100)
+    assert teams.update_one.call_args[0][1]["$inc"] == {"storage_used": -10, "version": 1}
+
+
+def test_reconcile_recomputes_from_disk(tmp_path, collections):
+    teams, competitions, schools = collections
+    school_id, competition_id, team_id = ObjectId(), ObjectId(), ObjectId()
+    (tmp_path / "f1_report.pdf").write_bytes(b"x" * 7)
+    (tmp_path / str(team_id)).mkdir()
+    (tmp_path / str(team_id) / "abc.png").write_bytes(b"x" * 5)
+    competitions.find.return_value = [{"_id": competition_id, "school_id": str(school_id)}]
+    teams.find.return_value = [
+        {
+            "_id": team_id,
+            "competition_id": str(competition_id),
+            "storage_used": 100,
+            "files": [
+                {"_id": "f1"},
+                {"id": "x", "url": f"/api/teams/{team_id}/files/abc.png"},
+                {"_id": "missing"},
+            ],
+        }
+    ]
+    schools.find.return_value = [{"_id": school_id}]
+
+    report = quota_service.reconcile_storage(upload_dir=str(tmp_path))
+
+    assert report["teams_corrected"] == [{"team_id": str(team_id), "recorded": 100, "actual": 12}]
+    assert report["schools_corrected"] == [{"school_id": str(school_id), "recorded": None, "actual": 12}]
+    for collection, document_id in ((teams, team_id), (schools, school_id)):
+        query, update = collection.update_one.call_args[0]
+        assert query == {"_id": document_id}
+        assert update["$set"]["storage_used"] == 12 and update["$inc"] == {"version": 1}
+
+
+def test_reconcile_sizes_blob_backed_files_from_the_store(tmp_path, collections):
+    teams, competitions, schools = collections
+    sha256 = "ab" * 32
+    blob_dir = tmp_path / "blobs" / sha256[:2] / sha256[2:4]
+    blob_dir.mkdir(parents=True)
+    (blob_dir / sha256).write_bytes(b"x" * 9)
+    competitions.find.return_value = []
+    team_ids = [ObjectId(), ObjectId()]
+    teams.find.return_value = [
+        {"_id": team_id, "storage_used": 0, "files": [{"_id": "f", "sha256": sha256}]}
+        for team_id in team_ids
+    ]
+    schools.find.return_value = []
+
+    report = quota_service.reconcile_storage(
+        str(tmp_path), dry_run=True, store=LocalStorage(str(tmp_path))
+    )
+
+    # Each team is charged for the shared file, the disk holds it once
+    assert [fix["actual"] for fix in report["teams_corrected"]] == [9, 9]
+    assert report["bytes_on_disk"] == 9
+
+
+def test_reconcile_keeps_space_reserved_by_open_upload_sessions(tmp_path, collections):
+    teams, competitions, schools = collections
+    sessions = quota_service._sessions_collection
+    team_id = ObjectId()
+    (tmp_path / "f1_report.pdf").write_bytes(b"x" * 7)
+    competitions.find.return_value = []
+    teams.find.return_value = [
+        {"_id": team_id, "storage_used": 7 + 40, "files": [{"_id": "f1"}]}
+    ]
+    schools.find.return_value = []
+    # Sessions still uploading to the team reserved their size when opened
+    sessions.aggregate.return_value = [{"_id": team_id, "size": 40}]
+
+    report = quota_service.reconcile_storage(upload_dir=str(tmp_path))
+
+    assert report["teams_corrected"] == []
+    teams.update_one.assert_not_called()
+
+
+def test_reconciliation_runs_later_and_stores_its_report(mocker):
+    runs = mocker.patch('services.quota_service._reconciliations_collection')
+    jobs = mocker.patch('services.job_service._jobs_collection')
+    mocker.patch.object(quota_service, "reconcile_storage", return_value={"teams_corrected": []})
+
+    run = quota_service.start_reconciliation(dry_run=True, requested_by="admin")
+    assert runs.insert_one.call_args[0][0]["status"] == "queued"
+    job = jobs.insert_one.call_args[0][0]
+    assert job["type"] == quota_service.RECONCILE_JOB
+    assert job["payload"] == {"run_id": str(run["_id"]), "dry_run": True}
+
+    quota_service._reconcile_job(job["payload"])
+
+    query, update = runs.update_one.call_args[0]
+    assert query == {"_id": run["_id"]}
+    assert update["$set"]["status"] == "done"
+    assert update["$set"]["report"] == {"teams_corrected": []}
+
+
+def test_failed_reconciliation_is_recorded(mocker):
+    runs = mocker.patch('services.quota_service._reconciliations_collection')
+    mocker.patch.object(quota_service, "reconcile_storage", side_effect=RuntimeError("disk gone"))
+
+    quota_service.run_reconciliation(ObjectId())
+
+    update = runs.update_one.call_args[0][1]
+    assert update["$set"]["status"] == "failed" and update["$set"]["error"] == "disk gone"
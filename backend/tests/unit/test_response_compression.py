@@ -0,0 +1,84 @@
+import gzip
+
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from response_compression import CompressionMiddleware, negotiate
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100, encodings=["gzip"])
+
+CHAT = [{"user_name": "Member", "message": f"message {i}"} for i in range(200)]
+
+
+@app.get("/chat")
+def chat():
+    return {"chat": CHAT}
+
+
+@app.get("/small")
+def small():
+    return {"ok": True}
+
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse(
+        (f'{{"row": {i}}}\n'.encode() for i in range(500)), media_type="application/x-ndjson"
+    )
+
+
+@app.get("/image")
+def image():
+    return Response(b"\x89PNG" + b"\0" * 4096, media_type="image/png")
+
+
+client = TestClient(app)
+
+
+def _raw(path):
+    # Read the undecoded body so the assertions see what went over the wire
+    with client.stream("GET", path, headers={"Accept-Encoding": "gzip"}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_negotiate_honours_q_values_and_server_preference():
+    assert negotiate("gzip, br, zstd", ["zstd", "br", "gzip"]) == "zstd"
+    assert negotiate("gzip;q=1, zstd;q=0.5", ["zstd", "gzip"]) == "gzip"
+    assert negotiate("*;q=0.1, zstd;q=0", ["zstd", "gzip"]) == "gzip"
+    assert negotiate("identity", ["gzip"]) is None
+    assert negotiate("", ["gzip"]) is None
+
+
+def test_large_json_is_compressed_with_exact_length():
+    response, body = _raw("/chat")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) == len(body)
+    assert b'"message 199"' in gzip.decompress(body)
+
+
+def test_small_and_binary_bodies_are_left_alone():
+    response, _ = _raw("/small")
+    assert "content-encoding" not in response.headers
+
+    response, body = _raw("/image")
+    assert "content-encoding" not in response.headers
+    assert body.startswith(b"\x89PNG")
+
+
+def test_streamed_bodies_are_compressed_incrementally():
+    response, body = _raw("/stream")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    lines = gzip.decompress(body).splitlines()
+    assert len(lines) == 500
+    assert lines[-1] == b'{"row": 499}'
+
+
+def test_no_compression_without_accept_encoding():
+    with client.stream("GET", "/chat", headers={"Accept-Encoding": "identity"}) as response:
+        assert "content-encoding" not in response.headers
@@ -0,0 +1,26 @@
+import json
+from datetime import datetime, timezone
+from bson import ObjectId
+from models import PydanticObjectId
+from responses import FastJSONResponse
+
+
+def test_fast_json_response_encodes_mongo_types():
+    oid = ObjectId()
+    created_at = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+    body = FastJSONResponse(
+        {"_id": oid, "created_at": created_at, "chat": [{"_id": PydanticObjectId(oid)}]}
+    ).body
+
+    assert json.loads(body) == {
+        "_id": str(oid),
+        "created_at": "2025-01-02T03:04:05+00:00",
+        "chat": [{"_id": str(oid)}],
+    }
+
+
+def test_fast_json_response_sets_content_type():
+    response = FastJSONResponse([])
+
+    assert response.headers["content-type"] == "application/json"
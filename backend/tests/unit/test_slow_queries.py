@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+from slow_queries import SlowQueryListener, filter_shape, summarize_plan
+
+
+def _started(command_name, command, request_id=1):
+    return SimpleNamespace(
+        command_name=command_name,
+        command=command,
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+        database_name="projektor",
+    )
+
+
+def _succeeded(command_name, duration_micros, request_id=1):
+    return SimpleNamespace(
+        command_name=command_name,
+        connection_id=("localhost", 27017),
+        request_id=request_id,
+        database_name="projektor",
+        duration_micros=duration_micros,
+    )
+
+
+def test_filter_shape_hides_values():
+    shape = filter_shape(
+        {"competition_id": "abc", "members.user_id": {"$in": ["a", "b"]}, "n": 3}
+    )
+
+    assert shape == {
+        "competition_id": "str",
+        "members.user_id": {"$in": ["str"]},
+        "n": "int",
+    }
+
+
+def test_summarize_plan_detects_collection_scan():
+    plan = summarize_plan(
+        {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "COLLSCAN"}}}}
+    )
+
+    assert plan["collection_scan"] is True
+    assert plan["index_used"] is False
+
+
+def test_summarize_plan_detects_index():
+    plan = summarize_plan(
+        {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}}
+    )
+
+    assert plan["index_used"] is True
+
+
+def test_fast_commands_are_not_logged(mocker):
+    logger = mocker.patch("slow_queries.logger")
+    listener = SlowQueryListener(threshold_ms=100, explain_sample_rate=0)
+
+    listener.started(_started("find", {"find": "teams", "filter": {"name": "x"}}))
+    listener.succeeded(_succeeded("find", duration_micros=5_000))
+
+    logger.warning.assert_not_called()
+
+
+def test_slow_commands_are_logged_with_shape(mocker):
+    logger = mocker.patch("slow_queries.logger")
+    listener = SlowQueryListener(threshold_ms=100, explain_sample_rate=0)
+
+    listener.started(_started("find", {"find": "teams", "filter": {"name": "x"}}))
+    listener.succeeded(_succeeded("find", duration_micros=250_000))
+
+    logger.warning.assert_called_once()
+    logged = logger.warning.call_args[0][1]
+    assert '"collection": "teams"' in logged
+    assert '"filter_shape": {"name": "str"}' in logged
+    assert '"x"' not in logged
+
+
+def test_admin_commands_are_ignored(mocker):
+    logger = mocker.patch("slow_queries.logger")
+    listener = SlowQueryListener(threshold_ms=0, explain_sample_rate=0)
+
+    listener.started(_started("ping", {"ping": 1}))
+    listener.succeeded(_succeeded("ping", duration_micros=250_000))
+
+    logger.warning.assert_not_called()
@@ -0,0 +1,121 @@
+import pytest
+from urllib.parse import parse_qs, urlencode, urlparse
+from file_serving import content_disposition
+from storage import LocalStorage, S3Storage
+
+
+class _ClientError(Exception):
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    """In-memory stand-in for an S3-compatible endpoint such as MinIO."""
+
+    class exceptions:
+        ClientError = _ClientError
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key):
+        with open(filename, "rb") as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise _ClientError("404")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix, StartAfter=""):
+                keys = sorted(k for b, k in client.objects if b == Bucket and k.startswith(Prefix))
+                yield {"Contents": [{"Key": k} for k in keys if k > StartAfter]}
+
+        return Paginator()
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        query = urlencode(
+            {"X-Amz-Expires": ExpiresIn, **{k: v for k, v in Params.items() if k not in ("Bucket", "Key")}}
+        )
+        return f"http://minio:9000/{Params['Bucket']}/{Params['Key']}?{query}"
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "upload.tmp"
+    path.write_bytes(b"report body")
+    return str(path)
+
+
+def test_local_storage_round_trip(tmp_path, source):
+    store = LocalStorage(str(tmp_path / "uploads"))
+
+    store.put_file("blobs/ab/cd/abcd", source)
+
+    assert store.exists("blobs/ab/cd/abcd")
+    assert store.size("blobs/ab/cd/abcd") == 11
+    response = store.download_response("blobs/ab/cd/abcd", "report.pdf")
+    assert response.path == str(tmp_path / "uploads" / "blobs" / "ab" / "cd" / "abcd")
+    assert 'filename="report.pdf"' in response.headers["content-disposition"]
+
+    store.delete("blobs/ab/cd/abcd")
+    assert store.size("blobs/ab/cd/abcd") is None
+    assert store.download_response("blobs/ab/cd/abcd", "report.pdf") is None
+
+
+def test_local_storage_lists_keys_from_checkpoint(tmp_path):
+    store = LocalStorage(str(tmp_path))
+    for key in ("blobs/ab/cd/abcd", "blobs/ab/ef/abef", "blobs/cd/01/cd01", "other/x"):
+        (tmp_path / key).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / key).write_bytes(b"x")
+
+    assert list(store.keys("blobs")) == ["blobs/ab/cd/abcd", "blobs/ab/ef/abef", "blobs/cd/01/cd01"]
+    assert list(store.keys("blobs", "blobs/ab/cd/abcd")) == ["blobs/ab/ef/abef", "blobs/cd/01/cd01"]
+    assert list(store.keys("missing")) == []
+
+
+def test_s3_storage_uploads_and_removes_the_local_copy(source):
+    client = FakeS3Client()
+    store = S3Storage("projektor", client=client)
+
+    store.put_file("blobs/ab/cd/abcd", source)
+
+    assert client.objects[("projektor", "blobs/ab/cd/abcd")] == b"report body"
+    assert store.size("blobs/ab/cd/abcd") == 11
+    store.delete("blobs/ab/cd/abcd")
+    assert not store.exists("blobs/ab/cd/abcd")
+
+
+def test_s3_download_redirects_to_a_presigned_url():
+    store = S3Storage("projektor", client=FakeS3Client(), presign_seconds=60)
+
+    response = store.download_response("blobs/ab/cd/abcd", "raport końcowy.pdf")
+
+    assert response.status_code == 307
+    assert response.headers["cache-control"] == "private, no-store"
+    url = urlparse(response.headers["location"])
+    assert url.path == "/projektor/blobs/ab/cd/abcd"
+    query = parse_qs(url.query)
+    assert query["X-Amz-Expires"] == ["60"]
+    assert "filename*=UTF-8''raport%20ko%C5%84cowy.pdf" in query["ResponseContentDisposition"][0]
+
+
+def test_content_disposition_keeps_an_ascii_fallback():
+    assert content_disposition('a"b.pdf') == "attachment; filename=\"ab.pdf\"; filename*=UTF-8''a%22b.pdf"
+
+
+def test_s3_storage_lists_keys_from_checkpoint():
+    client = FakeS3Client()
+    client.objects = {("bucket", key): b"x" for key in ("blobs/a", "blobs/b", "blobsx/c")}
+    store = S3Storage("bucket", client=client)
+
+    assert list(store.keys("blobs")) == ["blobs/a", "blobs/b"]
+    assert list(store.keys("blobs", "blobs/a")) == ["blobs/b"]
@@ -1,12 +1,18 @@
 import pytest
 from unittest.mock import MagicMock
 from services import team_service
-from models import Team, PydanticObjectId
+from models import Team, PydanticObjectId, File
+from pymongo import ReturnDocument
 from datetime import datetime, timezone
 
 @pytest.fixture
 def mock_db_collection(mocker):
     mocker.patch('services.team_service.db') # Mock the db object
+    mocker.patch('services.competition_service._competitions_collection')
+    mocker.patch('services.competition_service._teams_collection')
+    mocker.patch('services.quota_service._teams_collection')
+    mocker.patch('services.quota_service._competitions_collection')
+    mocker.patch('services.quota_service._schools_collection')
     mock_collection = mocker.patch('services.team_service._teams_collection')
     return mock_collection
 
@@ -42,7 +48,7 @@ def test_get_team(mock_db_collection, sample_team_data):
     
     assert team.name == sample_team_data["name"]
     assert str(team.competition_id) == str(sample_team_data["competition_id"])
-    mock_db_collection.find_one.assert_called_once_with({"_id": sample_team_data["_id"]})
+    mock_db_collection.find_one.assert_called_once_with({"_id": sample_team_data["_id"]}, None)
 
 def test_get_team_not_found(mock_db_collection):
     mock_db_collection.find_one.return_value = None
@@ -61,71 +67,145 @@ def test_get_teams(mock_db_collection, sample_team_data):
     mock_db_collection.find.assert_called_once()
 
 def test_update_team(mock_db_collection, sample_team_data):
-    mock_db_collection.find_one.return_value = {**sample_team_data, "name": "Updated Team"}
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_db_collection.find_one_and_update.return_value = {**sample_team_data, "name": "Updated Team"}
     
     updated_team = team_service.update_team(sample_team_data["_id"], {"name": "Updated Team"})
     
     assert updated_team.name == "Updated Team"
-    mock_db_collection.update_one.assert_called_once()
+    mock_db_collection.find_one_and_update.assert_called_once()
+    mock_db_collection.find_one.assert_not_called()
+    mock_db_collection.update_one.assert_not_called()
 
 def test_update_team_not_found(mock_db_collection):
-    mock_db_collection.find_one.return_value = None
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=0)
+    mock_db_collection.find_one_and_update.return_value = None
     
     updated_team = team_service.update_team(PydanticObjectId(), {"name": "Non Existent"})
     
     assert updated_team is None
 
-def test_delete_team(mock_db_collection, sample_team_data):
-    mock_db_collection.delete_one.return_value = MagicMock(deleted_count=1)
+def test_delete_team(mocker, mock_db_collection, sample_team_data):
+    release = mocker.patch('services.competition_service.release_team_slot')
+    release_blob = mocker.patch('services.blob_service.release')
+    mock_db_collection.find_one_and_delete.return_value = {
+        "_id": sample_team_data["_id"],
+        "competition_id": sample_team_data["competition_id"],
+        "files": [{"sha256": "ab" * 32}, {}],
+    }
     
     result = team_service.delete_team(sample_team_data["_id"])
     
     assert result["deleted_count"] == 1
-    mock_db_collection.delete_one.assert_called_once_with({"_id": sample_team_data["_id"]})
+    mock_db_collection.find_one_and_delete.assert_called_once_with(
+        {"_id": sample_team_data["_id"]},
+        projection={"competition_id": 1, "storage_used": 1, "files.sha256": 1},
+    )
+    release.assert_called_once_with(sample_team_data["competition_id"])
+    # Legacy files without a hash hold no blob reference
+    assert [c.args for c in release_blob.call_args_list] == [("ab" * 32,), (None,)]
 
-def test_delete_team_not_found(mock_db_collection):
-    mock_db_collection.delete_one.return_value = MagicMock(deleted_count=0)
+def test_delete_team_not_found(mocker, mock_db_collection):
+    release = mocker.patch('services.competition_service.release_team_slot')
+    mock_db_collection.find_one_and_delete.return_value = None
     
     result = team_service.delete_team(PydanticObjectId())
     
     assert result["deleted_count"] == 0
+    release.assert_not_called()
 
 def test_add_member_to_team(mock_db_collection, sample_team_data):
     user_id = PydanticObjectId()
     user_name = "New Member"
     
-    # Mock find_one to return the team before and after update
-    mock_db_collection.find_one.side_effect = [
-        sample_team_data, # Before update
-        {**sample_team_data, "members": [*sample_team_data["members"], {"user_id": user_id, "name": user_name}]} # After update
-    ]
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_db_collection.find_one_and_update.return_value = {
+        **sample_team_data,
+        "members": [*sample_team_data["members"], {"user_id": user_id, "name": user_name}],
+    }
     
     updated_team = team_service.add_member_to_team(sample_team_data["_id"], user_id, user_name)
     
     assert len(updated_team.members) == len(sample_team_data["members"]) + 1
     assert str(updated_team.members[-1]["user_id"]) == str(user_id)
-    mock_db_collection.update_one.assert_called_once_with(
-        {"_id": sample_team_data["_id"]},
-        {"$push": {"members": {"user_id": user_id, "name": user_name}}}
-    )
+    args, kwargs = mock_db_collection.find_one_and_update.call_args
+    assert args[0] == {"_id": sample_team_data["_id"]}
+    assert args[1][:-1] == team_service.member_addition({"user_id": user_id, "name": user_name})
+    # Every write bumps the stamps used for ETags
+    assert "version" in args[1][-1]["$set"]
+    assert kwargs == {"projection": None, "return_document": ReturnDocument.AFTER}
 
 def test_remove_member_from_team(mock_db_collection, sample_team_data):
     member_to_remove_id = sample_team_data["members"][0]["user_id"]
     
-    # Mock find_one to return the team before and after update
-    mock_db_collection.find_one.side_effect = [
-        sample_team_data, # Before update
-        {**sample_team_data, "members": []} # After update
-    ]
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_db_collection.find_one_and_update.return_value = {**sample_team_data, "members": []}
     
     updated_team = team_service.remove_member_from_team(sample_team_data["_id"], member_to_remove_id)
     
     assert len(updated_team.members) == 0
-    mock_db_collection.update_one.assert_called_once_with(
-        {"_id": sample_team_data["_id"]},
-        {"$pull": {"members": {"user_id": member_to_remove_id}}}
+    args, kwargs = mock_db_collection.find_one_and_update.call_args
+    assert args[0] == {"_id": sample_team_data["_id"], "members.user_id": member_to_remove_id}
+    # Pipeline update: filter the member out, recount, then bump the ETag stamps
+    assert args[1][:-1] == team_service.member_removal(member_to_remove_id)
+    assert args[1][-1]["$set"]["updated_at"] == "$$NOW"
+    assert kwargs == {"projection": None, "return_document": ReturnDocument.AFTER}
+
+def test_add_file_uses_projection(mock_db_collection, sample_team_data):
+    mock_db_collection.find_one_and_update.return_value = sample_team_data
+    new_file = File(
+        user_id=PydanticObjectId(),
+        user_name="Member One",
+        filename="report.pdf",
+        url="/api/teams/x/files/report.pdf",
+        size=10,
     )
+
+    team_service.add_file(sample_team_data["_id"], new_file, projection=team_service.SUMMARY_PROJECTION)
+
+    _, kwargs = mock_db_collection.find_one_and_update.call_args
+    assert kwargs["projection"] == {"chat": 0, "files": 0}
+    mock_db_collection.find_one.assert_not_called()
+
+def test_join_team_enforces_limit_in_the_update(mock_db_collection):
+    team_id = PydanticObjectId()
+    member = {"user_id": "u2", "name": "Two"}
+    mock_db_collection.update_one.return_value = MagicMock(modified_count=1)
+
+    assert team_service.join_team(team_id, member, max_members=4)
+
+    query, update = mock_db_collection.update_one.call_args[0]
+    assert query == {"_id": team_id, "member_count": {"$lt": 4}, "members.user_id": {"$ne": "u2"}}
+    assert update["$push"] == {"members": member}
+    assert update["$inc"]["member_count"] == 1
+
+def test_join_team_full_team_is_rejected(mock_db_collection):
+    # Neither the guarded push nor the backfill matches: the counter exists and is at the limit
+    mock_db_collection.update_one.return_value = MagicMock(modified_count=0)
+
+    assert not team_service.join_team(PydanticObjectId(), {"user_id": "u2", "name": "Two"}, max_members=1)
+    assert mock_db_collection.update_one.call_count == 2
+
+def test_join_team_backfills_missing_counter_then_retries(mock_db_collection):
+    mock_db_collection.update_one.side_effect = [
+        MagicMock(modified_count=0),  # no member_count yet
+        MagicMock(modified_count=1),  # backfilled from the members array
+        MagicMock(modified_count=1),  # guarded push succeeds
+    ]
+
+    assert team_service.join_team(PydanticObjectId(), {"user_id": "u2", "name": "Two"}, max_members=4)
+    backfill_query = mock_db_collection.update_one.call_args_list[1][0][0]
+    assert backfill_query["member_count"] == {"$exists": False}
+
+def test_delete_file_pulls_by_record_id_and_returns_the_removed_record(mock_db_collection):
+    team_id = PydanticObjectId()
+    record = {"_id": "f1", "size": 10, "sha256": "ab" * 32}
+    mock_db_collection.find_one_and_update.return_value = {"_id": team_id, "files": [record]}
+
+    assert team_service.delete_file(team_id, "f1") == record
+
+    query, update = mock_db_collection.find_one_and_update.call_args[0]
+    assert query == {"_id": team_id, "files._id": {"$eq": "f1"}}
+    assert update["$pull"] == {"files": {"_id": {"$eq": "f1"}}}
+    assert mock_db_collection.find_one_and_update.call_args[1]["return_document"] == ReturnDocument.BEFORE
+
+def test_delete_file_already_gone_returns_none(mock_db_collection):
+    mock_db_collection.find_one_and_update.return_value = None
+
+    assert team_service.delete_file(PydanticObjectId(), "f1") is None
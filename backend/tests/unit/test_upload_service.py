@@ -0,0 +1,130 @@
+import asyncio
+import os
+import pytest
+from datetime import datetime, timezone
+from bson import ObjectId
+from services import upload_service
+
+
+@pytest.fixture
+def sessions(mocker, tmp_path):
+    mocker.patch.object(upload_service.blob_service, "TEMP_DIR", str(tmp_path))
+    return mocker.patch('services.upload_service._sessions_collection')
+
+
+@pytest.fixture
+def quota(mocker):
+    return mocker.patch('services.upload_service.quota_service')
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_create_reserves_the_declared_size(sessions, quota):
+    team_id = ObjectId()
+    quota.reserve_team_storage.return_value = True
+
+    session = upload_service.create_session(team_id, "u1", "Ann", "video.mp4", 90)
+
+    quota.reserve_team_storage.assert_called_once_with(team_id, 90)
+    assert session["received"] == 0
+    assert os.path.exists(session["path"])
+    sessions.insert_one.assert_called_once_with(session)
+
+
+def test_create_over_quota_opens_nothing(sessions, quota):
+    quota.reserve_team_storage.return_value = False
+
+    assert upload_service.create_session(ObjectId(), "u1", "Ann", "video.mp4", 90) is None
+    sessions.insert_one.assert_not_called()
+
+
+def test_claim_requires_the_acknowledged_offset_and_no_lease(sessions):
+    upload_id = ObjectId()
+
+    upload_service.claim_chunk(upload_id, "u1", 10)
+
+    query, update = sessions.find_one_and_update.call_args[0]
+    assert query["_id"] == upload_id
+    assert query["user_id"] == "u1"
+    assert query["received"] == 10
+    assert {"lease_until": {"$exists": False}} in query["$or"]
+    assert "lease_until" in update["$set"]
+
+
+def test_retried_chunk_overwrites_a_partial_write(tmp_path):
+    path = tmp_path / "upload"
+    # An interrupted attempt left 4 stray bytes after offset 3
+    path.write_bytes(b"abcXXXX")
+    session = {"path": str(path), "size": 6}
+
+    written = asyncio.run(upload_service.write_chunk(session, 3, _stream(b"de", b"f")))
+
+    assert written == 3
+    assert path.read_bytes() == b"abcdef"
+
+
+def test_chunk_is_written_in_buffered_pieces(tmp_path, mocker):
+    mocker.patch.object(upload_service, "WRITE_BUFFER_SIZE", 2)
+    path = tmp_path / "upload"
+    path.write_bytes(b"")
+    session = {"path": str(path), "size": 5}
+
+    written = asyncio.run(upload_service.write_chunk(session, 0, _stream(b"a", b"bc", b"de")))
+
+    assert written == 5
+    assert path.read_bytes() == b"abcde"
+
+
+def test_chunk_past_declared_size_is_rejected(tmp_path):
+    path = tmp_path / "upload"
+    path.write_bytes(b"")
+    session = {"path": str(path), "size": 4}
+
+    with pytest.raises(upload_service.ChunkTooLarge):
+        asyncio.run(upload_service.write_chunk(session, 0, _stream(b"abc", b"de")))
+
+
+def test_acknowledge_advances_offset_and_drops_lease(sessions):
+    session = {"_id": ObjectId()}
+
+    assert upload_service.acknowledge_chunk(session, 10, 5) == 15
+
+    query, update = sessions.update_one.call_args[0]
+    assert query == {"_id": session["_id"], "received": 10}
+    assert update["$set"]["received"] == 15
+    assert update["$unset"] == {"lease_until": ""}
+
+
+def test_expired_sessions_give_their_quota_back(sessions, quota, tmp_path):
+    team_id = ObjectId()
+    path = tmp_path / "upload-1"
+    path.write_bytes(b"partial")
+    sessions.find_one_and_delete.side_effect = [
+        {"_id": ObjectId(), "team_id": team_id, "size": 90, "path": str(path)},
+        None,
+    ]
+    now = datetime.now(timezone.utc)
+
+    assert upload_service.expire_sessions(now) == 1
+
+    assert sessions.find_one_and_delete.call_args[0][0]["expires_at"] == {"$lt": now}
+    quota.release_team_storage.assert_called_once_with(team_id, 90)
+    assert not path.exists()
+
+
+def test_abort_unknown_session(sessions, quota):
+    sessions.find_one_and_delete.return_value = None
+
+    assert not upload_service.abort(ObjectId(), "u1")
+    quota.release_team_storage.assert_not_called()
+
+
+def test_expiry_runs_as_a_periodic_job(mocker):
+    mocker.patch.object(upload_service, "expire_sessions", return_value=3)
+
+    assert upload_service._expire_job({}) == {"expired": 3}
+    job_type = upload_service.job_service.JOB_TYPES[upload_service.EXPIRY_JOB]
+    assert job_type.concurrency == 1 and job_type.every is not None
@@ -41,7 +41,7 @@ def test_get_user(mock_db_collection, sample_user_data):
     
     assert user.name == sample_user_data["name"]
     assert user.email == sample_user_data["email"]
-    mock_db_collection.find_one.assert_called_once_with({"_id": sample_user_data["_id"]})
+    mock_db_collection.find_one.assert_called_once_with({"_id": sample_user_data["_id"]}, {"password": 0})
 
 def test_get_user_not_found(mock_db_collection):
     mock_db_collection.find_one.return_value = None
@@ -60,33 +60,44 @@ def test_get_users(mock_db_collection, sample_user_data):
     mock_db_collection.find.assert_called_once()
 
 def test_update_user(mock_db_collection, sample_user_data):
-    mock_db_collection.find_one.return_value = {**sample_user_data, "name": "Updated User"}
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=1)
+    mock_db_collection.find_one_and_update.return_value = {**sample_user_data, "name": "Updated User"}
     
     updated_user = user_service.update_user(sample_user_data["_id"], {"name": "Updated User"})
     
     assert updated_user.name == "Updated User"
-    mock_db_collection.update_one.assert_called_once()
+    mock_db_collection.find_one_and_update.assert_called_once()
+    _, kwargs = mock_db_collection.find_one_and_update.call_args
+    assert kwargs["projection"] == {"password": 0}
+    mock_db_collection.find_one.assert_not_called()
 
 def test_update_user_not_found(mock_db_collection):
-    mock_db_collection.find_one.return_value = None
-    mock_db_collection.update_one.return_value = MagicMock(matched_count=0)
+    mock_db_collection.find_one_and_update.return_value = None
     
     updated_user = user_service.update_user(PydanticObjectId(), {"name": "Non Existent"})
     
     assert updated_user is None
 
-def test_delete_user(mock_db_collection, sample_user_data):
+def test_delete_user(mocker, mock_db_collection, sample_user_data):
+    deletions = mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
     mock_db_collection.delete_one.return_value = MagicMock(deleted_count=1)
     
-    result = user_service.delete_user(sample_user_data["_id"])
+    result = user_service.delete_user(sample_user_data["_id"], anonymize_messages=True)
     
     assert result["deleted_count"] == 1
     mock_db_collection.delete_one.assert_called_once_with({"_id": sample_user_data["_id"]})
+    queued = deletions.insert_one.call_args[0][0]
+    assert queued["kind"] == "user" and queued["target_id"] == str(sample_user_data["_id"])
+    assert queued["anonymize_messages"] is True
+    assert result["deletion_id"] == str(queued["_id"])
 
-def test_delete_user_not_found(mock_db_collection):
+def test_delete_user_not_found(mocker, mock_db_collection):
+    deletions = mocker.patch('services.cascade_service._deletions_collection')
+    mocker.patch('services.job_service._jobs_collection')
     mock_db_collection.delete_one.return_value = MagicMock(deleted_count=0)
     
     result = user_service.delete_user(PydanticObjectId())
     
     assert result["deleted_count"] == 0
+    assert result["deletion_id"] is None
+    deletions.delete_one.assert_called_once()